@@ -0,0 +1,76 @@
+"""
+Log Retention & Archive for Makar.id
+====================================
+Memindahkan partisi bulanan activity_logs / email_logs yang lebih tua dari
+LOG_RETENTION_MONTHS ke arsip gzip NDJSON di LOG_ARCHIVE_DIR, lalu menghapus
+partisinya dari database. Server juga menjalankan retensi ini sekali sehari;
+script ini untuk menjalankannya manual, mis. dari cron.
+
+Usage:
+  python3 archive_logs.py                                # Arsipkan partisi lama
+  python3 archive_logs.py --months 6                     # Retensi custom (bulan)
+  python3 archive_logs.py --status                       # Daftar partisi & statusnya
+  python3 archive_logs.py --migrate                      # Pindahkan log lama ke partisi bulanan
+  python3 archive_logs.py --rehydrate activity_logs 2025-03   # Muat ulang arsip untuk audit
+
+Environment variables yang diperlukan:
+  MONGO_URL        - MongoDB connection string
+  DB_NAME          - Nama database
+  LOG_ARCHIVE_DIR  - Folder arsip (default: backend/log_archive)
+"""
+
+import asyncio
+import logging
+import sys
+
+from fastapi import HTTPException
+
+from server import (
+    client, db, LOG_STORES, LOG_RETENTION_MONTHS, activity_log_store, archive_log_partitions,
+    migrate_legacy_logs, prepare_legacy_activity_log, rehydrate_log_partition
+)
+
+
+async def main():
+    if '--status' in sys.argv:
+        async for part in db.log_partitions.find({}).sort([("collection", 1), ("month", -1)]):
+            rows = f", {part['rows']} baris" if part.get("rows") is not None else ""
+            print(f"  {part['collection']:14} {part['month']}  {part['status']}{rows}")
+        return
+
+    if '--rehydrate' in sys.argv:
+        i = sys.argv.index('--rehydrate')
+        collection, month = sys.argv[i + 1], sys.argv[i + 2]
+        if collection not in LOG_STORES:
+            print(f"  ❌ Koleksi tidak dikenal: {collection}")
+            return
+        try:
+            rows = await rehydrate_log_partition(LOG_STORES[collection], month)
+        except HTTPException as e:
+            print(f"  ❌ {e.detail}")
+            return
+        print(f"  ✅ {rows} log {collection} {month} dimuat ulang")
+        return
+
+    if '--migrate' in sys.argv:
+        for store in LOG_STORES.values():
+            prepare = prepare_legacy_activity_log if store is activity_log_store else None
+            moved = await migrate_legacy_logs(store, prepare=prepare)
+            print(f"  ✅ {moved} {store.name} dipindahkan ke partisi bulanan")
+        return
+
+    months = LOG_RETENTION_MONTHS
+    if '--months' in sys.argv:
+        months = int(sys.argv[sys.argv.index('--months') + 1])
+
+    for store in LOG_STORES.values():
+        archived = await archive_log_partitions(store, months)
+        print(f"  ✅ {store.name}: {len(archived)} partisi diarsipkan {archived or ''}")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(main())
+    finally:
+        client.close()
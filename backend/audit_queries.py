@@ -0,0 +1,181 @@
+"""
+Query Plan Auditor for Makar.id
+===============================
+Menjalankan explain("executionStats") pada katalog bentuk query yang dipakai
+server.py (lookup session, lookup domain, absensi per tanggal, lamaran per
+perusahaan & status, dst.) terhadap database yang sudah di-seed, lalu menandai:
+  - COLLSCAN          : query tidak memakai index
+  - SORT              : sort dilakukan di memori, bukan lewat index
+  - SELECTIVITY       : dokumen yang diperiksa jauh lebih banyak dari hasilnya
+
+Nilai contoh (company_id, employee_id, dst.) diambil dari data yang ada, jadi
+jalankan setelah seed_db.py (idealnya dengan data sintetis dalam jumlah besar).
+
+Usage:
+  python3 audit_queries.py                 # Audit semua bentuk query
+  python3 audit_queries.py --json          # Output JSON (untuk CI)
+  python3 audit_queries.py --only attendance   # Hanya query yang namanya mengandung kata ini
+
+Exit code 1 jika ada query yang ditandai.
+
+Environment variables yang diperlukan:
+  MONGO_URL  - MongoDB connection string
+  DB_NAME    - Nama database
+"""
+
+import asyncio
+import json
+import sys
+from datetime import datetime
+
+from server import (
+    client, db, JAKARTA_TZ, activity_log_store, attendance_day, attendance_day_filter, current_log_month
+)
+
+# Flag when more than this many documents are examined per document returned
+SELECTIVITY_RATIO = 10
+SELECTIVITY_MIN_EXAMINED = 100
+
+
+async def load_samples() -> dict:
+    """Real ids from the database so explain() sees realistic selectivity"""
+    company = await db.companies.find_one({}, {"_id": 0, "id": 1, "domain": 1, "slug": 1}) or {}
+    employee = await db.employees.find_one({}, {"_id": 0, "id": 1, "email": 1}) or {}
+    job = await db.jobs.find_one({}, {"_id": 0, "id": 1}) or {}
+    session = await db.user_sessions.find_one({}, {"_id": 0, "session_token": 1}) or {}
+    today = datetime.now(JAKARTA_TZ).strftime("%Y-%m-%d")
+    return {
+        "company_id": company.get("id", "audit-company"),
+        "domain": company.get("domain", "audit.makar.id"),
+        "slug": company.get("slug", "audit"),
+        "employee_id": employee.get("id", "audit-employee"),
+        "email": employee.get("email", "audit@makar.id"),
+        "job_id": job.get("id", "audit-job"),
+        "session_token": session.get("session_token", "audit-token"),
+        "today": today,
+        "month": today[:7],
+    }
+
+
+def query_catalogue(s: dict) -> list:
+    """(name, collection, explain command body) for each query shape in server.py"""
+    find = lambda coll, flt, sort=None, limit=None: {
+        "find": coll, "filter": flt, **({"sort": sort} if sort else {}), **({"limit": limit} if limit else {})
+    }
+    logs = activity_log_store.partition(current_log_month())
+    return [
+        ("session lookup", find("user_sessions", {"session_token": s["session_token"]}, limit=1)),
+        ("company by id", find("companies", {"id": s["company_id"]}, limit=1)),
+        ("company by slug", find("companies", {"slug": s["slug"]}, limit=1)),
+        ("domain lookup", find("companies", {
+            "$or": [{"custom_domains.main": s["domain"]}, {"custom_domains.careers": s["domain"]},
+                    {"custom_domains.hr": s["domain"]}, {"custom_domains.team": s["domain"]},
+                    {"domain": s["domain"]}],
+            "is_active": True}, limit=1)),
+        ("public careers jobs", find("jobs", {"company_id": s["company_id"], "status": {"$in": ["published", "closed"]}},
+                                     {"created_at": -1}, 100)),
+        ("jobs by company", find("jobs", {"company_id": s["company_id"]}, {"created_at": -1}, 1000)),
+        ("job by id", find("jobs", {"id": s["job_id"]}, limit=1)),
+        ("applications by company", find("applications", {"company_id": s["company_id"], "deleted_at": {"$exists": False}},
+                                         {"created_at": -1}, 1000)),
+        ("applications by company and status", find("applications", {
+            "company_id": s["company_id"], "deleted_at": {"$exists": False}, "status": "pending"}, {"created_at": -1}, 1000)),
+        ("applications by job", find("applications", {
+            "company_id": s["company_id"], "deleted_at": {"$exists": False}, "job_id": s["job_id"]}, {"created_at": -1}, 1000)),
+        ("employee login by email", find("employees", {"email": s["email"]}, limit=1)),
+        ("employee by id", find("employees", {"id": s["employee_id"]}, limit=1)),
+        ("employees by company", find("employees", {
+            "companies": s["company_id"], "$or": [{"trashed": {"$ne": True}}, {"trashed": {"$exists": False}}]},
+            {"name": 1}, 1000)),
+        ("outlets by company", find("outlets", {"company_id": s["company_id"]})),
+        ("attendance today (clock)", find("attendance", {
+            "employee_id": s["employee_id"], "company_id": s["company_id"], "date": s["today"]}, limit=1)),
+        ("attendance by company and date", find("attendance", {
+            "company_id": s["company_id"], "employee_active": True, "day": attendance_day(s["today"])}, {"day": -1}, 100)),
+        ("attendance by company and month", find("attendance", {
+            "company_id": s["company_id"], "employee_active": True, "day": attendance_day_filter(None, s["month"])},
+            {"day": -1}, 100)),
+        ("attendance pending approval", find("attendance", {
+            "company_id": s["company_id"], "employee_removed": False,
+            "$or": [{"status": "pending_approval"}, {"pending_change": {"$ne": None, "$exists": True}}]},
+            {"day": -1}, 100)),
+        ("attendance delta sync", find("attendance", {"company_id": s["company_id"], "rev": {"$gt": 0}},
+                                       {"rev": 1, "id": 1}, 500)),
+        ("attendance summary", find("attendance_rollups", {"company_id": s["company_id"], "month": s["month"],
+                                                           "employee_active": True}, {"employee_name": 1})),
+        ("activity logs by company", find(logs, {"company_id": s["company_id"]}, {"timestamp": -1, "id": -1}, 50)),
+        ("activity logs search", find(logs, {"company_id": s["company_id"], "search_terms": {"$all": ["adm"]}},
+                                      {"timestamp": -1, "id": -1}, 50)),
+    ]
+
+
+def plan_stages(plan) -> list:
+    """Every stage in a (possibly nested) plan tree as (stage, indexName)"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append((plan["stage"], plan.get("indexName")))
+        for value in plan.values():
+            stages += plan_stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            stages += plan_stages(value)
+    return stages
+
+
+def audit(name: str, collection: str, explain: dict) -> dict:
+    planner = explain.get("queryPlanner", {})
+    stats = explain.get("executionStats", {})
+    stages = plan_stages(planner.get("winningPlan", {}))
+    names = [stage for stage, _ in stages]
+    examined = stats.get("totalDocsExamined", 0)
+    returned = stats.get("nReturned", 0)
+    flags = []
+    if "COLLSCAN" in names:
+        flags.append("COLLSCAN")
+    if "SORT" in names:
+        flags.append("SORT")
+    if examined >= SELECTIVITY_MIN_EXAMINED and examined > SELECTIVITY_RATIO * max(returned, 1):
+        flags.append("SELECTIVITY")
+    return {
+        "name": name,
+        "collection": collection,
+        "indexes": sorted({index for _, index in stages if index}),
+        "docs_examined": examined,
+        "keys_examined": stats.get("totalKeysExamined", 0),
+        "returned": returned,
+        "ms": stats.get("executionTimeMillis", 0),
+        "flags": flags,
+    }
+
+
+async def main():
+    samples = await load_samples()
+    only = sys.argv[sys.argv.index('--only') + 1] if '--only' in sys.argv else None
+    results = []
+    for name, command in query_catalogue(samples):
+        if only and only not in name:
+            continue
+        explain = await db.command("explain", command, verbosity="executionStats")
+        results.append(audit(name, command["find"], explain))
+
+    if '--json' in sys.argv:
+        print(json.dumps(results, indent=2))
+    else:
+        for r in results:
+            mark = "⚠️ " if r["flags"] else "✅"
+            index = ", ".join(r["indexes"]) or "-"
+            print(f"  {mark} {r['name']:38} {r['collection']:22} index: {index}")
+            print(f"      {r['docs_examined']} docs / {r['keys_examined']} keys diperiksa, "
+                  f"{r['returned']} hasil, {r['ms']} ms  {' '.join(r['flags'])}")
+        flagged = sum(1 for r in results if r["flags"])
+        print(f"\n  {flagged} dari {len(results)} query ditandai")
+    return 1 if any(r["flags"] for r in results) else 0
+
+
+if __name__ == '__main__':
+    try:
+        code = asyncio.run(main())
+    finally:
+        client.close()
+    sys.exit(code)
@@ -0,0 +1,291 @@
+"""
+Load Test Harness for Makar.id
+==============================
+Menjalankan skenario beban realistis terhadap API, lalu melaporkan latency
+p50/p95/p99 dan throughput per endpoint. Default-nya app dijalankan in-process
+(ASGI) terhadap MongoDB lokal; pakai --url untuk menguji uvicorn yang sedang
+berjalan. Jalankan pada database khusus load test yang sudah diisi data
+sintetis (seed_db.py --synthetic), JANGAN pada database produksi.
+
+Skenario:
+  clock-rush     Jam 08:00: ribuan karyawan clock-in bersamaan
+  careers-burst  Halaman karir diserbu setelah lowongan viral
+  apply          Pelamar submit lamaran + upload CV bersamaan
+  admin-export   Admin export data sementara admin lain bekerja
+
+Usage:
+  python3 loadtest.py                                   # Semua skenario, in-process
+  python3 loadtest.py --scenario clock-rush --employees 2000 --concurrency 200
+  python3 loadtest.py --url http://localhost:8001       # Uji server yang berjalan
+  python3 loadtest.py --reset-attendance                # Hapus absensi hari ini milik karyawan uji dulu
+  python3 loadtest.py --save-baseline main              # Simpan hasil sebagai baseline
+  python3 loadtest.py --compare main                    # Bandingkan dengan baseline (exit 1 jika regresi)
+
+Environment variables yang diperlukan:
+  MONGO_URL  - MongoDB connection string
+  DB_NAME    - Nama database (khusus load test)
+"""
+
+import asyncio
+import json
+import math
+import os
+import secrets
+import sys
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+
+import httpx
+
+from server import app, db, client, JAKARTA_TZ
+
+RESULTS_DIR = Path(__file__).parent / 'loadtest_results'
+SESSION_PREFIX = "loadtest-"
+REGRESSION_TOLERANCE = 0.2  # 20% slower p95 or lower throughput than baseline
+
+
+def arg(name: str, default=None, cast=str):
+    return cast(sys.argv[sys.argv.index(name) + 1]) if name in sys.argv else default
+
+
+class Recorder:
+    """Latencies and status codes per endpoint label"""
+
+    def __init__(self):
+        self.samples = {}
+
+    async def call(self, http: httpx.AsyncClient, label: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await http.request(method, url, **kwargs)
+            status = response.status_code
+        except httpx.HTTPError:
+            status = 0
+        entry = self.samples.setdefault(label, {"latencies": [], "statuses": {}})
+        entry["latencies"].append(time.perf_counter() - started)
+        entry["statuses"][status] = entry["statuses"].get(status, 0) + 1
+
+    def report(self, wall_seconds: float) -> dict:
+        report = {}
+        for label, entry in self.samples.items():
+            lat = sorted(entry["latencies"])
+            pct = lambda p: lat[max(0, math.ceil(p / 100 * len(lat)) - 1)] * 1000  # Nearest rank
+            report[label] = {
+                "requests": len(lat),
+                "errors": sum(n for status, n in entry["statuses"].items() if status == 0 or status >= 400),
+                "statuses": {str(k): v for k, v in sorted(entry["statuses"].items())},
+                "p50_ms": round(pct(50), 1),
+                "p95_ms": round(pct(95), 1),
+                "p99_ms": round(pct(99), 1),
+                "rps": round(len(lat) / wall_seconds, 1) if wall_seconds else 0,
+            }
+        return report
+
+
+async def gather_limited(concurrency: int, coros):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(coro):
+        async with semaphore:
+            await coro
+
+    await asyncio.gather(*(run(c) for c in coros))
+
+
+async def create_sessions(users: list, role: str) -> list:
+    """Insert sessions directly so scenarios start from logged-in users (as at 08:00)"""
+    now = datetime.now(timezone.utc)
+    docs = [{
+        "session_token": SESSION_PREFIX + secrets.token_urlsafe(24),
+        "user_id": u["id"], "email": u["email"], "name": u.get("name"), "picture": None,
+        "company_id": u["company_id"], "role": role,
+        "expires_at": (now + timedelta(hours=2)).isoformat(), "created_at": now.isoformat()
+    } for u in users]
+    if docs:
+        await db.user_sessions.insert_many(docs)
+    return [d["session_token"] for d in docs]
+
+
+# ============ SCENARIOS ============
+
+async def clock_rush(http, rec: Recorder, concurrency: int):
+    count = arg('--employees', 2000, int)
+    employees = await db.employees.find(
+        {"is_active": {"$ne": False}, "trashed": {"$ne": True}, "face_photo": {"$nin": [None, ""]}},
+        {"_id": 0, "id": 1, "email": 1, "name": 1, "companies": 1, "outlet_id": 1}
+    ).limit(count).to_list(count)
+    if not employees:
+        print("  ⚠️  Tidak ada karyawan dengan wajah terdaftar; jalankan seed_db.py --synthetic")
+        return
+    outlets = {o["id"]: o for o in await db.outlets.find({}, {"_id": 0, "id": 1, "latitude": 1, "longitude": 1}).to_list(None)}
+    for e in employees:
+        e["company_id"] = e["companies"][0]
+    if '--reset-attendance' in sys.argv:
+        today = datetime.now(JAKARTA_TZ).strftime("%Y-%m-%d")
+        await db.attendance.delete_many({"employee_id": {"$in": [e["id"] for e in employees]}, "date": today})
+    tokens = await create_sessions(employees, "employee")
+
+    def body(e):
+        outlet = outlets.get(e.get("outlet_id")) or {}
+        geo = {"lat": outlet["latitude"], "lng": outlet["longitude"], "acc": 15} if outlet.get("latitude") is not None else None
+        return {"action": "clock_in", "face_score": 0.92, "geo_location": geo}
+
+    print(f"  clock-rush: {len(employees)} karyawan clock-in")
+    await gather_limited(concurrency, [
+        rec.call(http, "POST /attendance/clock", "POST", "/api/attendance/clock",
+                 json=body(e), headers={"Authorization": f"Bearer {token}"})
+        for e, token in zip(employees, tokens)
+    ])
+
+
+async def careers_burst(http, rec: Recorder, concurrency: int):
+    visitors = arg('--visitors', 3000, int)
+    job = await db.jobs.find_one({"status": "published"}, {"_id": 0, "id": 1, "company_id": 1})
+    if not job:
+        print("  ⚠️  Tidak ada lowongan published")
+        return
+    company = await db.companies.find_one({"id": job["company_id"]}, {"_id": 0, "slug": 1, "domain": 1})
+    slug = company.get("slug") or company["domain"]
+    print(f"  careers-burst: {visitors} pengunjung ke /careers/{slug}")
+    calls = []
+    for _ in range(visitors):
+        calls += [
+            rec.call(http, "GET /public/company/{domain}", "GET", f"/api/public/company/{company['domain']}"),
+            rec.call(http, "GET /public/careers/{domain}/jobs", "GET", f"/api/public/careers/{slug}/jobs"),
+            rec.call(http, "GET /public/careers/{domain}/jobs/{job_id}", "GET", f"/api/public/careers/{slug}/jobs/{job['id']}"),
+        ]
+    await gather_limited(concurrency, calls)
+
+
+async def apply_burst(http, rec: Recorder, concurrency: int):
+    applicants = arg('--applicants', 500, int)
+    job = await db.jobs.find_one({"status": "published"}, {"_id": 0, "id": 1})
+    if not job:
+        print("  ⚠️  Tidak ada lowongan published")
+        return
+    run_id = uuid.uuid4().hex[:8]
+    cv = b"%PDF-1.4\n" + os.urandom(200 * 1024)  # ~200 KB CV
+    print(f"  apply: {applicants} pelamar dengan CV 200 KB")
+    await gather_limited(concurrency, [
+        rec.call(http, "POST /public/apply", "POST", "/api/public/apply",
+                 data={"job_id": job["id"], "form_data": json.dumps({
+                     "full_name": f"Load Test {i}", "email": f"loadtest+{run_id}-{i}@example.com", "phone": "081200000000"
+                 })},
+                 files={"resume": (f"cv-{i}.pdf", cv, "application/pdf")})
+        for i in range(applicants)
+    ])
+
+
+async def admin_export(http, rec: Recorder, concurrency: int):
+    admins = await db.company_admins.find({"is_active": {"$ne": False}}, {"_id": 0, "id": 1, "email": 1, "name": 1, "companies": 1}).to_list(50)
+    admins = [dict(a, company_id=a["companies"][0]) for a in admins if a.get("companies")]
+    if not admins:
+        print("  ⚠️  Tidak ada admin perusahaan")
+        return
+    tokens = await create_sessions(admins, "admin")
+    month = datetime.now(JAKARTA_TZ).strftime("%Y-%m")
+    rounds = arg('--rounds', 20, int)
+    print(f"  admin-export: {len(admins)} admin, {rounds} putaran export + kerja harian")
+    calls = []
+    for i in range(rounds):
+        for n, token in enumerate(tokens):
+            auth = {"Authorization": f"Bearer {token}"}
+            if n % 4 == 0:  # One in four admins exports, the rest keep working
+                calls += [
+                    rec.call(http, "GET /employees-session/export/excel", "GET", "/api/employees-session/export/excel", headers=auth),
+                    rec.call(http, "GET /logs/me/export", "GET", "/api/logs/me/export?format=csv", headers=auth),
+                ]
+            calls += [
+                rec.call(http, "GET /attendance/company", "GET", f"/api/attendance/company?month={month}&limit=200", headers=auth),
+                rec.call(http, "GET /applications-session", "GET", "/api/applications-session", headers=auth),
+                rec.call(http, "GET /employees-session", "GET", "/api/employees-session", headers=auth),
+                rec.call(http, "GET /attendance/summary", "GET", f"/api/attendance/summary?month={month}", headers=auth),
+            ]
+    await gather_limited(concurrency, calls)
+
+
+SCENARIOS = {
+    "clock-rush": clock_rush,
+    "careers-burst": careers_burst,
+    "apply": apply_burst,
+    "admin-export": admin_export,
+}
+
+
+# ============ REPORTING ============
+
+def print_report(name: str, report: dict, wall: float):
+    print(f"\n  === {name} ({wall:.1f}s) ===")
+    print(f"  {'endpoint':44} {'req':>6} {'err':>5} {'p50':>8} {'p95':>8} {'p99':>8} {'req/s':>7}")
+    for label, r in report.items():
+        print(f"  {label:44} {r['requests']:>6} {r['errors']:>5} {r['p50_ms']:>7.1f} {r['p95_ms']:>7.1f} {r['p99_ms']:>7.1f} {r['rps']:>7.1f}")
+
+
+def compare(results: dict, baseline: dict) -> list:
+    regressions = []
+    for scenario, report in results.items():
+        for label, r in report.items():
+            base = baseline.get(scenario, {}).get(label)
+            if not base:
+                continue
+            if r["p95_ms"] > base["p95_ms"] * (1 + REGRESSION_TOLERANCE):
+                regressions.append(f"{scenario} {label}: p95 {base['p95_ms']} -> {r['p95_ms']} ms")
+            if r["rps"] < base["rps"] * (1 - REGRESSION_TOLERANCE):
+                regressions.append(f"{scenario} {label}: {base['rps']} -> {r['rps']} req/s")
+    return regressions
+
+
+async def main():
+    url = arg('--url')
+    concurrency = arg('--concurrency', 100, int)
+    selected = [arg('--scenario')] if '--scenario' in sys.argv else list(SCENARIOS)
+    unknown = [s for s in selected if s not in SCENARIOS]
+    if unknown:
+        print(f"  ❌ Skenario tidak dikenal: {unknown}. Pilihan: {', '.join(SCENARIOS)}")
+        return 2
+
+    if url:
+        transport, base_url = None, url.rstrip('/')
+    else:
+        await app.router.startup()
+        transport, base_url = httpx.ASGITransport(app=app), "http://loadtest"
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    results = {}
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=120, limits=limits) as http:
+            for name in selected:
+                rec = Recorder()
+                started = time.perf_counter()
+                await SCENARIOS[name](http, rec, concurrency)
+                wall = time.perf_counter() - started
+                results[name] = rec.report(wall)
+                print_report(name, results[name], wall)
+    finally:
+        await db.user_sessions.delete_many({"session_token": {"$regex": f"^{SESSION_PREFIX}"}})
+        if not url:
+            await app.router.shutdown()
+
+    meta = {"run_at": datetime.now(timezone.utc).isoformat(), "mode": url or "asgi", "concurrency": concurrency}
+    if '--save-baseline' in sys.argv:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        path = RESULTS_DIR / f"{arg('--save-baseline')}.json"
+        path.write_text(json.dumps({"meta": meta, "results": results}, indent=2))
+        print(f"\n  ✅ Baseline disimpan ke {path}")
+    if '--compare' in sys.argv:
+        path = RESULTS_DIR / f"{arg('--compare')}.json"
+        regressions = compare(results, json.loads(path.read_text())["results"])
+        for line in regressions:
+            print(f"  ❌ {line}")
+        print(f"\n  {len(regressions)} regresi dibanding baseline {path.name}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    try:
+        code = asyncio.run(main())
+    finally:
+        client.close()
+    sys.exit(code)
@@ -0,0 +1,65 @@
+"""
+Attendance Date Migration for Makar.id
+======================================
+Mengisi field bertipe (day, <event>_min, work_minutes, break_minutes) pada
+data absensi lama yang hanya menyimpan tanggal & jam sebagai string, serta
+flag karyawan (employee_active, employee_removed) untuk filter absensi, dan
+rev awal (0) untuk delta sync pada karyawan, absensi & lamaran lama.
+scripts/deploy.sh menjalankan script ini sebelum restart backend. Server juga
+menjalankannya di background saat startup (untuk data yang ditulis versi lama
+selama deploy) dan /api/health/ready baru "ready" setelah migrasi selesai.
+
+Usage:
+  python3 migrate_attendance.py                # Migrasi dengan batch 1000
+  python3 migrate_attendance.py --batch 5000   # Ukuran batch custom
+  python3 migrate_attendance.py --status       # Cek jumlah data yang belum dimigrasi
+  python3 migrate_attendance.py --rollups      # Hitung ulang semua ringkasan bulanan
+
+Environment variables yang diperlukan:
+  MONGO_URL  - MongoDB connection string
+  DB_NAME    - Nama database
+"""
+
+import asyncio
+import logging
+import sys
+
+from server import (
+    SYNC_COLLECTIONS, client, db, migrate_attendance_dates, migrate_attendance_employee_flags,
+    migrate_sync_revs, rebuild_attendance_rollups,
+)
+
+
+async def main():
+    if '--status' in sys.argv:
+        pending = await db.attendance.count_documents({"day": {"$exists": False}})
+        no_flags = await db.attendance.count_documents({"employee_active": {"$exists": False}})
+        total = await db.attendance.count_documents({})
+        print(f"  Absensi: {total} total, {pending} belum dimigrasi, {no_flags} tanpa flag karyawan")
+        for name in SYNC_COLLECTIONS:
+            no_rev = await db[name].count_documents({"rev": {"$exists": False}})
+            print(f"  {name}: {no_rev} tanpa rev")
+        return
+
+    batch_size = 1000
+    if '--batch' in sys.argv:
+        batch_size = int(sys.argv[sys.argv.index('--batch') + 1])
+
+    revs = await migrate_sync_revs(db, batch_size)
+    print(f"  ✅ {revs} data diberi rev awal untuk delta sync")
+    migrated = await migrate_attendance_dates(db, batch_size)
+    print(f"  ✅ {migrated} data absensi dimigrasi")
+    employees = await migrate_attendance_employee_flags(db)
+    print(f"  ✅ Flag absensi {employees} karyawan diperbarui")
+
+    if '--rollups' in sys.argv:
+        companies = await rebuild_attendance_rollups(db)
+        print(f"  ✅ Ringkasan absensi {companies} perusahaan dihitung ulang")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(main())
+    finally:
+        client.close()
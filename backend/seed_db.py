@@ -8,6 +8,17 @@ Usage:
   python3 seed_db.py --force      # Hapus semua data lama & seed ulang
   python3 seed_db.py --status     # Cek status database saja
 
+Data sintetis skala besar (untuk load test, benchmark & audit_queries.py).
+Hasilnya identik untuk --seed dan --anchor yang sama:
+  python3 seed_db.py --synthetic                       # 3 perusahaan x 1000 karyawan, 1 tahun absensi
+  python3 seed_db.py --synthetic --companies 10 --employees 5000 --days 730 --applications 100000
+  python3 seed_db.py --synthetic --seed 7 --anchor 2026-06-30   # Seed & tanggal acuan tetap
+  python3 seed_db.py --synthetic --clear               # Hapus semua data sintetis
+
+  Opsi lain (per perusahaan): --outlets 10, --jobs 20, --logs 20000;
+  --uploads 200 (file foto wajah & CV bersama), --batch 1000, --parallel 4.
+  Login admin: admin@synthetic001.makar.id / Synthetic123!
+
 Environment variables yang diperlukan:
   MONGO_URL  - MongoDB connection string
   DB_NAME    - Nama database
@@ -16,7 +27,10 @@ Environment variables yang diperlukan:
 import asyncio
 import json
 import os
+import random
 import sys
+import uuid
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
@@ -116,8 +130,364 @@ async def seed_data(force=False):
     client.close()
 
 
+# ============ SYNTHETIC DATA ============
+# Every value is drawn from random.Random streams seeded with
+# "<seed>:<kind>:<company>", so one kind's volume (e.g. --logs) never shifts
+# another kind's data. Dates are offsets from --anchor (default: today).
+
+SYNTHETIC_PASSWORD = "Synthetic123!"
+SYNTHETIC_DOMAIN = "synthetic{:03d}.makar.id"
+SYNTHETIC_COLLECTIONS = [
+    'company_admins', 'outlets', 'divisions', 'employees', 'jobs', 'applications',
+    'attendance', 'attendance_rollups',
+]
+
+FIRST_NAMES = [
+    "Budi", "Siti", "Agus", "Dewi", "Andi", "Rina", "Joko", "Sri", "Hendra", "Wati", "Rudi", "Yuni",
+    "Eko", "Nur", "Dian", "Fajar", "Indah", "Bayu", "Lestari", "Rizky", "Putri", "Ahmad", "Ayu", "Dimas",
+]
+LAST_NAMES = [
+    "Santoso", "Wijaya", "Saputra", "Lestari", "Pratama", "Hidayat", "Kusuma", "Nugroho", "Siregar",
+    "Sari", "Setiawan", "Wibowo", "Gunawan", "Harahap", "Rahmawati", "Permana", "Simanjuntak", "Utami",
+]
+CITIES = [
+    ("DKI Jakarta", "Jakarta Selatan", -6.2615, 106.8106), ("DKI Jakarta", "Jakarta Timur", -6.2250, 106.9004),
+    ("Jawa Barat", "Bandung", -6.9175, 107.6191), ("Jawa Barat", "Bekasi", -6.2383, 106.9756),
+    ("Jawa Timur", "Surabaya", -7.2575, 112.7521), ("Jawa Tengah", "Semarang", -6.9667, 110.4167),
+    ("Sumatera Utara", "Medan", 3.5952, 98.6722), ("Bali", "Denpasar", -8.6705, 115.2126),
+]
+DIVISIONS = ["Operasional", "Penjualan", "Gudang", "Keuangan", "HRD", "IT", "Marketing", "Customer Service"]
+JOB_TITLES = [
+    "Sales Promotor", "Kasir", "Staff Gudang", "Admin Keuangan", "Customer Service", "Teknisi",
+    "Kepala Toko", "Driver", "Staff IT", "Digital Marketing",
+]
+EDUCATION = ["SMA/SMK", "D3", "S1", "S2"]
+MAJORS = ["Manajemen", "Akuntansi", "Teknik Informatika", "Ilmu Komunikasi", "Teknik Mesin", "IPA", "IPS"]
+APPLICATION_STATUSES = ["pending"] * 5 + ["reviewing"] * 2 + ["shortlisted", "interviewed", "offered", "hired"] + ["rejected"] * 3
+LOG_ACTIONS = [
+    ("login", "auth", "Login ke sistem"), ("update", "application", "Mengubah status lamaran"),
+    ("create", "employee", "Menambahkan karyawan"), ("update", "employee", "Mengubah data karyawan"),
+    ("create", "job", "Membuat lowongan baru"), ("approve", "attendance", "Menyetujui absensi"),
+    ("export", "application", "Export data lamaran"),
+]
+
+
+def synthetic_rng(seed: int, kind: str, index: int) -> random.Random:
+    return random.Random(f"{seed}:{kind}:{index}")
+
+
+def synthetic_id(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+class BulkInserter:
+    """Buffers documents per collection; full batches are written with up to `parallel` insert_many in flight"""
+
+    def __init__(self, db, batch_size: int, parallel: int, writers: dict = None):
+        self.db = db
+        self.batch_size = batch_size
+        self.slots = asyncio.Semaphore(parallel)
+        self.writers = writers or {}
+        self.buffers = {}
+        self.tasks = []
+        self.counts = {}
+
+    async def add(self, name: str, doc: dict):
+        buffer = self.buffers.setdefault(name, [])
+        buffer.append(doc)
+        if len(buffer) >= self.batch_size:
+            await self._schedule(name)
+
+    async def _schedule(self, name: str):
+        batch = self.buffers.pop(name, None)
+        if not batch:
+            return
+        await self.slots.acquire()  # Backpressure: generation waits while `parallel` batches are writing
+        self.tasks.append(asyncio.create_task(self._write(name, batch)))
+
+    async def _write(self, name: str, batch: list):
+        try:
+            if name in self.writers:
+                await self.writers[name](batch)
+            else:
+                await self.db[name].insert_many(batch, ordered=False)
+            self.counts[name] = self.counts.get(name, 0) + len(batch)
+        finally:
+            self.slots.release()
+
+    async def close(self) -> dict:
+        for name in list(self.buffers):
+            await self._schedule(name)
+        await asyncio.gather(*self.tasks)
+        return self.counts
+
+
+def write_synthetic_uploads(upload_dir: Path, seed: int, count: int):
+    """Shared pool of face photos (JPEG) and CVs (PDF); returns their upload URLs"""
+    from PIL import Image, ImageDraw
+
+    upload_dir.mkdir(parents=True, exist_ok=True)
+    rng = synthetic_rng(seed, "uploads", 0)
+    faces, cvs = [], []
+    for i in range(max(1, count // 2)):
+        img = Image.new("RGB", (240, 240), tuple(rng.randrange(150, 256) for _ in range(3)))
+        draw = ImageDraw.Draw(img)
+        draw.ellipse((60, 40, 180, 200), fill=tuple(rng.randrange(90, 220) for _ in range(3)))
+        name = f"synthetic-face-{i:04d}.jpg"
+        img.save(upload_dir / name, "JPEG", quality=80)
+        faces.append(f"/api/uploads/{name}")
+    for i in range(max(1, count - count // 2)):
+        body = rng.randbytes(rng.randrange(20, 200) * 1024)
+        name = f"synthetic-cv-{i:04d}.pdf"
+        (upload_dir / name).write_bytes(b"%PDF-1.4\n" + body + b"\n%%EOF\n")
+        cvs.append(f"/api/uploads/{name}")
+    return faces, cvs
+
+
+def synthetic_person(rng: random.Random, tag: str, domain: str) -> tuple:
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    return f"{first} {last}", f"{first.lower()}.{last.lower()}.{tag}@{domain}"
+
+
+def synthetic_attendance_day(rng: random.Random, emp: dict, date: str) -> dict:
+    """One approved (occasionally pending) workday with clock-in/out and usually a break"""
+    from server import attendance_day, attendance_derived_fields
+
+    def minute(start: int, spread: int) -> str:
+        m = start + rng.randrange(spread)
+        return f"{m // 60:02d}:{m % 60:02d}:00"
+
+    record = {
+        "employee_id": emp["id"], "employee_name": emp["name"], "employee_email": emp["email"],
+        "company_id": emp["companies"][0], "outlet_id": emp["outlet_id"],
+        "date": date, "day": attendance_day(date),
+        "employee_active": not emp.get("trashed", False), "employee_removed": False,
+        "clock_in": minute(7 * 60 + 30, 80), "clock_out": minute(16 * 60 + 30, 120),
+        "break_start": None, "break_end": None,
+        "clock_in_photo": emp["face_photo"], "clock_out_photo": emp["face_photo"],
+        "clock_in_score": round(rng.uniform(0.6, 0.99), 2), "clock_out_score": round(rng.uniform(0.6, 0.99), 2),
+        "clock_in_ip": None, "clock_out_ip": None,
+        "clock_in_outlet_id": emp["outlet_id"], "clock_out_outlet_id": emp["outlet_id"],
+        "status": "pending_approval" if rng.random() < 0.02 else "approved",
+        "is_backdate": False, "notes": None,
+    }
+    if rng.random() < 0.8:
+        record["break_start"], record["break_end"] = minute(12 * 60, 15), minute(13 * 60, 15)
+    record.update(attendance_derived_fields(record))
+    return record
+
+
+async def seed_synthetic():
+    from server import (
+        db, client, UPLOAD_DIR, activity_log_store, ensure_indexes, hash_password, log_search_terms,
+        next_rev, outlet_geo_point, rebuild_attendance_rollups
+    )
+
+    arg = lambda name, default: int(sys.argv[sys.argv.index(name) + 1]) if name in sys.argv else default
+    seed = arg('--seed', 42)
+    companies = arg('--companies', 3)
+    per_company = {
+        "outlets": arg('--outlets', 10), "employees": arg('--employees', 1000), "jobs": arg('--jobs', 20),
+        "applications": arg('--applications', 20000), "logs": arg('--logs', 20000),
+    }
+    days = arg('--days', 365)
+    anchor = datetime.strptime(sys.argv[sys.argv.index('--anchor') + 1], "%Y-%m-%d") if '--anchor' in sys.argv \
+        else datetime.now(timezone.utc).replace(tzinfo=None)
+    anchor = anchor.replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=timezone.utc)
+    moment = lambda rng: (anchor - timedelta(seconds=rng.randrange(days * 86400))).isoformat()
+
+    try:
+        print("\n=== Seeding Synthetic Data ===")
+        print(f"Database: {os.environ.get('DB_NAME')}")
+        print(f"Seed: {seed}, anchor: {anchor.date()}, {companies} perusahaan, {days} hari, {per_company}")
+        existing = await db.companies.count_documents({"synthetic": True})
+        if existing:
+            print(f"  SKIP - sudah ada {existing} perusahaan sintetis (gunakan --synthetic --clear dulu)")
+            return
+
+        faces, cvs = write_synthetic_uploads(UPLOAD_DIR, seed, arg('--uploads', 200))
+        print(f"  UPLOADS - {len(faces)} foto wajah, {len(cvs)} CV di {UPLOAD_DIR}")
+
+        password = hash_password(SYNTHETIC_PASSWORD)  # One hash shared by every synthetic account
+        rev = await next_rev()  # Shared rev; delta-sync cursors page by (rev, id)
+        writer = BulkInserter(db, arg('--batch', 1000), arg('--parallel', 4),
+                              writers={"activity_logs": activity_log_store.insert_many})
+        started = datetime.now(timezone.utc)
+
+        for c in range(companies):
+            rng = synthetic_rng(seed, "company", c)
+            domain = SYNTHETIC_DOMAIN.format(c + 1)
+            now = anchor.isoformat()
+            company = {
+                "id": synthetic_id(rng), "name": f"PT Sintetis {c + 1:03d}", "slug": domain.split(".")[0],
+                "domain": domain, "address": f"Jl. Sintetis No. {c + 1}, Jakarta", "phone": f"021{rng.randrange(10**7):07d}",
+                "email": f"hrd@{domain}", "logo_url": "", "is_active": True,
+                "license_start": (anchor - timedelta(days=days)).isoformat(),
+                "license_end": (anchor + timedelta(days=365)).isoformat(), "license_type": "yearly",
+                "profile": {"tagline": "Data sintetis untuk uji performa", "description": None, "vision": None,
+                            "mission": None, "history": None, "culture": None, "benefits": [], "social_links": {},
+                            "gallery_images": [], "cover_image": None},
+                "smtp_settings": None, "synthetic": True, "created_at": now, "updated_at": now,
+            }
+            cid = company["id"]
+            await db.companies.insert_one(company)
+            admin = {
+                "id": f"admin_{synthetic_id(rng)[-12:]}", "email": f"admin@{domain}", "name": f"Admin Sintetis {c + 1:03d}",
+                "password": password, "picture": None, "companies": [cid], "is_active": True,
+                "auth_provider": "email", "created_at": now, "updated_at": now,
+            }
+            await writer.add("company_admins", admin)
+
+            outlets = []
+            for i in range(per_company["outlets"]):
+                province, city, lat, lng = rng.choice(CITIES)
+                lat, lng = round(lat + rng.uniform(-0.05, 0.05), 6), round(lng + rng.uniform(-0.05, 0.05), 6)
+                outlets.append({
+                    "id": synthetic_id(rng), "company_id": cid, "name": f"Outlet {city} {i + 1:02d}",
+                    "address": f"Jl. Raya {city} No. {i + 1}", "phone": None, "office_ips": [],
+                    "latitude": lat, "longitude": lng, "location": outlet_geo_point(lat, lng),
+                    "radius_meters": 150, "geo_enabled": True, "is_active": True, "created_at": now, "updated_at": now,
+                })
+            divisions = [{"id": synthetic_id(rng), "company_id": cid, "name": name, "description": None,
+                          "created_at": now, "updated_at": now} for name in DIVISIONS]
+            for doc in outlets:
+                await writer.add("outlets", doc)
+            for doc in divisions:
+                await writer.add("divisions", doc)
+
+            # Employees, each with a year (--days) of attendance; today is left free for clock-in tests
+            emp_rng, att_rng = synthetic_rng(seed, "employees", c), synthetic_rng(seed, "attendance", c)
+            for i in range(per_company["employees"]):
+                name, email = synthetic_person(emp_rng, f"{c + 1}{i:05d}", domain)
+                province, city, _, _ = emp_rng.choice(CITIES)
+                outlet = emp_rng.choice(outlets)
+                emp = {
+                    "id": f"emp_{synthetic_id(emp_rng)[-12:]}", "email": email, "name": name, "password": password,
+                    "phone": f"08{emp_rng.randrange(10**10):010d}", "position": emp_rng.choice(JOB_TITLES),
+                    "department": None, "join_date": (anchor - timedelta(days=emp_rng.randrange(days, days + 1500))).strftime("%Y-%m-%d"),
+                    "picture": None, "gender": emp_rng.choice(["Laki-laki", "Perempuan"]),
+                    "education": emp_rng.choice(EDUCATION), "major": emp_rng.choice(MAJORS),
+                    "province": province, "city": city, "employment_type": emp_rng.choice(["tetap", "kontrak"]),
+                    "outlet_id": outlet["id"], "outlet_ids": [outlet["id"]],
+                    "division_id": emp_rng.choice(divisions)["id"], "companies": [cid],
+                    "face_photo": emp_rng.choice(faces), "face_registered_at": now,
+                    "face_descriptor": [round(emp_rng.gauss(0, 0.1), 6) for _ in range(128)],
+                    "is_active": True, "auth_provider": "email", "created_at": now, "updated_at": now, "rev": rev,
+                }
+                if emp_rng.random() < 0.03:
+                    emp["trashed"] = True
+                await writer.add("employees", emp)
+                for d in range(days, 0, -1):
+                    date = anchor - timedelta(days=d)
+                    if date.weekday() == 6 or att_rng.random() < 0.05:  # Sundays off, ~5% absent
+                        continue
+                    record = synthetic_attendance_day(att_rng, emp, date.strftime("%Y-%m-%d"))
+                    record.update({"id": synthetic_id(att_rng), "created_at": f"{record['date']}T00:30:00+00:00", "rev": rev})
+                    await writer.add("attendance", record)
+
+            job_rng = synthetic_rng(seed, "jobs", c)
+            jobs = []
+            for i in range(per_company["jobs"]):
+                _, city, _, _ = job_rng.choice(CITIES)
+                created = moment(job_rng)
+                jobs.append({
+                    "id": synthetic_id(job_rng), "company_id": cid, "title": f"{job_rng.choice(JOB_TITLES)} {city}",
+                    "department": job_rng.choice(DIVISIONS), "location": city,
+                    "job_type": job_rng.choice(["full_time", "part_time", "contract", "internship"]),
+                    "description": "Lowongan sintetis untuk uji performa.",
+                    "requirements": ["Pendidikan minimal SMA/SMK", "Jujur dan bertanggung jawab"],
+                    "responsibilities": ["Melayani pelanggan", "Membuat laporan harian"],
+                    "salary_min": 4_000_000, "salary_max": 7_000_000, "show_salary": job_rng.random() < 0.5,
+                    "status": job_rng.choices(["published", "closed", "draft"], [6, 3, 1])[0],
+                    "allow_existing_applicant": True, "created_at": created, "updated_at": created,
+                })
+            for doc in jobs:
+                await writer.add("jobs", doc)
+
+            # Applications with varied form_data: optional fields come and go like real forms
+            app_rng = synthetic_rng(seed, "applications", c)
+            open_jobs = [j for j in jobs if j["status"] != "draft"] or jobs
+            for i in range(per_company["applications"]):
+                name, email = synthetic_person(app_rng, f"{c + 1}{i:06d}", "example.com")
+                province, city, _, _ = app_rng.choice(CITIES)
+                form_data = {"full_name": name, "email": email, "phone": f"08{app_rng.randrange(10**10):010d}",
+                             "education": app_rng.choice(EDUCATION)}
+                optional = {
+                    "birth_place": city, "birth_date": f"{app_rng.randrange(1975, 2006)}-{app_rng.randrange(1, 13):02d}-{app_rng.randrange(1, 29):02d}",
+                    "major": app_rng.choice(MAJORS), "province": province, "city": city,
+                    "full_address": f"Jl. {app_rng.choice(LAST_NAMES)} No. {app_rng.randrange(1, 200)}, RT {app_rng.randrange(1, 20):02d} / RW {app_rng.randrange(1, 15):02d}",
+                    "expected_salary": f"{app_rng.randrange(35, 120) * 100_000:,}".replace(",", "."),
+                    "experience": str(app_rng.randrange(0, 15)),
+                }
+                form_data.update({k: v for k, v in optional.items() if app_rng.random() < 0.7})
+                created = moment(app_rng)
+                application = {
+                    "id": synthetic_id(app_rng), "job_id": app_rng.choice(open_jobs)["id"], "company_id": cid,
+                    "form_data": form_data, "resume_url": app_rng.choice(cvs) if app_rng.random() < 0.7 else None,
+                    "status": app_rng.choice(APPLICATION_STATUSES), "notes": None,
+                    "created_at": created, "updated_at": created, "rev": rev,
+                }
+                if app_rng.random() < 0.02:
+                    application["deleted_at"] = created
+                await writer.add("applications", application)
+
+            # Activity logs go through the partitioned store, one collection per month
+            log_rng = synthetic_rng(seed, "logs", c)
+            for i in range(per_company["logs"]):
+                action, resource_type, description = log_rng.choice(LOG_ACTIONS)
+                description = f"{description} #{log_rng.randrange(1, 10000)}"
+                await writer.add("activity_logs", {
+                    "id": synthetic_id(log_rng), "user_id": admin["id"], "user_name": admin["name"],
+                    "user_email": admin["email"], "user_role": "admin", "company_id": cid,
+                    "company_name": company["name"], "action": action, "resource_type": resource_type,
+                    "resource_id": None, "description": description,
+                    "ip_address": f"10.{log_rng.randrange(256)}.{log_rng.randrange(256)}.{log_rng.randrange(1, 255)}",
+                    "timestamp": moment(log_rng),
+                    "search_terms": log_search_terms(admin["name"], admin["email"], description),
+                })
+            print(f"  SEED {company['name']} ({domain})")
+
+        for name, count in sorted((await writer.close()).items()):
+            print(f"  SEED {name} - {count} documents ditambahkan")
+        print("  INDEX - membangun index & rollup absensi...")
+        await ensure_indexes()
+        for cid in await db.companies.distinct("id", {"synthetic": True}):
+            await rebuild_attendance_rollups(db, cid)
+        elapsed = (datetime.now(timezone.utc) - started).total_seconds()
+        print(f"\nSeeding sintetis selesai dalam {elapsed:.0f} detik!")
+        print(f"  Admin: admin@{SYNTHETIC_DOMAIN.format(1)} / {SYNTHETIC_PASSWORD}")
+    finally:
+        client.close()
+
+
+async def clear_synthetic():
+    from server import db, client, UPLOAD_DIR, LOG_STORES
+
+    try:
+        company_ids = await db.companies.distinct("id", {"synthetic": True})
+        print(f"\n=== Menghapus data sintetis ({len(company_ids)} perusahaan) ===")
+        for coll_name in SYNTHETIC_COLLECTIONS:
+            result = await db[coll_name].delete_many({"$or": [{"company_id": {"$in": company_ids}}, {"companies": {"$in": company_ids}}]})
+            print(f"  CLEAR {coll_name} - {result.deleted_count} documents dihapus")
+        for store in LOG_STORES.values():
+            deleted = 0
+            async for part in db.log_partitions.find({"collection": store.name}, {"_id": 1}):
+                deleted += (await db[part["_id"]].delete_many({"company_id": {"$in": company_ids}})).deleted_count
+            print(f"  CLEAR {store.name} - {deleted} documents dihapus")
+        result = await db.companies.delete_many({"synthetic": True})
+        print(f"  CLEAR companies - {result.deleted_count} documents dihapus")
+        files = list(UPLOAD_DIR.glob("synthetic-*"))
+        for path in files:
+            path.unlink()
+        print(f"  CLEAR uploads - {len(files)} file dihapus")
+    finally:
+        client.close()
+
+
 if __name__ == '__main__':
-    if '--status' in sys.argv:
+    if '--synthetic' in sys.argv:
+        asyncio.run(clear_synthetic() if '--clear' in sys.argv else seed_synthetic())
+    elif '--status' in sys.argv:
         asyncio.run(check_status())
     elif '--force' in sys.argv:
         print("WARNING: Ini akan MENGHAPUS semua data lama dan menggantinya dengan seed data!")
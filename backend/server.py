@@ -1,27 +1,48 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Form, Request, Response, Cookie
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, JSONResponse, ORJSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, CollectionInvalid, OperationFailure
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional, Any, Dict
+from typing import List, Optional, Any, Dict, Set
 import uuid
 from datetime import datetime, timezone, timedelta
 import hashlib
 import jwt
 import secrets
 import json
+import orjson
 import aiofiles
 import httpx
 import pyotp
 import zipfile
 import io
 import tempfile
+import random
+import shutil
 import re
+import math
+import ipaddress
+import gzip
+import csv
+import asyncio
+import time
+import threading
+import contextvars
+import sys
+import traceback
+import cProfile
+import pstats
+import marshal
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from zoneinfo import ZoneInfo
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -30,9 +51,491 @@ load_dotenv(ROOT_DIR / '.env')
 UPLOAD_DIR = ROOT_DIR / "uploads"
 UPLOAD_DIR.mkdir(exist_ok=True)
 
+# ============ METRICS ============
+
+# Per-worker request, MongoDB and SMTP metrics rendered in Prometheus text
+# format at GET /api/metrics. Every uvicorn worker keeps its own registry;
+# the pid label tells scraped workers apart. current_request carries the
+# per-request DB counters so the command listener (which runs on motor's
+# threads) can attribute commands to the route that issued them.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+DB_CALL_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+STREAM_DURATION_BUCKETS = (1, 10, 60, 300, 900, 1800, 3600)
+
+def prometheus_labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    escape = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels.items()) + "}"
+
+class Metrics:
+    """Small counter/histogram/gauge registry (thread-safe, no external deps)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta: Dict[str, tuple] = {}    # name -> (type, help, buckets)
+        self._values: Dict[str, Dict[tuple, Any]] = {}
+        self._gauges: Dict[str, Any] = {}    # name -> callable returning value or [(labels, value)]
+
+    def counter(self, name: str, help_text: str):
+        self._meta[name] = ("counter", help_text, None)
+        self._values[name] = {}
+
+    def histogram(self, name: str, help_text: str, buckets: tuple):
+        self._meta[name] = ("histogram", help_text, buckets)
+        self._values[name] = {}
+
+    def gauge(self, name: str, help_text: str, collect):
+        self._meta[name] = ("gauge", help_text, None)
+        self._gauges[name] = collect
+
+    def inc(self, name: str, labels: Dict[str, Any], value: float = 1):
+        key = tuple(labels.items())
+        with self._lock:
+            series = self._values[name]
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, labels: Dict[str, Any], value: float):
+        buckets = self._meta[name][2]
+        key = tuple(labels.items())
+        with self._lock:
+            series = self._values[name].setdefault(key, [0] * len(buckets) + [0, 0.0])
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self) -> str:
+        pid = {"pid": os.getpid()}
+        lines = []
+        for name, (kind, help_text, buckets) in self._meta.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            if kind == "gauge":
+                try:
+                    value = self._gauges[name]()
+                except Exception as e:
+                    logging.warning(f"Metric {name} failed: {e}")
+                    continue
+                for labels, v in (value if isinstance(value, list) else [({}, value)]):
+                    lines.append(f"{name}{prometheus_labels({**pid, **labels})} {v}")
+                continue
+            with self._lock:
+                series = {key: (list(v) if isinstance(v, list) else v) for key, v in self._values[name].items()}
+            for key, v in series.items():
+                labels = {**pid, **dict(key)}
+                if kind == "counter":
+                    lines.append(f"{name}{prometheus_labels(labels)} {v}")
+                    continue
+                for bound, count in zip(buckets, v):
+                    lines.append(f"{name}_bucket{prometheus_labels({**labels, 'le': bound})} {count}")
+                lines.append(f"{name}_bucket{prometheus_labels({**labels, 'le': '+Inf'})} {v[-2]}")
+                lines.append(f"{name}_sum{prometheus_labels(labels)} {v[-1]}")
+                lines.append(f"{name}_count{prometheus_labels(labels)} {v[-2]}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+metrics.counter("http_requests_total", "HTTP requests by route template and status")
+metrics.histogram("http_request_duration_seconds", "Request latency by route template", LATENCY_BUCKETS)
+metrics.histogram("http_stream_duration_seconds", "Lifetime of event-stream (SSE) responses", STREAM_DURATION_BUCKETS)
+metrics.histogram("http_response_size_bytes", "Response body size by route template", SIZE_BUCKETS)
+metrics.histogram("http_request_db_calls", "MongoDB commands issued per request", DB_CALL_BUCKETS)
+metrics.counter("http_request_db_seconds_total", "Time spent in MongoDB commands by route template")
+metrics.histogram("mongo_command_duration_seconds", "MongoDB command latency by command", LATENCY_BUCKETS)
+metrics.histogram("smtp_send_duration_seconds", "SMTP send time by outcome", LATENCY_BUCKETS)
+
+# Per-request state (request_id, scope, DB counters, tenant, role), set by RequestMetricsMiddleware
+current_request: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("current_request", default=None)
+
+def current_request_id() -> Optional[str]:
+    ctx = current_request.get()
+    return ctx["request_id"] if ctx else None
+
+def tag_request(tenant: Optional[str], role: Optional[str]):
+    """Record who the current request acts for, for the access log"""
+    ctx = current_request.get()
+    if ctx is not None:
+        ctx["tenant"] = tenant
+        ctx["role"] = role
+
+# Fire-and-forget tasks started by requests; held here so they aren't garbage
+# collected mid-run, and drained (up to SPAWN_DRAIN_SECONDS) on shutdown
+_spawned_tasks: Set[asyncio.Task] = set()
+SPAWN_DRAIN_SECONDS = 10
+
+def spawn(coro) -> asyncio.Task:
+    """create_task for work started by a request: keeps its request_id, not its DB counters"""
+    ctx = current_request.get()
+
+    async def run():
+        if ctx is not None:
+            current_request.set({**ctx, "db_calls": 0, "db_seconds": 0.0, "shapes": {}, "background": True})
+        return await coro
+    task = asyncio.create_task(run())
+    _spawned_tasks.add(task)
+    task.add_done_callback(_spawned_tasks.discard)
+    return task
+
+# Every log record carries the request id of the request (or spawned task) that emitted it
+_log_record_factory = logging.getLogRecordFactory()
+
+def _request_log_record(*args, **kwargs):
+    record = _log_record_factory(*args, **kwargs)
+    record.request_id = current_request_id() or "-"
+    return record
+
+logging.setLogRecordFactory(_request_log_record)
+
+# Structured access log: one JSON line per request. Errors (4xx/5xx) and slow
+# requests are always logged; other requests are sampled at ACCESS_LOG_SAMPLE_RATE.
+# Event streams (SSE) stay open by design, so they are never "slow" and are
+# flagged with "stream": true; their duration goes to http_stream_duration_seconds.
+ACCESS_LOG_SAMPLE_RATE = float(os.environ.get('ACCESS_LOG_SAMPLE_RATE', '0.1'))
+ACCESS_LOG_SLOW_MS = float(os.environ.get('ACCESS_LOG_SLOW_MS', '1000'))
+access_logger = logging.getLogger("makar.access")
+
+def log_access(ctx: dict, status: int, seconds: float, size: int, stream: bool = False):
+    ms = seconds * 1000
+    sampled = status < 400 and (stream or ms < ACCESS_LOG_SLOW_MS)
+    if sampled and random.random() >= ACCESS_LOG_SAMPLE_RATE:
+        return
+    scope = ctx["scope"]
+    entry = {
+        "request_id": ctx["request_id"],
+        "method": scope["method"],
+        "route": request_route(ctx),
+        "path": scope["path"],
+        "status": status,
+        "ms": round(ms, 1),
+        "db_calls": ctx["db_calls"],
+        "db_ms": round(ctx["db_seconds"] * 1000, 1),
+        "bytes": size,
+        "tenant": ctx.get("tenant"),
+        "role": ctx.get("role"),
+        "stream": stream,
+        "sample_rate": ACCESS_LOG_SAMPLE_RATE if sampled else 1,  # Weight for aggregations
+    }
+    access_logger.log(logging.ERROR if status >= 500 else logging.INFO, json.dumps(entry))
+
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '200'))
+SLOW_QUERY_SHAPE_FIELDS = ("filter", "query", "sort", "pipeline", "updates", "deletes")
+slow_query_logger = logging.getLogger("makar.slow_query")
+
+def query_shape(value, depth: int = 0):
+    """Replace literal values with "?" so a logged query shows its structure, not tenant data"""
+    if depth > 8:
+        return "..."
+    if isinstance(value, dict):
+        return {k: query_shape(v, depth + 1) for k, v in value.items()}
+    if isinstance(value, (list, tuple)) and value and all(isinstance(v, dict) for v in value):
+        return [query_shape(v, depth + 1) for v in value]
+    return "?"
+
+def request_route(ctx: dict) -> str:
+    return getattr(ctx["scope"].get("route"), "path", None) or "unmatched"
+
+# N+1 detection. With DB_DEBUG=warn each request counts its commands by
+# (command, collection, query shape) and logs shapes repeated more than
+# DB_REPEAT_THRESHOLD times, plus routes over their @db_budget. DB_DEBUG=strict
+# (tests, benchmarks) turns those into a 500 response instead. Calls made while
+# a streamed body is being sent are checked again before its last chunk; by
+# then the status is out, so strict mode aborts the response instead.
+# X-DB-Calls only counts calls made before the response started.
+DB_DEBUG = os.environ.get('DB_DEBUG', '').lower()
+DB_REPEAT_THRESHOLD = int(os.environ.get('DB_REPEAT_THRESHOLD', '5'))
+DB_DEBUG_IGNORED = {"getMore", "killCursors", "endSessions"}
+
+def db_budget(max_calls: int):
+    """Declare the most MongoDB commands (cursor getMores excluded) one request to this route may issue"""
+    def decorate(endpoint):
+        endpoint.db_budget = max_calls
+        return endpoint
+    return decorate
+
+def db_violations(ctx: dict) -> List[str]:
+    violations = [
+        f"{command} {collection} x{count}: {shape}"
+        for (command, collection, shape), count in ctx["shapes"].items()
+        if count > DB_REPEAT_THRESHOLD
+    ]
+    budget = getattr(getattr(ctx["scope"].get("route"), "endpoint", None), "db_budget", None)
+    calls = sum(ctx["shapes"].values())
+    if budget is not None and calls > budget:
+        violations.append(f"{calls} DB calls, budget {budget}")
+    return violations
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Count and time every MongoDB command, attributed to the current request"""
+
+    def __init__(self):
+        self._commands: Dict[tuple, Any] = {}  # In-flight command documents, for slow-query logging
+
+    def started(self, event):
+        self._commands[(event.connection_id, event.request_id)] = event.command
+        ctx = current_request.get()
+        if DB_DEBUG and ctx is not None and event.command_name not in DB_DEBUG_IGNORED:
+            command = event.command
+            shape = {field: query_shape(command[field]) for field in SLOW_QUERY_SHAPE_FIELDS if field in command}
+            key = (event.command_name, command.get(event.command_name), json.dumps(shape, sort_keys=True))
+            ctx["shapes"][key] = ctx["shapes"].get(key, 0) + 1
+
+    def succeeded(self, event):
+        self._record(event, "ok")
+
+    def failed(self, event):
+        self._record(event, "error")
+
+    def _record(self, event, outcome: str):
+        command = self._commands.pop((event.connection_id, event.request_id), None)
+        seconds = event.duration_micros / 1_000_000
+        metrics.observe("mongo_command_duration_seconds", {"command": event.command_name, "outcome": outcome}, seconds)
+        ctx = current_request.get()
+        if ctx is not None:
+            ctx["db_calls"] += 1
+            ctx["db_seconds"] += seconds
+        if seconds * 1000 >= SLOW_QUERY_MS and command is not None:
+            entry = {
+                "ms": round(seconds * 1000, 1),
+                "command": event.command_name,
+                "collection": command.get(event.command_name) if event.command_name != "getMore" else command.get("collection"),
+                "outcome": outcome,
+                "route": request_route(ctx) if ctx else None,
+                "request_id": ctx["request_id"] if ctx else None,
+                **{field: query_shape(command[field]) for field in SLOW_QUERY_SHAPE_FIELDS if field in command}
+            }
+            slow_query_logger.warning(json.dumps(entry, default=str))
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    """Track open and checked-out connections across the driver's pools"""
+
+    def __init__(self):
+        self.open = 0
+        self.checked_out = 0
+        self._lock = threading.Lock()  # Pool events fire on driver threads
+
+    def _add(self, field: str, delta: int):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + delta)
+
+    def connection_created(self, event):
+        self._add("open", 1)
+
+    def connection_closed(self, event):
+        self._add("open", -1)
+
+    def connection_checked_out(self, event):
+        self._add("checked_out", 1)
+
+    def connection_checked_in(self, event):
+        self._add("checked_out", -1)
+
+    def connection_check_out_failed(self, event):
+        metrics.inc("mongo_pool_checkout_failures_total", {"reason": str(event.reason)})
+
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_check_out_started(self, event): pass
+
+metrics.counter("mongo_pool_checkout_failures_total", "Failed connection checkouts (timeouts, pool closed)")
+
+class RequestMetricsMiddleware:
+    """ASGI middleware recording latency, status, body size and DB usage per route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        request_id = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1")
+        if not re.fullmatch(r"[\w-]{1,64}", request_id):
+            request_id = uuid.uuid4().hex
+        ctx = {"request_id": request_id, "scope": scope, "db_calls": 0, "db_seconds": 0.0, "shapes": {}}
+        token = current_request.set(ctx)
+        response = {"status": 500, "size": 0, "replaced": False, "violations": [], "stream": False}
+        start = time.perf_counter()
+
+        async def send_with_metrics(message):
+            if response["replaced"]:
+                return  # Original body of a response swapped out by DB_DEBUG=strict
+            if message["type"] == "http.response.start":
+                headers = [*message.get("headers", []), (b"x-request-id", request_id.encode())]
+                if DB_DEBUG:
+                    headers.append((b"x-db-calls", str(sum(ctx["shapes"].values())).encode()))
+                    violations = response["violations"] = db_violations(ctx)
+                    if violations:
+                        logging.warning(f"DB usage {scope['method']} {request_route(ctx)} [{request_id}]: {'; '.join(violations)}")
+                    if violations and DB_DEBUG == "strict":
+                        body = json.dumps({"detail": "DB budget exceeded", "violations": violations}).encode()
+                        await send({"type": "http.response.start", "status": 500, "headers": [
+                            (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                            *headers[-2:]
+                        ]})
+                        await send({"type": "http.response.body", "body": body})
+                        response.update(status=500, size=len(body), replaced=True)
+                        return
+                response["status"] = message["status"]
+                response["stream"] = dict(headers).get(b"content-type", b"").startswith(b"text/event-stream")
+                message["headers"] = headers
+            elif message["type"] == "http.response.body":
+                response["size"] += len(message.get("body", b""))
+                if DB_DEBUG and not message.get("more_body", False):
+                    late = [v for v in db_violations(ctx) if v not in response["violations"]]
+                    if late:
+                        logging.warning(f"DB usage {scope['method']} {request_route(ctx)} [{request_id}] "
+                                        f"while streaming the body: {'; '.join(late)}")
+                        if DB_DEBUG == "strict":
+                            raise RuntimeError(f"DB budget exceeded while streaming: {'; '.join(late)}")
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            # FastAPI stores the matched route in scope; unmatched paths share one label
+            labels = {"method": scope["method"], "route": request_route(ctx)}
+            duration = time.perf_counter() - start
+            metrics.inc("http_requests_total", {**labels, "status": response["status"]})
+            if response["stream"]:
+                metrics.observe("http_stream_duration_seconds", labels, duration)
+            else:
+                metrics.observe("http_request_duration_seconds", labels, duration)
+            metrics.observe("http_response_size_bytes", labels, response["size"])
+            metrics.observe("http_request_db_calls", labels, ctx["db_calls"])
+            metrics.inc("http_request_db_seconds_total", labels, ctx["db_seconds"])
+            log_access(ctx, response["status"], duration, response["size"], response["stream"])
+            current_request.reset(token)
+
+# Default executor for asyncio.to_thread (SMTP, archives); installed at startup
+THREAD_POOL_WORKERS = int(os.environ.get('THREAD_POOL_WORKERS', str(min(32, (os.cpu_count() or 1) + 4))))
+thread_pool = ThreadPoolExecutor(max_workers=THREAD_POOL_WORKERS, thread_name_prefix="makar")
+
+def executor_stats() -> list:
+    pools = [("default", thread_pool)]
+    try:
+        import motor.frameworks.asyncio as motor_asyncio
+        if getattr(motor_asyncio, "_EXECUTOR", None) is not None:
+            pools.append(("motor", motor_asyncio._EXECUTOR))
+    except ImportError:
+        pass
+    return pools
+
+metrics.gauge("thread_pool_queue_depth", "Tasks waiting for a thread", lambda: [
+    ({"pool": name}, pool._work_queue.qsize()) for name, pool in executor_stats()
+])
+metrics.gauge("thread_pool_threads", "Threads started by the pool", lambda: [
+    ({"pool": name}, len(pool._threads)) for name, pool in executor_stats()
+])
+
+# ============ EVENT LOOP MONITOR ============
+
+# Sync work inside async handlers (PIL, openpyxl, zipfile, hashing) stalls
+# every request on the worker. LoopMonitor measures loop lag from a coroutine
+# that expects to wake every LOOP_LAG_INTERVAL_MS; a watchdog thread notices
+# when that heartbeat is overdue by LOOP_BLOCK_THRESHOLD_MS and, while the
+# loop is still blocked, captures the loop thread's stack and the request
+# (route, request_id) it belongs to.
+LOOP_LAG_INTERVAL_MS = float(os.environ.get('LOOP_LAG_INTERVAL_MS', '250'))
+LOOP_BLOCK_THRESHOLD_MS = float(os.environ.get('LOOP_BLOCK_THRESHOLD_MS', '200'))
+LOOP_BLOCK_STACK_DEPTH = 25
+loop_logger = logging.getLogger("makar.loop")
+
+metrics.histogram("event_loop_lag_seconds", "Delay of the loop lag probe past its scheduled wake-up", LATENCY_BUCKETS)
+metrics.counter("event_loop_blocked_total", "Loop stalls over LOOP_BLOCK_THRESHOLD_MS by route")
+
+class LoopMonitor:
+    """Event-loop lag probe plus a watchdog thread that samples the stack of long stalls"""
+
+    def __init__(self, interval_ms: float, threshold_ms: float):
+        self.interval = interval_ms / 1000
+        self.threshold = threshold_ms / 1000
+        self.lag = 0.0
+        self.beat = time.monotonic()
+        self.recent_blocks = deque(maxlen=20)
+        self._loop_thread = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        self._loop_thread = threading.get_ident()
+        self.beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._probe())
+        self._thread = threading.Thread(target=self._watch, name="makar-loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _probe(self):
+        while True:
+            due = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.lag = max(0.0, now - due)
+            self.beat = now
+            metrics.observe("event_loop_lag_seconds", {}, self.lag)
+
+    def _watch(self):
+        reported = None
+        while not self._stopped.wait(self.interval / 2):
+            beat = self.beat
+            stalled = time.monotonic() - beat - self.interval
+            if stalled >= self.threshold and beat != reported:
+                reported = beat  # One sample per stall
+                try:
+                    self._report(stalled)
+                except Exception as e:
+                    loop_logger.warning(f"Loop stall capture failed: {e}")
+
+    def _report(self, stalled: float):
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return
+        route, request_id = self.request_of(frame)
+        stack = traceback.extract_stack(frame)[-LOOP_BLOCK_STACK_DEPTH:]
+        entry = {
+            "blocked_ms": round(stalled * 1000, 1),  # When sampled; the stall may run longer
+            "route": route,
+            "request_id": request_id,
+            "at": datetime.now(timezone.utc).isoformat(),
+            "stack": [f"{f.filename}:{f.lineno} {f.name}" for f in stack],
+        }
+        self.recent_blocks.append(entry)
+        metrics.inc("event_loop_blocked_total", {"route": route})
+        loop_logger.warning(json.dumps(entry))
+
+    @staticmethod
+    def request_of(frame) -> tuple:
+        """(route, request_id) of the request whose middleware frame is on the blocked stack"""
+        while frame is not None:
+            if frame.f_code is RequestMetricsMiddleware.__call__.__code__:
+                ctx = frame.f_locals.get("ctx")
+                if ctx:
+                    return request_route(ctx), ctx["request_id"]
+            frame = frame.f_back
+        return "background", None
+
+loop_monitor = LoopMonitor(LOOP_LAG_INTERVAL_MS, LOOP_BLOCK_THRESHOLD_MS)
+metrics.gauge("event_loop_lag_last_seconds", "Most recent loop lag probe", lambda: loop_monitor.lag)
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '100'))
+mongo_pool = MongoPoolMetrics()
+client = AsyncIOMotorClient(mongo_url, maxPoolSize=MONGO_MAX_POOL_SIZE,
+                            event_listeners=[MongoCommandMetrics(), mongo_pool])
+metrics.gauge("mongo_pool_connections", "MongoDB connections by state", lambda: [
+    ({"state": "open"}, mongo_pool.open), ({"state": "checked_out"}, mongo_pool.checked_out)
+])
 db = client[os.environ['DB_NAME']]
 
 # JWT Config
@@ -41,11 +544,62 @@ JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_HOURS = 24
 
 # Create the main app without a prefix
-app = FastAPI(title="Makar.id HR System API")
+app = FastAPI(title="Makar.id HR System API", default_response_class=ORJSONResponse)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
+# ============ JSON RESPONSES ============
+
+# Responses are encoded with orjson (the app's default response class). List
+# endpoints that already build their rows as response models return
+# model_list_response(), which skips FastAPI's second response_model
+# validation; response_model stays on the route for the OpenAPI schema.
+# Cursor-backed lists go through stream_json_list(): the first
+# JSON_STREAM_CHUNK rows are built before the response starts, so short lists
+# are a plain response (errors are a 500, DB calls count against @db_budget).
+# Longer lists stream the rest chunk by chunk. Once streaming, the status is
+# already 200; a failure then is logged and the body is cut off unterminated
+# rather than closed early, so clients fail to parse it instead of taking a
+# partial list as complete.
+JSON_STREAM_CHUNK = 500
+
+def model_list_response(items: List[BaseModel], response: Optional[Response] = None) -> ORJSONResponse:
+    """Encode already-validated models once; keeps headers (ETag) set on the injected `response`"""
+    result = ORJSONResponse([item.model_dump() for item in items])
+    if response is not None:
+        for key, value in response.headers.items():
+            if key not in ("content-length", "content-type"):
+                result.headers[key] = value
+    return result
+
+async def stream_json_list(cursor, build, chunk: int = JSON_STREAM_CHUNK) -> Response:
+    """JSON array of a cursor; `build` turns a chunk of documents into response models"""
+    first = await cursor.to_list(chunk)
+    if len(first) < chunk:
+        return model_list_response(await build(first))
+
+    async def encode(docs: List[dict]) -> bytes:
+        return b",".join(orjson.dumps(item.model_dump()) for item in await build(docs))
+
+    head = b"[" + await encode(first)
+
+    async def chunks():
+        yield head
+        docs = []
+        try:
+            async for doc in cursor:
+                docs.append(doc)
+                if len(docs) >= chunk:
+                    yield b"," + await encode(docs)
+                    docs = []
+            yield (b"," + await encode(docs) if docs else b"") + b"]"
+        except Exception as e:
+            logging.error(f"JSON list stream failed after the response started: {e!r}")
+            raise
+
+    return StreamingResponse(chunks(), media_type="application/json")
+
 security = HTTPBearer()
 optional_security = HTTPBearer(auto_error=False)
 
@@ -642,9 +1196,129 @@ async def create_activity_log(
         "resource_id": resource_id,
         "description": description,
         "ip_address": ip_address,
-        "timestamp": datetime.now(timezone.utc).isoformat()
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "search_terms": log_search_terms(user_name, user_email, description),
+        "request_id": current_request_id()
     }
-    await db.activity_logs.insert_one(log_doc)
+    await activity_log_writer.write(log_doc)
+
+# Activity logs are written off the request path: entries are queued and a
+# background task flushes them with insert_many.
+ACTIVITY_LOG_QUEUE_SIZE = int(os.environ.get('ACTIVITY_LOG_QUEUE_SIZE', 10000))
+ACTIVITY_LOG_BATCH_SIZE = int(os.environ.get('ACTIVITY_LOG_BATCH_SIZE', 200))
+ACTIVITY_LOG_FLUSH_MS = int(os.environ.get('ACTIVITY_LOG_FLUSH_MS', 500))
+
+class ActivityLogWriter:
+    """Buffered activity-log writer: bounded queue, batched inserts, sync fallback"""
+
+    def __init__(self, queue_size: int, batch_size: int, flush_ms: int):
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_seconds = flush_ms / 1000
+        self.queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.metrics = {"enqueued": 0, "written": 0, "sync_writes": 0, "dropped": 0, "flushes": 0}
+
+    def start(self):
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self._task = asyncio.create_task(self._run())
+
+    async def write(self, log_doc: dict):
+        if self._task is not None and not self._task.done():
+            try:
+                self.queue.put_nowait(log_doc)
+                self.metrics["enqueued"] += 1
+                return
+            except asyncio.QueueFull:
+                pass
+        # Queue full or writer not running: write inline rather than lose the entry
+        try:
+            await activity_log_store.insert_one(log_doc)
+            self.metrics["sync_writes"] += 1
+        except Exception as e:
+            self.metrics["dropped"] += 1
+            logging.error(f"Activity log dropped: {e}")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        batch = []
+        try:
+            while True:
+                batch = [await self.queue.get()]
+                deadline = loop.time() + self.flush_seconds
+                while len(batch) < self.batch_size:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+                await self._flush(batch)
+                for _ in batch:
+                    self.queue.task_done()
+                batch = []
+        except asyncio.CancelledError:
+            if batch:
+                await self._flush(batch)
+            raise
+
+    async def _flush(self, batch: List[dict]):
+        self.metrics["flushes"] += 1
+        try:
+            await activity_log_store.insert_many(batch, ordered=False)
+            self.metrics["written"] += len(batch)
+        except BulkWriteError as e:
+            # Duplicate ids mean a retried batch was already stored
+            errors = e.details.get("writeErrors", [])
+            lost = sum(1 for err in errors if err.get("code") != 11000)
+            self.metrics["written"] += len(batch) - lost
+            self.metrics["dropped"] += lost
+            if lost:
+                logging.error(f"Activity log flush lost {lost} entr(ies): {errors[0].get('errmsg')}")
+        except Exception as e:
+            self.metrics["dropped"] += len(batch)
+            logging.error(f"Activity log flush failed, {len(batch)} entr(ies) dropped: {e}")
+
+    async def flush(self, timeout: float = 2.0):
+        """Write out queued entries now, so log viewers see their own actions"""
+        if self.queue is None:
+            return
+        while not self.queue.empty():
+            batch = [self.queue.get_nowait() for _ in range(min(self.batch_size, self.queue.qsize()))]
+            await self._flush(batch)
+            for _ in batch:
+                self.queue.task_done()
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)  # Batch already taken by the flusher
+        except asyncio.TimeoutError:
+            pass
+
+    async def stop(self):
+        """Stop the flusher and write out everything still queued"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        while not self.queue.empty():
+            batch = [self.queue.get_nowait() for _ in range(min(self.batch_size, self.queue.qsize()))]
+            await self._flush(batch)
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue.qsize() if self.queue else 0,
+            "queue_capacity": self.queue_size,
+            "running": self._task is not None and not self._task.done(),
+            **self.metrics
+        }
+
+activity_log_writer = ActivityLogWriter(ACTIVITY_LOG_QUEUE_SIZE, ACTIVITY_LOG_BATCH_SIZE, ACTIVITY_LOG_FLUSH_MS)
+metrics.gauge("activity_log_queue_depth", "Activity logs waiting to be flushed",
+              lambda: activity_log_writer.stats()["queue_depth"])
+metrics.gauge("activity_log_entries", "Activity log writer counters", lambda: [
+    ({"state": key}, activity_log_writer.metrics[key]) for key in ("written", "sync_writes", "dropped")
+])
 
 
 async def get_smtp_settings(company_id: str = None):
@@ -663,6 +1337,13 @@ async def get_smtp_settings(company_id: str = None):
             return smtp
     return None
 
+async def send_logged(send, what: str):
+    """Await an email send started in the background, logging instead of raising"""
+    try:
+        await send
+    except Exception as e:
+        logging.error(f"Failed to send {what}: {e}")
+
 async def send_notification_email(to_email: str, subject: str, html_body: str, text_body: str, company_id: str = None):
     """Send email notification using SMTP. Returns True on success, False on failure."""
     import smtplib
@@ -707,12 +1388,18 @@ async def send_notification_email(to_email: str, subject: str, html_body: str, t
     
     try:
         # Run synchronous smtplib in thread pool to avoid blocking event loop
-        await asyncio.to_thread(_send)
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(_send)
+        except Exception:
+            metrics.observe("smtp_send_duration_seconds", {"outcome": "error"}, time.perf_counter() - started)
+            raise
+        metrics.observe("smtp_send_duration_seconds", {"outcome": "ok"}, time.perf_counter() - started)
         logging.info(f"Email sent to {to_email}: {subject}")
         # Store success log
-        await db.email_logs.insert_one({
-            "to": to_email, "subject": subject, "status": "sent",
-            "company_id": company_id,
+        await email_log_store.insert_one({
+            "id": str(uuid.uuid4()), "to": to_email, "subject": subject, "status": "sent",
+            "company_id": company_id, "request_id": current_request_id(),
             "timestamp": datetime.now(timezone.utc).isoformat()
         })
         return True
@@ -720,10 +1407,11 @@ async def send_notification_email(to_email: str, subject: str, html_body: str, t
         error_msg = str(e)
         logging.error(f"Failed to send email to {to_email}: {error_msg}")
         # Store error log for visibility
-        await db.email_logs.insert_one({
-            "to": to_email, "subject": subject, "status": "failed",
+        await email_log_store.insert_one({
+            "id": str(uuid.uuid4()), "to": to_email, "subject": subject, "status": "failed",
             "error": error_msg, "company_id": company_id,
             "smtp_host": smtp.get("host"), "smtp_port": smtp.get("port"),
+            "request_id": current_request_id(),
             "timestamp": datetime.now(timezone.utc).isoformat()
         })
         return False
@@ -748,13 +1436,10 @@ def build_email_footer(company_name: str):
         <p style="color:#9ca3af;font-size:12px;margin:0;">2026 {company_name}</p>
     </div>'''
 
-async def send_application_confirmation_email(application: dict, job: dict, company: dict):
-    """Send confirmation email when applicant submits application"""
+def build_application_confirmation_email(application: dict, job: dict, company: dict) -> tuple:
+    """(subject, html, text) of the application received email"""
     form_data = application.get("form_data", {})
     applicant_name = form_data.get("full_name", form_data.get("name", "Pelamar"))
-    applicant_email = form_data.get("email")
-    if not applicant_email:
-        return
     
     company_name = company.get("name", "Perusahaan")
     job_title = job.get("title", "Posisi")
@@ -783,16 +1468,22 @@ async def send_application_confirmation_email(application: dict, job: dict, comp
     </div>'''
     
     text_body = f"Halo {applicant_name},\n\nTerima kasih telah melamar posisi {job_title} di {company_name}.\nLamaran Anda telah kami terima dan sedang dalam proses peninjauan.\n\nPosisi: {job_title}\nPerusahaan: {company_name}\nStatus: Menunggu Review\n\nKami akan menghubungi Anda jika ada perkembangan."
+    return subject, html_body, text_body
+
+async def send_application_confirmation_email(application: dict, job: dict, company: dict):
+    """Send confirmation email when applicant submits application"""
+    applicant_email = application.get("form_data", {}).get("email")
+    if not applicant_email:
+        return
+    
+    subject, html_body, text_body = build_application_confirmation_email(application, job, company)
     
     await send_notification_email(applicant_email, subject, html_body, text_body, company.get("id"))
 
-async def send_status_update_email(application: dict, job: dict, company: dict, old_status: str, new_status: str):
-    """Send notification email when application status is updated"""
+def build_status_update_email(application: dict, job: dict, company: dict, old_status: str, new_status: str) -> tuple:
+    """(subject, html, text) of the application status email"""
     form_data = application.get("form_data", {})
     applicant_name = form_data.get("full_name", form_data.get("name", "Pelamar"))
-    applicant_email = form_data.get("email")
-    if not applicant_email:
-        return
     
     company_name = company.get("name", "Perusahaan")
     job_title = job.get("title", "Posisi")
@@ -839,6 +1530,15 @@ async def send_status_update_email(application: dict, job: dict, company: dict,
     </div>'''
     
     text_body = f"Halo {applicant_name},\n\nAda pembaruan status lamaran Anda:\n\nPosisi: {job_title}\nPerusahaan: {company_name}\nStatus Baru: {status_label}\nStatus Sebelumnya: {old_status_label}\n\n{closing_msg}"
+    return subject, html_body, text_body
+
+async def send_status_update_email(application: dict, job: dict, company: dict, old_status: str, new_status: str):
+    """Send notification email when application status is updated"""
+    applicant_email = application.get("form_data", {}).get("email")
+    if not applicant_email:
+        return
+    
+    subject, html_body, text_body = build_status_update_email(application, job, company, old_status, new_status)
     
     await send_notification_email(applicant_email, subject, html_body, text_body, company.get("id"))
 
@@ -925,7 +1625,8 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         user_id = payload.get("user_id")
         role = payload.get("role")
         
-        if not user_id:
+        # Purpose-bound tokens (profiling grants) are never login tokens
+        if not user_id or "purpose" in payload:
             raise HTTPException(status_code=401, detail="Invalid token")
         
         # Check superadmins table first
@@ -934,6 +1635,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             if user:
                 user["role"] = "super_admin"
                 user["company_id"] = None
+                tag_request(None, "super_admin")
                 return user
         
         # Check users table (company users)
@@ -941,6 +1643,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         if not user:
             raise HTTPException(status_code=401, detail="User not found")
         
+        tag_request(user.get("company_id"), user.get("role"))
         return user
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
@@ -955,7 +1658,7 @@ async def get_optional_user(credentials: HTTPAuthorizationCredentials = Depends(
         user_id = payload.get("user_id")
         role = payload.get("role")
         
-        if not user_id:
+        if not user_id or "purpose" in payload:
             return None
         
         # Check superadmins table first
@@ -1030,6 +1733,311 @@ async def startup_event():
     else:
         logging.info(f"Super admins already exist: {total_admins} admin(s)")
 
+@app.on_event("startup")
+async def ensure_indexes():
+    """Create indexes and backfill derived fields that query paths depend on."""
+    # Outlets saved before geofencing used GeoJSON points
+    backfill = await db.outlets.update_many(
+        {"latitude": {"$gte": -90, "$lte": 90}, "longitude": {"$gte": -180, "$lte": 180}, "location": {"$exists": False}},
+        [{"$set": {"location": {"type": "Point", "coordinates": ["$longitude", "$latitude"]}}}]
+    )
+    if backfill.modified_count:
+        logging.info(f"Backfilled GeoJSON location on {backfill.modified_count} outlet(s)")
+    await db.outlets.create_index([("location", "2dsphere")])
+    await db.outlets.create_index([("company_id", 1), ("id", 1)])
+    await db.config_versions.create_index("company_id", unique=True)
+    await db.config_versions.create_index("updated_at")
+    await db.attendance.create_index([("company_id", 1), ("employee_active", 1), ("day", -1)])
+    await db.attendance.create_index([("company_id", 1), ("employee_removed", 1), ("day", -1)])
+    await db.attendance.create_index([("employee_id", 1), ("company_id", 1), ("day", -1)])
+    await db.attendance.create_index([("employee_id", 1), ("company_id", 1), ("date", 1)])
+    await db.attendance_rollups.create_index([("company_id", 1), ("employee_id", 1), ("month", 1)], unique=True)
+    await db.attendance_rollups.create_index([("company_id", 1), ("month", 1), ("employee_active", 1)])
+    await db.employees.create_index([("companies", 1), ("rev", 1), ("id", 1)])
+    await db.attendance.create_index([("company_id", 1), ("rev", 1), ("id", 1)])
+    await db.applications.create_index([("company_id", 1), ("rev", 1), ("id", 1)])
+    await db.sync_tombstones.create_index([("company_id", 1), ("collection", 1), ("rev", 1), ("id", 1)])
+    await db.log_partitions.create_index([("collection", 1), ("status", 1), ("month", 1)])
+    for store in LOG_STORES.values():
+        await store.ensure_partition(current_log_month())
+    await ensure_profile_collection()
+
+# Long-running loops owned by this worker, cancelled on shutdown
+_background_tasks: List[asyncio.Task] = []
+
+# Attendance views and delta sync filter on fields the backfill adds (day,
+# employee_active, rev); the worker reports not-ready until it has finished (deploy.sh runs
+# migrate_attendance.py before restarting, so this is normally instant).
+attendance_migration: Optional[asyncio.Task] = None
+
+def attendance_migration_state() -> str:
+    if attendance_migration is None or not attendance_migration.done():
+        return "running"
+    if attendance_migration.cancelled() or attendance_migration.exception():
+        return "failed"
+    return "done"
+
+def log_attendance_migration(task: asyncio.Task):
+    if not task.cancelled() and task.exception():
+        logging.error(f"Attendance migration failed: {task.exception()!r}")
+
+@app.on_event("startup")
+async def start_background_tasks():
+    """Start per-worker background loops."""
+    asyncio.get_running_loop().set_default_executor(thread_pool)
+    loop_monitor.start()
+    activity_log_writer.start()
+    _background_tasks.append(asyncio.create_task(sync_config_versions()))
+    global attendance_migration
+    attendance_migration = asyncio.create_task(migrate_attendance(db))
+    attendance_migration.add_done_callback(log_attendance_migration)
+    _background_tasks.append(attendance_migration)
+    _background_tasks.append(asyncio.create_task(migrate_legacy_logs(activity_log_store, prepare=prepare_legacy_activity_log)))
+    _background_tasks.append(asyncio.create_task(migrate_legacy_logs(email_log_store)))
+    _background_tasks.append(asyncio.create_task(log_retention_loop()))
+
+
+# ============ REALTIME EVENTS ============
+
+# Dashboards subscribe to a per-company server-sent events stream instead of
+# polling full lists. Events are small deltas published in-process by the
+# write paths; each worker only sees its own writes, so clients still do a
+# full refresh on (re)connect and on "resync".
+SSE_MAX_CONNECTIONS_PER_COMPANY = int(os.environ.get('SSE_MAX_CONNECTIONS_PER_COMPANY', 20))
+SSE_QUEUE_SIZE = 100  # Events buffered per connection before it is told to resync
+SSE_HEARTBEAT_SECONDS = 15
+SSE_MAX_STREAM_SECONDS = 3600  # Forces clients to reconnect (and re-auth) periodically
+
+class EventBus:
+    """In-process pub/sub of per-company dashboard events with bounded queues"""
+
+    def __init__(self, queue_size: int, max_per_company: int):
+        self.queue_size = queue_size
+        self.max_per_company = max_per_company
+        self._subscribers: Dict[str, set] = {}
+        self._next_id = 0
+
+    def subscribe(self, company_id: str) -> Optional[asyncio.Queue]:
+        """New subscriber queue, or None if the company is at its connection cap"""
+        subscribers = self._subscribers.setdefault(company_id, set())
+        if len(subscribers) >= self.max_per_company:
+            return None
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, company_id: str, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(company_id)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                self._subscribers.pop(company_id, None)
+
+    def publish(self, company_id: str, event_type: str, data: dict):
+        subscribers = self._subscribers.get(company_id)
+        if not subscribers:
+            return
+        self._next_id += 1
+        event = {"id": self._next_id, "type": event_type, "data": data}
+        for queue in list(subscribers):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Slow consumer: drop its backlog rather than grow memory; the client refetches
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait({"id": self._next_id, "type": "resync", "data": {}})
+
+    def connection_counts(self) -> Dict[str, int]:
+        return {company_id: len(subscribers) for company_id, subscribers in self._subscribers.items()}
+
+event_bus = EventBus(SSE_QUEUE_SIZE, SSE_MAX_CONNECTIONS_PER_COMPANY)
+metrics.gauge("sse_connections", "Open event streams on this worker",
+              lambda: sum(event_bus.connection_counts().values()))
+
+@api_router.get("/events/stream")
+async def stream_company_events(request: Request):
+    """Server-sent events for the admin's company (attendance & application deltas)"""
+    session = await require_session_admin(request)
+    company_id = session["company_id"]
+    queue = event_bus.subscribe(company_id)
+    if queue is None:
+        raise HTTPException(status_code=429, detail="Terlalu banyak koneksi realtime untuk perusahaan ini")
+    
+    async def stream():
+        deadline = time.monotonic() + SSE_MAX_STREAM_SECONDS
+        try:
+            yield "retry: 5000\n\n"
+            while time.monotonic() < deadline:
+                try:
+                    event = await asyncio.wait_for(queue.get(), SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": ping\n\n"
+                    continue
+                yield f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'], default=str)}\n\n"
+        finally:
+            event_bus.unsubscribe(company_id, queue)
+    
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"  # Disable nginx response buffering
+    })
+
+
+# ============ DELTA SYNC ============
+
+# Employees, attendance and applications carry a `rev` stamped from one
+# global counter on every write. `/changes?since=<cursor>` endpoints return
+# documents written after the cursor; documents that left the list (trashed,
+# soft-deleted, removed) come back as tombstones. Hard deletes leave a row in
+# sync_tombstones so they can be replayed too. Cursors are "<rev>:<id>" so
+# documents sharing a rev (update_many) page correctly.
+#
+# A rev is taken before its write commits, so a later rev can become visible
+# first. Revs are therefore hybrid clock values (MongoDB server time in ms *
+# 1000, bumped by one when several land in the same ms), and /changes only
+# serves revs older than SYNC_SAFE_LAG_MS; a write slower than that can still
+# be skipped by a client that polled in between.
+SYNC_PAGE_SIZE = 500
+SYNC_SAFE_LAG_MS = int(os.environ.get('SYNC_SAFE_LAG_MS', '5000'))
+
+async def next_rev() -> int:
+    doc = await db.counters.find_one_and_update(
+        {"_id": "sync_rev"},
+        [{"$set": {"value": {"$max": [
+            {"$add": [{"$ifNull": ["$value", 0]}, 1]},
+            {"$multiply": [{"$toLong": "$$NOW"}, 1000]}
+        ]}}}],
+        upsert=True, return_document=ReturnDocument.AFTER
+    )
+    return doc["value"]
+
+async def sync_horizon() -> int:
+    """Revs below this were taken more than SYNC_SAFE_LAG_MS ago (by the database clock)"""
+    server_now = (await db.command("hello"))["localTime"].replace(tzinfo=timezone.utc)
+    return (int(server_now.timestamp() * 1000) - SYNC_SAFE_LAG_MS) * 1000
+
+SYNC_COLLECTIONS = ("employees", "attendance", "applications")
+
+async def migrate_sync_revs(database, batch_size: int = 1000) -> int:
+    """Give documents written before revs existed rev 0, in batches"""
+    migrated = 0
+    for name in SYNC_COLLECTIONS:
+        collection = database[name]
+        while True:
+            batch = await collection.find({"rev": {"$exists": False}}, {"_id": 1}).limit(batch_size).to_list(batch_size)
+            if not batch:
+                break
+            result = await collection.update_many(
+                {"_id": {"$in": [doc["_id"] for doc in batch]}, "rev": {"$exists": False}}, {"$set": {"rev": 0}}
+            )
+            migrated += result.modified_count
+            logging.info(f"Sync rev migration: {migrated} document(s) done")
+    return migrated
+
+async def add_tombstones(company_id: str, collection: str, doc_ids: List[str]):
+    """Record hard-deleted documents so delta clients can drop them"""
+    if not doc_ids:
+        return
+    rev = await next_rev()
+    now = datetime.now(timezone.utc).isoformat()
+    await db.sync_tombstones.insert_many([
+        {"company_id": company_id, "collection": collection, "id": doc_id, "rev": rev, "deleted_at": now}
+        for doc_id in doc_ids
+    ])
+
+def parse_sync_cursor(since: str) -> tuple:
+    rev, _, doc_id = since.partition(":")
+    try:
+        return int(rev), doc_id
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor sync tidak valid")
+
+async def fetch_changes(collection, company_id: str, name: str, query: dict, since: str,
+                        is_tombstone, projection: Optional[dict] = None, limit: int = SYNC_PAGE_SIZE) -> dict:
+    """
+    One page of changes after `since`, ordered by (rev, id).
+    Returns {"upserts", "tombstones", "cursor", "has_more"}; clients pass
+    `cursor` back as `since` until has_more is false.
+    """
+    rev, doc_id = parse_sync_cursor(since)
+    after = {"$and": [
+        {"$or": [{"rev": {"$gt": rev}}, {"rev": rev, "id": {"$gt": doc_id}}]},
+        {"rev": {"$lt": await sync_horizon()}}
+    ]}
+    sort = [("rev", 1), ("id", 1)]
+    docs = await collection.find({**query, **after}, {"_id": 0, **(projection or {})}).sort(sort).limit(limit + 1).to_list(limit + 1)
+    deleted = await db.sync_tombstones.find(
+        {"company_id": company_id, "collection": name, **after}, {"_id": 0, "id": 1, "rev": 1}
+    ).sort(sort).limit(limit + 1).to_list(limit + 1)
+    
+    merged = sorted([(d["rev"], d["id"], d, False) for d in docs] + [(t["rev"], t["id"], t, True) for t in deleted],
+                    key=lambda item: (item[0], item[1]))
+    has_more = len(merged) > limit
+    merged = merged[:limit]
+    
+    upserts, tombstones = [], []
+    for _, item_id, doc, hard_deleted in merged:
+        if hard_deleted or is_tombstone(doc):
+            tombstones.append(item_id)
+        else:
+            upserts.append(doc)
+    cursor = f"{merged[-1][0]}:{merged[-1][1]}" if merged else since
+    return {"upserts": upserts, "tombstones": tombstones, "cursor": cursor, "has_more": has_more}
+
+
+# ============ COLLECTION VERSIONS ============
+
+# Tenant list endpoints answer If-None-Match from a per-(company, collection)
+# counter kept in config_versions.collections.<name>, so a repeat request is
+# one small lookup instead of a collection scan. Every write path that changes
+# what a list returns must bump its counter.
+
+async def bump_collection_version(company_ids, *collections: str):
+    """Invalidate the ETags of `collections` for one or more companies"""
+    if isinstance(company_ids, str):
+        company_ids = [company_ids]
+    company_ids = [cid for cid in set(company_ids) if cid]
+    if not company_ids:
+        return
+    now = datetime.now(timezone.utc).isoformat()
+    inc = {f"collections.{name}": 1 for name in collections}
+    await db.config_versions.bulk_write([
+        UpdateOne({"company_id": cid}, {"$inc": inc, "$set": {"updated_at": now}}, upsert=True)
+        for cid in company_ids
+    ], ordered=False)
+
+async def employee_written(employee_id: str, *extra_company_ids: str):
+    """Bump the employees list version of every company the employee belongs (or belonged) to"""
+    emp = await db.employees.find_one({"id": employee_id}, {"_id": 0, "companies": 1})
+    await bump_collection_version([*((emp or {}).get("companies") or []), *extra_company_ids], "employees")
+
+async def collection_etag(company_id: str, collection: str) -> str:
+    field = f"collections.{collection}"
+    doc = await db.config_versions.find_one({"company_id": company_id}, {"_id": 0, field: 1})
+    if doc is None:
+        doc = await db.config_versions.find_one_and_update(
+            {"company_id": company_id}, {"$inc": {field: 0}}, upsert=True,
+            projection={"_id": 0, field: 1}, return_document=ReturnDocument.AFTER
+        )
+    version = (doc.get("collections") or {}).get(collection, 0)
+    return f'"{company_id}.{collection}.{version}"'
+
+async def not_modified(request: Request, response: Response, company_id: str, collection: str) -> Optional[Response]:
+    """
+    Set ETag on `response`; return a 304 Response when the client's
+    If-None-Match already names the current version.
+    """
+    etag = await collection_etag(company_id, collection)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
 
 # ============ AUTH ROUTES ============
 
@@ -1355,9 +2363,11 @@ async def google_oauth_callback(session_id: str, response: Response):
                 "name": name,
                 "picture": picture,
                 "auth_provider": "google",
-                "updated_at": datetime.now(timezone.utc).isoformat()
+                "updated_at": datetime.now(timezone.utc).isoformat(),
+                "rev": await next_rev()
             }}
         )
+        await employee_written(employee["id"])
         
         # Get access list
         for company_id in employee.get("companies", []):
@@ -1493,6 +2503,7 @@ async def get_session_user(request: Request):
         await db.user_sessions.delete_one({"session_token": session_token})
         raise HTTPException(status_code=401, detail="Anda tidak lagi terdaftar di perusahaan ini")
     
+    tag_request(company_id, role)
     return session
 
 @api_router.get("/auth/me-session")
@@ -1725,14 +2736,16 @@ async def toggle_user_2fa(user_id: str, enable: bool, user_table: str, current_u
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    await table.update_one(
-        {"id": user_id},
-        {"$set": {
-            "totp_enabled": False if not enable else user.get("totp_enabled", False),
-            "totp_secret": None if not enable else user.get("totp_secret"),
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }}
-    )
+    update_data = {
+        "totp_enabled": False if not enable else user.get("totp_enabled", False),
+        "totp_secret": None if not enable else user.get("totp_secret"),
+        "updated_at": datetime.now(timezone.utc).isoformat()
+    }
+    if user_table == "employees":
+        update_data["rev"] = await next_rev()
+    await table.update_one({"id": user_id}, {"$set": update_data})
+    if user_table == "employees":
+        await employee_written(user_id)
     
     return {"message": f"2FA {'enabled' if enable else 'disabled'} successfully"}
 
@@ -1746,13 +2759,12 @@ async def toggle_user_active(user_id: str, active: bool, user_table: str, curren
     else:
         raise HTTPException(status_code=400, detail="Invalid user table")
     
-    await table.update_one(
-        {"id": user_id},
-        {"$set": {
-            "is_active": active,
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }}
-    )
+    update_data = {"is_active": active, "updated_at": datetime.now(timezone.utc).isoformat()}
+    if user_table == "employees":
+        update_data["rev"] = await next_rev()
+    await table.update_one({"id": user_id}, {"$set": update_data})
+    if user_table == "employees":
+        await employee_written(user_id)
     
     return {"message": f"Account {'activated' if active else 'deactivated'} successfully"}
 
@@ -1818,10 +2830,377 @@ async def get_my_profile(request: Request):
     }
 
 
+# ============ LOG PARTITIONS ============
+
+# activity_logs and email_logs are split into monthly collections
+# (activity_logs_202607, ...) behind PartitionedLog. Reads walk partitions
+# newest first and stop once the page is full, so everyday queries only
+# touch the current month. Months older than LOG_RETENTION_MONTHS are written
+# to gzip NDJSON archives in LOG_ARCHIVE_DIR and dropped; an archived month
+# can be rehydrated for audits. log_partitions records each month's state.
+
+LOG_RETENTION_MONTHS = int(os.environ.get('LOG_RETENTION_MONTHS', '12'))
+LOG_REHYDRATE_DAYS = int(os.environ.get('LOG_REHYDRATE_DAYS', '7'))
+LOG_ARCHIVE_DIR = Path(os.environ.get('LOG_ARCHIVE_DIR', str(ROOT_DIR / 'log_archive')))
+LOG_PARTITION_CACHE_TTL = 60
+LOG_LIVE_STATUSES = ["hot", "rehydrated"]
+
+def current_log_month() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m")
+
+def log_month(doc: dict) -> str:
+    return (doc.get("timestamp") or datetime.now(timezone.utc).isoformat())[:7]
+
+class PartitionedLog:
+    """Monthly partitions of one log collection, read newest first"""
+
+    def __init__(self, name: str, indexes: List[tuple]):
+        self.name = name
+        self.indexes = indexes
+        self._ensured = set()
+        self._live = None  # (loaded_at, months newest first)
+        self.legacy_drained = False
+
+    def partition(self, month: str) -> str:
+        return f"{self.name}_{month.replace('-', '')}"
+
+    async def ensure_partition(self, month: str) -> str:
+        name = self.partition(month)
+        if name not in self._ensured:
+            for keys, options in self.indexes:
+                await db[name].create_index(keys, **options)
+            await db.log_partitions.update_one(
+                {"_id": name},
+                {"$setOnInsert": {"collection": self.name, "month": month, "status": "hot",
+                                  "created_at": datetime.now(timezone.utc).isoformat()}},
+                upsert=True
+            )
+            self._ensured.add(name)
+            self._live = None
+        return name
+
+    async def live_months(self) -> List[str]:
+        """Queryable months, newest first; the current month is always included"""
+        if self._live is None or time.monotonic() - self._live[0] > LOG_PARTITION_CACHE_TTL:
+            docs = await db.log_partitions.find(
+                {"collection": self.name, "status": {"$in": LOG_LIVE_STATUSES}}, {"month": 1}
+            ).to_list(None)
+            self._live = (time.monotonic(), [d["month"] for d in docs])
+        return sorted(set(self._live[1]) | {current_log_month()}, reverse=True)
+
+    async def months_between(self, oldest: Optional[str], newest: Optional[str]) -> List[str]:
+        return [
+            m for m in await self.live_months()
+            if (not newest or m <= newest[:7]) and (not oldest or m >= oldest[:7])
+        ]
+
+    async def insert_one(self, doc: dict):
+        await db[await self.ensure_partition(log_month(doc))].insert_one(doc)
+
+    async def insert_many(self, docs: List[dict], ordered: bool = False):
+        """Insert into each doc's month; write errors from all months are raised together"""
+        by_month: Dict[str, List[dict]] = {}
+        for doc in docs:
+            by_month.setdefault(log_month(doc), []).append(doc)
+        errors, inserted = [], 0
+        for month, batch in by_month.items():
+            try:
+                result = await db[await self.ensure_partition(month)].insert_many(batch, ordered=ordered)
+                inserted += len(result.inserted_ids)
+            except BulkWriteError as e:
+                errors.extend(e.details.get("writeErrors", []))
+                inserted += e.details.get("nInserted", 0)
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": inserted})
+
+    async def find(self, query: dict, projection: dict, limit: int, skip: int = 0,
+                   oldest: Optional[str] = None, newest: Optional[str] = None) -> List[dict]:
+        """Rows ordered by (timestamp, id) desc. oldest/newest are ISO timestamps
+        bounding the query, used to skip partitions outside the range."""
+        want = skip + limit
+        sort = [("timestamp", -1), ("id", -1)]
+        rows = []
+        for month in await self.months_between(oldest, newest):
+            rows += await db[self.partition(month)].find(query, projection).sort(sort).limit(want - len(rows)).to_list(None)
+            if len(rows) >= want:
+                break
+        if not self.legacy_drained:
+            # Rows not yet moved out of the unpartitioned collection
+            legacy = await db[self.name].find(query, projection).sort(sort).limit(want).to_list(None)
+            if legacy:
+                rows = sorted(rows + legacy, key=lambda r: (r.get("timestamp") or "", r.get("id") or ""), reverse=True)
+        return rows[skip:want]
+
+    async def stream(self, query: dict, projection: dict, oldest: Optional[str] = None,
+                     newest: Optional[str] = None, batch_size: int = 1000):
+        """Yield every matching row, newest month first, holding one cursor batch at a time"""
+        sort = [("timestamp", -1), ("id", -1)]
+        for month in await self.months_between(oldest, newest):
+            async for doc in db[self.partition(month)].find(query, projection).sort(sort).batch_size(batch_size):
+                yield doc
+        if not self.legacy_drained:
+            async for doc in db[self.name].find(query, projection).sort(sort).batch_size(batch_size):
+                yield doc
+
+    async def count(self, query: dict, cap: int, oldest: Optional[str] = None,
+                    newest: Optional[str] = None) -> int:
+        """Count up to cap + 1 (so callers can tell the cap was exceeded)"""
+        total = 0
+        for month in await self.months_between(oldest, newest):
+            total += await db[self.partition(month)].count_documents(query, limit=cap + 1 - total)
+            if total > cap:
+                return total
+        if not self.legacy_drained:
+            total += await db[self.name].count_documents(query, limit=cap + 1 - total)
+        return total
+
+activity_log_store = PartitionedLog("activity_logs", [
+    ("id", {"unique": True}),
+    ([("timestamp", -1), ("id", -1)], {}),
+    ([("company_id", 1), ("timestamp", -1), ("id", -1)], {}),
+    ([("search_terms", 1), ("timestamp", -1), ("id", -1)], {}),
+    ([("company_id", 1), ("search_terms", 1), ("timestamp", -1), ("id", -1)], {}),
+])
+email_log_store = PartitionedLog("email_logs", [
+    ([("timestamp", -1), ("id", -1)], {}),
+    ([("company_id", 1), ("timestamp", -1), ("id", -1)], {}),
+])
+LOG_STORES = {store.name: store for store in (activity_log_store, email_log_store)}
+
+
+async def migrate_legacy_logs(store: PartitionedLog, batch_size: int = 1000, prepare=None) -> int:
+    """Move rows from the unpartitioned collection into monthly partitions.
+    _id is kept, so a batch re-run after a crash is a no-op."""
+    moved = 0
+    while True:
+        batch = await db[store.name].find({}).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not batch:
+            store.legacy_drained = True
+            return moved
+        if prepare:
+            for doc in batch:
+                prepare(doc)
+        try:
+            await store.insert_many(batch)
+        except BulkWriteError as e:
+            failed = [err for err in e.details["writeErrors"] if err.get("code") != 11000]
+            if failed:
+                logging.error(f"{store.name} partition migration stopped: {failed[0].get('errmsg')}")
+                return moved
+        await db[store.name].delete_many({"_id": {"$in": [doc["_id"] for doc in batch]}})
+        moved += len(batch)
+        logging.info(f"{store.name} partition migration: {moved} row(s) moved")
+
+
+async def write_log_archive(collection: str) -> tuple:
+    """Dump one partition to <LOG_ARCHIVE_DIR>/<collection>.ndjson.gz; returns (path, rows)"""
+    LOG_ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+    path = LOG_ARCHIVE_DIR / f"{collection}.ndjson.gz"
+    tmp = LOG_ARCHIVE_DIR / f"{collection}.ndjson.gz.tmp"
+    rows = 0
+    fh = await asyncio.to_thread(gzip.open, tmp, "wt", encoding="utf-8")
+    try:
+        cursor = db[collection].find({}, {"_id": 0}).sort([("timestamp", 1), ("id", 1)]).batch_size(1000)
+        lines = []
+        async for doc in cursor:
+            lines.append(json.dumps(doc, default=str, ensure_ascii=False))
+            if len(lines) >= 1000:
+                await asyncio.to_thread(fh.write, "\n".join(lines) + "\n")
+                rows += len(lines)
+                lines = []
+        if lines:
+            await asyncio.to_thread(fh.write, "\n".join(lines) + "\n")
+            rows += len(lines)
+    finally:
+        await asyncio.to_thread(fh.close)
+    await asyncio.to_thread(os.replace, tmp, path)
+    return path, rows
+
+
+async def archive_log_partitions(store: PartitionedLog, retention_months: int = LOG_RETENTION_MONTHS) -> List[str]:
+    """Archive and drop partitions older than retention_months; drop expired rehydrations"""
+    now = datetime.now(timezone.utc)
+    year, month = divmod(now.year * 12 + now.month - 1 - retention_months, 12)
+    cutoff = f"{year:04d}-{month + 1:02d}"
+    rehydrate_expiry = (now - timedelta(days=LOG_REHYDRATE_DAYS)).isoformat()
+    claim_expiry = (now - timedelta(hours=1)).isoformat()
+    archived = []
+    candidates = await db.log_partitions.find(
+        {"collection": store.name, "month": {"$lt": cutoff}, "status": {"$in": LOG_LIVE_STATUSES}}
+    ).to_list(None)
+    for part in candidates:
+        if part["status"] == "rehydrated" and part.get("rehydrated_at", "") > rehydrate_expiry:
+            continue
+        # Claim the month so concurrent workers don't archive it twice
+        claimed = await db.log_partitions.find_one_and_update(
+            {"_id": part["_id"], "status": part["status"],
+             "$or": [{"archiving_at": {"$exists": False}}, {"archiving_at": {"$lt": claim_expiry}}]},
+            {"$set": {"archiving_at": now.isoformat()}}
+        )
+        if not claimed:
+            continue
+        update = {"status": "archived", "archived_at": now.isoformat()}
+        if part["status"] == "hot":
+            path, rows = await write_log_archive(part["_id"])
+            expected = await db[part["_id"]].count_documents({})
+            if rows != expected:
+                logging.error(f"Archive of {part['_id']} wrote {rows} of {expected} row(s), partition kept")
+                await db.log_partitions.update_one({"_id": part["_id"]}, {"$unset": {"archiving_at": ""}})
+                continue
+            update.update({"archive_path": str(path), "rows": rows})
+        # A rehydrated month is dropped again; its archive file is still on disk
+        await db.log_partitions.update_one({"_id": part["_id"]}, {"$set": update, "$unset": {"archiving_at": ""}})
+        await db.drop_collection(part["_id"])
+        store._ensured.discard(part["_id"])
+        archived.append(part["_id"])
+        logging.info(f"Log partition {part['_id']} archived")
+    store._live = None
+    return archived
+
+
+async def rehydrate_log_partition(store: PartitionedLog, month: str) -> int:
+    """Load an archived month back into its partition so audits can query it"""
+    name = store.partition(month)
+    part = await db.log_partitions.find_one({"_id": name})
+    if not part or part.get("status") == "hot":
+        raise HTTPException(status_code=404, detail="Arsip log untuk bulan ini tidak ditemukan")
+    path = Path(part["archive_path"])
+    if not path.exists():
+        raise HTTPException(status_code=404, detail="File arsip log tidak ditemukan")
+    await db.drop_collection(name)  # Replace any partial earlier rehydration
+    rows = 0
+    fh = await asyncio.to_thread(gzip.open, path, "rt", encoding="utf-8")
+    try:
+        while True:
+            lines = await asyncio.to_thread(fh.readlines, 1 << 20)
+            if not lines:
+                break
+            docs = [json.loads(line) for line in lines if line.strip()]
+            await db[name].insert_many(docs, ordered=False)
+            rows += len(docs)
+    finally:
+        await asyncio.to_thread(fh.close)
+    store._ensured.discard(name)
+    await store.ensure_partition(month)
+    await db.log_partitions.update_one(
+        {"_id": name}, {"$set": {"status": "rehydrated", "rehydrated_at": datetime.now(timezone.utc).isoformat()}}
+    )
+    store._live = None
+    logging.info(f"Log partition {name} rehydrated: {rows} row(s)")
+    return rows
+
+
+async def log_retention_loop():
+    """Daily archive pass over every partitioned log"""
+    while True:
+        for store in LOG_STORES.values():
+            if not store.legacy_drained:
+                continue  # Old rows could still land in a month being archived
+            try:
+                await archive_log_partitions(store)
+            except Exception as e:
+                logging.error(f"Log retention for {store.name} failed: {e}")
+        await asyncio.sleep(24 * 3600)
+
+
+# ============ ACTIVITY LOG SEARCH ============
+
+# Log search runs on search_terms, an indexed array of lowercase word prefixes
+# (edge n-grams) of user_name, user_email and description, instead of an
+# unanchored regex over every row. Listings page by (timestamp, id) keyset.
+
+LOG_SEARCH_MIN_PREFIX = 2
+LOG_SEARCH_MAX_PREFIX = 20
+LOG_COUNT_CAP = int(os.environ.get('LOG_COUNT_CAP', '10000'))
+LOG_PROJECTION = {"_id": 0, "search_terms": 0}
+
+def log_search_words(text: str) -> List[str]:
+    return [w for w in re.split(r"[^\w]+", (text or "").lower()) if len(w) >= LOG_SEARCH_MIN_PREFIX]
+
+def log_search_terms(*texts: str) -> List[str]:
+    """Edge n-grams of every word, e.g. "lucky" -> lu, luc, luck, lucky"""
+    terms = set()
+    for text in texts:
+        for word in log_search_words(text):
+            for size in range(LOG_SEARCH_MIN_PREFIX, min(len(word), LOG_SEARCH_MAX_PREFIX) + 1):
+                terms.add(word[:size])
+    return sorted(terms)
+
+def log_search_filter(search: str) -> List[dict]:
+    """Index lookup on word prefixes, then an exact phrase check on the candidates"""
+    words = {w[:LOG_SEARCH_MAX_PREFIX] for w in log_search_words(search)}
+    phrase = {"$regex": re.escape(search.strip()), "$options": "i"}
+    clauses = [{"$or": [{"user_name": phrase}, {"user_email": phrase}, {"description": phrase}]}]
+    if words:
+        clauses.insert(0, {"search_terms": {"$all": sorted(words)}})
+    return clauses
+
+def log_cursor(log: dict) -> str:
+    return f"{log['timestamp']}|{log['id']}"
+
+def log_cursor_filter(cursor: str) -> dict:
+    """Rows strictly after the cursor in (timestamp desc, id desc) order"""
+    timestamp, _, log_id = cursor.partition("|")
+    if not timestamp or not log_id:
+        raise HTTPException(status_code=400, detail="Cursor tidak valid")
+    return {"$or": [
+        {"timestamp": {"$lt": timestamp}},
+        {"timestamp": timestamp, "id": {"$lt": log_id}}
+    ]}
+
+def activity_log_base(company_id: Optional[str] = None, user_id: Optional[str] = None,
+                      action: Optional[str] = None, resource_type: Optional[str] = None) -> dict:
+    """Exact-match filters shared by the log listings and exports"""
+    fields = {"company_id": company_id, "user_id": user_id, "action": action, "resource_type": resource_type}
+    return {key: value for key, value in fields.items() if value}
+
+def activity_log_query(base: dict, search: Optional[str], start_date: Optional[str],
+                       end_date: Optional[str], cursor: Optional[str] = None) -> dict:
+    """Shared filter for the log listings"""
+    query = dict(base)
+    clauses = []
+    if search and search.strip():
+        clauses.extend(log_search_filter(search))
+    if start_date or end_date:
+        date_query = {}
+        if start_date:
+            date_query["$gte"] = start_date
+        if end_date:
+            # Add one day to include end_date fully
+            end_dt = datetime.fromisoformat(end_date) + timedelta(days=1)
+            date_query["$lt"] = end_dt.isoformat()
+        query["timestamp"] = date_query
+    if cursor:
+        clauses.append(log_cursor_filter(cursor))
+    if clauses:
+        query["$and"] = clauses
+    return query
+
+def activity_log_bounds(start_date: Optional[str], end_date: Optional[str],
+                        cursor: Optional[str] = None) -> Dict[str, Optional[str]]:
+    """Time range of a listing, so only the partitions inside it are read"""
+    newest = [t for t in (
+        (datetime.fromisoformat(end_date) + timedelta(days=1)).isoformat() if end_date else None,
+        cursor.partition("|")[0] if cursor else None
+    ) if t]
+    return {"oldest": start_date, "newest": min(newest) if newest else None}
+
+async def count_activity_logs(query: dict, bounds: dict) -> Dict[str, Any]:
+    """Exact count up to LOG_COUNT_CAP, so a year of history never needs a full scan"""
+    total = await activity_log_store.count(query, LOG_COUNT_CAP, **bounds)
+    return {"total": min(total, LOG_COUNT_CAP), "total_capped": total > LOG_COUNT_CAP}
+
+def prepare_legacy_activity_log(log: dict):
+    """Fill search_terms on logs written before the search index existed"""
+    if "search_terms" not in log:
+        log["search_terms"] = log_search_terms(log.get("user_name"), log.get("user_email"), log.get("description"))
+
+
 # ============ ACTIVITY LOGS ============
 
 @api_router.get("/logs")
 async def get_activity_logs(
+    response: Response,
     current_user: dict = Depends(require_super_admin),
     user_id: Optional[str] = None,
     action: Optional[str] = None,
@@ -1830,38 +3209,19 @@ async def get_activity_logs(
     search: Optional[str] = None,
     start_date: Optional[str] = None,  # ISO format: 2026-01-01
     end_date: Optional[str] = None,    # ISO format: 2026-12-31
+    cursor: Optional[str] = None,      # X-Next-Cursor of the previous page
     limit: int = 100
 ):
     """Get activity logs (Super Admin only) with date range filter"""
-    query = {}
-    
-    if user_id:
-        query["user_id"] = user_id
-    if action:
-        query["action"] = action
-    if resource_type:
-        query["resource_type"] = resource_type
-    if company_id:
-        query["company_id"] = company_id
-    if search:
-        query["$or"] = [
-            {"user_name": {"$regex": search, "$options": "i"}},
-            {"user_email": {"$regex": search, "$options": "i"}},
-            {"description": {"$regex": search, "$options": "i"}}
-        ]
-    
-    # Date range filter
-    if start_date or end_date:
-        date_query = {}
-        if start_date:
-            date_query["$gte"] = start_date
-        if end_date:
-            # Add one day to include end_date fully
-            end_dt = datetime.fromisoformat(end_date) + timedelta(days=1)
-            date_query["$lt"] = end_dt.isoformat()
-        query["timestamp"] = date_query
-    
-    logs = await db.activity_logs.find(query, {"_id": 0}).sort("timestamp", -1).limit(limit).to_list(limit)
+    await activity_log_writer.flush()
+    limit = max(1, min(limit, 500))
+    base = activity_log_base(company_id, user_id, action, resource_type)
+    query = activity_log_query(base, search, start_date, end_date, cursor)
+    bounds = activity_log_bounds(start_date, end_date, cursor)
+    
+    logs = await activity_log_store.find(query, LOG_PROJECTION, limit, **bounds)
+    if len(logs) == limit:
+        response.headers["X-Next-Cursor"] = log_cursor(logs[-1])
     return logs
 
 @api_router.get("/logs/me")
@@ -1872,36 +3232,102 @@ async def get_my_activity_logs(
     search: Optional[str] = None,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
+    cursor: Optional[str] = None,
     skip: int = 0,
     limit: int = 50
 ):
-    """Get activity logs for current company (Company Admin only) with pagination"""
+    """Get activity logs for current company (Company Admin only).
+    Page with next_cursor; skip is kept for old clients. total is only
+    counted on the first page and stops at LOG_COUNT_CAP (total_capped)."""
     session = await require_session_admin(request)
-    
-    query = {"company_id": session["company_id"]}
-    
-    if action:
-        query["action"] = action
-    if resource_type:
-        query["resource_type"] = resource_type
-    if search:
-        query["$or"] = [
-            {"user_name": {"$regex": search, "$options": "i"}},
-            {"user_email": {"$regex": search, "$options": "i"}},
-            {"description": {"$regex": search, "$options": "i"}}
-        ]
-    if start_date or end_date:
-        date_query = {}
-        if start_date:
-            date_query["$gte"] = start_date
-        if end_date:
-            end_dt = datetime.fromisoformat(end_date) + timedelta(days=1)
-            date_query["$lt"] = end_dt.isoformat()
-        query["timestamp"] = date_query
-    
-    total = await db.activity_logs.count_documents(query)
-    logs = await db.activity_logs.find(query, {"_id": 0}).sort("timestamp", -1).skip(skip).limit(limit).to_list(limit)
-    return {"logs": logs, "total": total, "skip": skip, "limit": limit}
+    await activity_log_writer.flush()
+    limit = max(1, min(limit, 200))
+    
+    base = activity_log_base(session["company_id"], action=action, resource_type=resource_type)
+    query = activity_log_query(base, search, start_date, end_date, cursor)
+    bounds = activity_log_bounds(start_date, end_date, cursor)
+    
+    counts = {"total": None, "total_capped": False}
+    if not cursor:
+        counts = await count_activity_logs(query, bounds)
+    skip = 0 if cursor else max(skip, 0)
+    logs = await activity_log_store.find(query, LOG_PROJECTION, limit, skip=skip, **bounds)
+    next_cursor = log_cursor(logs[-1]) if len(logs) == limit else None
+    return {"logs": logs, **counts, "skip": skip, "limit": limit, "next_cursor": next_cursor}
+
+LOG_EXPORT_COLUMNS = ["timestamp", "user_name", "user_email", "user_role", "company_name",
+                      "action", "resource_type", "resource_id", "description", "ip_address"]
+LOG_EXPORT_CHUNK = 500
+
+def csv_safe(value) -> str:
+    """Neutralise spreadsheet formulas in exported cells"""
+    text = "" if value is None else str(value)
+    return "'" + text if text[:1] in ("=", "+", "-", "@") else text
+
+def activity_log_export(query: dict, bounds: dict, fmt: str, name: str) -> StreamingResponse:
+    """Stream matching logs as NDJSON or CSV in chunks of LOG_EXPORT_CHUNK rows"""
+    if fmt not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="Format export harus ndjson atau csv")
+
+    def encode(rows: List[dict]) -> str:
+        if fmt == "ndjson":
+            return "".join(json.dumps(row, default=str, ensure_ascii=False) + "\n" for row in rows)
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerows([csv_safe(row.get(col)) for col in LOG_EXPORT_COLUMNS] for row in rows)
+        return out.getvalue()
+
+    async def chunks():
+        if fmt == "csv":
+            yield "\ufeff" + ",".join(LOG_EXPORT_COLUMNS) + "\r\n"  # BOM so Excel reads UTF-8
+        rows = []
+        async for log in activity_log_store.stream(query, LOG_PROJECTION, batch_size=LOG_EXPORT_CHUNK, **bounds):
+            rows.append(log)
+            if len(rows) >= LOG_EXPORT_CHUNK:
+                yield encode(rows)
+                rows = []
+        if rows:
+            yield encode(rows)
+
+    media_type = "application/x-ndjson" if fmt == "ndjson" else "text/csv; charset=utf-8"
+    filename = f"{name}_{datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')}.{fmt}"
+    return StreamingResponse(chunks(), media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+@api_router.get("/logs/export")
+async def export_activity_logs(
+    current_user: dict = Depends(require_super_admin),
+    user_id: Optional[str] = None,
+    action: Optional[str] = None,
+    resource_type: Optional[str] = None,
+    company_id: Optional[str] = None,
+    search: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    format: str = "ndjson"
+):
+    """Export all matching activity logs (Super Admin only) as NDJSON or CSV"""
+    await activity_log_writer.flush()
+    base = activity_log_base(company_id, user_id, action, resource_type)
+    query = activity_log_query(base, search, start_date, end_date)
+    return activity_log_export(query, activity_log_bounds(start_date, end_date), format, "activity_logs")
+
+@api_router.get("/logs/me/export")
+async def export_my_activity_logs(
+    request: Request,
+    action: Optional[str] = None,
+    resource_type: Optional[str] = None,
+    search: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    format: str = "csv"
+):
+    """Export the current company's activity logs (Company Admin only) as CSV or NDJSON"""
+    session = await require_session_admin(request)
+    await activity_log_writer.flush()
+    base = activity_log_base(session["company_id"], action=action, resource_type=resource_type)
+    query = activity_log_query(base, search, start_date, end_date)
+    return activity_log_export(query, activity_log_bounds(start_date, end_date), format, "log_aktivitas")
 
 class ProfileUpdate(BaseModel):
     name: Optional[str] = None
@@ -1941,8 +3367,12 @@ async def update_my_profile(data: ProfileUpdate, request: Request):
             raise HTTPException(status_code=400, detail="Email already in use")
     
     update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
+    if table_name == "employees":
+        update_data["rev"] = await next_rev()
     
     await table.update_one({"id": session["user_id"]}, {"$set": update_data})
+    if table_name == "employees":
+        await employee_written(session["user_id"])
     
     # Update session if name or email changed
     if "name" in update_data or "email" in update_data:
@@ -1991,7 +3421,9 @@ async def fill_my_profile_data(request: Request):
     
     if update_data:
         update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
+        update_data["rev"] = await next_rev()
         await db.employees.update_one({"id": session["user_id"]}, {"$set": update_data})
+        await employee_written(session["user_id"])
     
     return {
         "message": f"{len(update_data)} field berhasil diisi" + (f", {len(skipped)} field dilewati (sudah terisi)" if skipped else ""),
@@ -2222,6 +3654,42 @@ async def get_dashboard_stats(current_user: dict = Depends(require_super_admin))
 
 # ============ SYSTEM SETTINGS ROUTES (Super Admin Only) ============
 
+@api_router.get("/system/activity-log-writer")
+async def get_activity_log_writer_stats(current_user: dict = Depends(require_super_admin)):
+    """Queue depth and write/drop counters of the buffered activity-log writer"""
+    return activity_log_writer.stats()
+
+@api_router.get("/system/loop-blocks")
+async def get_loop_blocks(current_user: dict = Depends(require_super_admin)):
+    """Current loop lag and the latest event-loop stalls seen by this worker, newest first"""
+    return {
+        "pid": os.getpid(),
+        "lag_ms": round(loop_monitor.lag * 1000, 1),
+        "threshold_ms": LOOP_BLOCK_THRESHOLD_MS,
+        "blocks": list(reversed(loop_monitor.recent_blocks)),
+    }
+
+class LogRehydrateRequest(BaseModel):
+    collection: str  # activity_logs | email_logs
+    month: str       # YYYY-MM
+
+@api_router.get("/system/log-partitions")
+async def get_log_partitions(current_user: dict = Depends(require_super_admin)):
+    """Monthly log partitions and whether each is hot, archived or rehydrated"""
+    return await db.log_partitions.find({}).sort([("collection", 1), ("month", -1)]).to_list(None)
+
+@api_router.post("/system/log-partitions/rehydrate")
+async def rehydrate_log_partition_endpoint(data: LogRehydrateRequest, current_user: dict = Depends(require_super_admin)):
+    """Load an archived month back into the database for an audit (runs in background)"""
+    store = LOG_STORES.get(data.collection)
+    if not store or not re.match(r"^\d{4}-(0[1-9]|1[0-2])$", data.month):
+        raise HTTPException(status_code=400, detail="Koleksi atau bulan tidak valid")
+    part = await db.log_partitions.find_one({"_id": store.partition(data.month)})
+    if not part or part.get("status") != "archived":
+        raise HTTPException(status_code=404, detail="Arsip log untuk bulan ini tidak ditemukan")
+    spawn(rehydrate_log_partition(store, data.month))
+    return {"message": f"Arsip {data.collection} {data.month} sedang dimuat ulang", "rows": part.get("rows")}
+
 @api_router.get("/system/settings")
 async def get_system_settings(current_user: dict = Depends(require_super_admin)):
     """Get global system settings (SMTP, etc.)"""
@@ -2331,7 +3799,7 @@ async def send_test_email(data: TestEmailRequest, current_user: dict = Depends(r
 @api_router.get("/system/email-logs")
 async def get_email_logs(current_user: dict = Depends(require_super_admin), limit: int = 50):
     """Get email send logs for debugging"""
-    logs = await db.email_logs.find({}, {"_id": 0}).sort("timestamp", -1).limit(limit).to_list(limit)
+    logs = await email_log_store.find({}, {"_id": 0}, limit)
     return logs
 
 @api_router.post("/companies/{company_id}/test-email")
@@ -2375,10 +3843,155 @@ async def test_company_email(company_id: str, data: TestEmailRequest, current_us
 @api_router.get("/companies/{company_id}/email-logs")
 async def get_company_email_logs(company_id: str, current_user: dict = Depends(require_super_admin), limit: int = 20):
     """Get email logs for a specific company"""
-    logs = await db.email_logs.find({"company_id": company_id}, {"_id": 0}).sort("timestamp", -1).limit(limit).to_list(limit)
+    logs = await email_log_store.find({"company_id": company_id}, {"_id": 0}, limit)
     return logs
 
 
+# ============ REQUEST PROFILING ============
+
+# A super admin mints a short-lived profiling grant; any single request that
+# carries it in the X-Profile header runs under cProfile and
+# the result lands in the capped request_profiles collection. Off unless
+# PROFILING_ENABLED is set, at most PROFILE_RATE_LIMIT profiles per minute
+# per worker and one at a time. cProfile sees the whole thread, so other
+# requests interleaving on the same worker show up in the profile as well.
+# Grants are signed with a key derived from JWT_SECRET and carry their own
+# audience, so they can't be replayed as login tokens (and login tokens can't
+# be used as grants). They are header-only: URLs end up in access logs.
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '').lower() in ('1', 'true', 'yes')
+PROFILE_RATE_LIMIT = int(os.environ.get('PROFILE_RATE_LIMIT', '6'))  # per minute per worker
+PROFILE_MAX_STORED = 200
+PROFILE_STORE_BYTES = 64 * 1024 * 1024
+PROFILE_GRANT_MAX_MINUTES = 60
+PROFILE_SUMMARY_LINES = 60
+PROFILE_GRANT_AUDIENCE = "makar:profile"
+PROFILE_GRANT_SECRET = hashlib.sha256(f"profile-grant:{JWT_SECRET}".encode()).hexdigest()
+
+async def ensure_profile_collection():
+    """Capped collection, so stored profiles never outgrow PROFILE_STORE_BYTES / PROFILE_MAX_STORED"""
+    try:
+        await db.create_collection("request_profiles", capped=True, size=PROFILE_STORE_BYTES, max=PROFILE_MAX_STORED)
+    except (CollectionInvalid, OperationFailure):
+        pass  # Already exists (another worker created it)
+    await db.request_profiles.create_index("id")
+
+def profile_grant(scope) -> Optional[dict]:
+    """Decoded profiling grant carried by the request, if any and valid"""
+    token = dict(scope["headers"]).get(b"x-profile", b"").decode("latin-1")
+    if not token:
+        return None
+    try:
+        payload = jwt.decode(token, PROFILE_GRANT_SECRET, algorithms=[JWT_ALGORITHM], audience=PROFILE_GRANT_AUDIENCE)
+    except jwt.InvalidTokenError:
+        return None
+    return payload if payload.get("purpose") == "profile" else None
+
+def render_profile(profiler: cProfile.Profile) -> tuple:
+    """(gzipped pstats dump, text summary sorted by cumulative time)"""
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)  # Takes over profiler.stats
+    dump = gzip.compress(marshal.dumps(stats.stats))
+    stats.sort_stats("cumulative").print_stats(PROFILE_SUMMARY_LINES)
+    return dump, out.getvalue()
+
+class RequestProfilerMiddleware:
+    """Runs requests carrying a valid profiling grant under cProfile"""
+
+    def __init__(self, app):
+        self.app = app
+        self.recent = deque()  # Start times of profiles in the last minute
+        self.active = False
+
+    def admit(self) -> str:
+        now = time.monotonic()
+        while self.recent and now - self.recent[0] > 60:
+            self.recent.popleft()
+        if self.active:
+            return "busy"
+        if len(self.recent) >= PROFILE_RATE_LIMIT:
+            return "rate-limited"
+        self.recent.append(now)
+        return "ok"
+
+    async def __call__(self, scope, receive, send):
+        grant = profile_grant(scope) if PROFILING_ENABLED and scope["type"] == "http" else None
+        if grant is None:
+            return await self.app(scope, receive, send)
+        verdict = self.admit()
+        profile_id = str(uuid.uuid4())
+        result = {"status": 500}
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                result["status"] = message["status"]
+                header = profile_id if verdict == "ok" else verdict
+                message["headers"] = [*message.get("headers", []), (b"x-profile-id", header.encode())]
+            await send(message)
+
+        if verdict != "ok":
+            return await self.app(scope, receive, send_with_profile_id)
+        self.active = True
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profiler.disable()
+            self.active = False
+            duration = time.perf_counter() - start
+            ctx = current_request.get()
+            try:
+                stats, summary = await asyncio.to_thread(render_profile, profiler)
+                await db.request_profiles.insert_one({
+                    "id": profile_id,
+                    "created_at": datetime.now(timezone.utc).isoformat(),
+                    "method": scope["method"], "path": scope["path"],
+                    "query": scope.get("query_string", b"").decode("latin-1"),
+                    "route": getattr(scope.get("route"), "path", None),
+                    "status": result["status"], "duration_ms": round(duration * 1000, 1),
+                    "request_id": ctx["request_id"] if ctx else None,
+                    "granted_by": grant.get("granted_by"), "note": grant.get("note"),
+                    "summary": summary, "stats": stats,
+                })
+            except Exception as e:
+                logging.error(f"Saving request profile {profile_id} failed: {e}")
+
+class ProfileGrantRequest(BaseModel):
+    minutes: int = 10
+    note: Optional[str] = None  # e.g. tenant or ticket being investigated
+
+@api_router.post("/system/profiles/grant")
+async def create_profile_grant(data: ProfileGrantRequest, current_user: dict = Depends(require_super_admin)):
+    """Short-lived token; send it as the X-Profile header on the request to profile"""
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=403, detail="Profiling tidak aktif (set PROFILING_ENABLED=1)")
+    minutes = max(1, min(data.minutes, PROFILE_GRANT_MAX_MINUTES))
+    expires_at = datetime.now(timezone.utc) + timedelta(minutes=minutes)
+    token = jwt.encode({"purpose": "profile", "aud": PROFILE_GRANT_AUDIENCE, "granted_by": current_user["id"],
+                        "note": data.note, "exp": expires_at}, PROFILE_GRANT_SECRET, algorithm=JWT_ALGORITHM)
+    return {"token": token, "header": "X-Profile", "expires_at": expires_at.isoformat(),
+            "rate_limit_per_minute": PROFILE_RATE_LIMIT}
+
+@api_router.get("/system/profiles")
+async def list_request_profiles(current_user: dict = Depends(require_super_admin), limit: int = 50):
+    """Stored request profiles, newest first (without the profile data)"""
+    return await db.request_profiles.find({}, {"_id": 0, "stats": 0, "summary": 0}) \
+        .sort("$natural", -1).limit(min(limit, PROFILE_MAX_STORED)).to_list(None)
+
+@api_router.get("/system/profiles/{profile_id}")
+async def download_request_profile(profile_id: str, format: str = "prof", current_user: dict = Depends(require_super_admin)):
+    """format=prof: pstats file (python -m pstats, snakeviz); format=txt: top functions by cumulative time"""
+    profile = await db.request_profiles.find_one({"id": profile_id}, {"_id": 0})
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile tidak ditemukan")
+    if format == "txt":
+        header = f"{profile['method']} {profile['path']} -> {profile['status']} in {profile['duration_ms']} ms\n\n"
+        return Response(header + profile["summary"], media_type="text/plain; charset=utf-8")
+    if format != "prof":
+        raise HTTPException(status_code=400, detail="Format harus prof atau txt")
+    return Response(gzip.decompress(profile["stats"]), media_type="application/octet-stream",
+                    headers={"Content-Disposition": f'attachment; filename="profile_{profile_id}.prof"'})
 
 
 # ============ COMPANY ROUTES ============
@@ -2403,7 +4016,7 @@ async def get_companies(current_user: dict = Depends(require_super_admin)):
         
         result.append(build_company_response(company, admin_count, emp_count))
     
-    return result
+    return model_list_response(result)
 
 @api_router.post("/companies", response_model=CompanyResponse)
 async def create_company(data: CompanyCreate, current_user: dict = Depends(require_super_admin)):
@@ -2985,6 +4598,14 @@ class OutletUpdate(BaseModel):
     geo_enabled: Optional[bool] = None
     allow_outside_network: Optional[bool] = None
 
+def outlet_geo_point(latitude: Optional[float], longitude: Optional[float]):
+    """GeoJSON point for the outlets 2dsphere index (None when coordinates are incomplete)"""
+    if latitude is None or longitude is None:
+        return None
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise HTTPException(status_code=400, detail="Koordinat outlet tidak valid")
+    return {"type": "Point", "coordinates": [longitude, latitude]}
+
 @api_router.get("/companies/{company_id}/outlets")
 async def get_company_outlets(company_id: str, current_user: dict = Depends(require_super_admin)):
     """Get outlets for a company (superadmin use)"""
@@ -2992,8 +4613,11 @@ async def get_company_outlets(company_id: str, current_user: dict = Depends(requ
     return outlets
 
 @api_router.get("/outlets-session")
-async def get_outlets(request: Request):
+async def get_outlets(request: Request, response: Response):
     session = await require_session_admin(request)
+    cached = await not_modified(request, response, session["company_id"], "outlets")
+    if cached:
+        return cached
     outlets = await db.outlets.find({"company_id": session["company_id"]}, {"_id": 0}).sort("name", 1).to_list(100)
     return outlets
 
@@ -3005,6 +4629,7 @@ async def create_outlet(data: OutletCreate, request: Request):
     existing = await db.outlets.find_one({"company_id": session["company_id"], "name": {"$regex": f"^{re.escape(data.name.strip())}$", "$options": "i"}})
     if existing:
         raise HTTPException(status_code=400, detail=f"Outlet '{data.name}' sudah ada")
+    validate_office_ips(data.office_ips)
     
     now = datetime.now(timezone.utc).isoformat()
     doc = {
@@ -3013,11 +4638,16 @@ async def create_outlet(data: OutletCreate, request: Request):
         "name": data.name, "address": data.address, "phone": data.phone,
         "office_ips": data.office_ips or [],
         "latitude": data.latitude, "longitude": data.longitude,
+        "location": outlet_geo_point(data.latitude, data.longitude),
         "radius_meters": data.radius_meters, "geo_enabled": data.geo_enabled,
         "is_active": data.is_active,
         "created_at": now, "updated_at": now
     }
+    if not doc["location"]:
+        doc.pop("location")  # 2dsphere index rejects null geometries
     await db.outlets.insert_one(doc)
+    await publish_attendance_config(session["company_id"])
+    await bump_collection_version(session["company_id"], "outlets")
     return {"message": "Outlet berhasil ditambahkan", "id": doc["id"]}
 
 @api_router.put("/outlets-session/{outlet_id}")
@@ -3030,15 +4660,26 @@ async def update_outlet(outlet_id: str, data: OutletUpdate, request: Request):
         existing = await db.outlets.find_one({"company_id": session["company_id"], "name": {"$regex": f"^{re.escape(update_data['name'].strip())}$", "$options": "i"}, "id": {"$ne": outlet_id}})
         if existing:
             raise HTTPException(status_code=400, detail=f"Outlet '{update_data['name']}' sudah ada")
+    if "office_ips" in update_data:
+        validate_office_ips(update_data["office_ips"])
+    if "latitude" in update_data or "longitude" in update_data:
+        current = await db.outlets.find_one({"id": outlet_id, "company_id": session["company_id"]}, {"_id": 0, "latitude": 1, "longitude": 1}) or {}
+        point = outlet_geo_point(update_data.get("latitude", current.get("latitude")), update_data.get("longitude", current.get("longitude")))
+        if point:
+            update_data["location"] = point
     
     update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
     await db.outlets.update_one({"id": outlet_id, "company_id": session["company_id"]}, {"$set": update_data})
+    await publish_attendance_config(session["company_id"])
+    await bump_collection_version(session["company_id"], "outlets")
     return {"message": "Outlet berhasil diupdate"}
 
 @api_router.delete("/outlets-session/{outlet_id}")
 async def delete_outlet(outlet_id: str, request: Request):
     session = await require_session_admin(request)
     await db.outlets.delete_one({"id": outlet_id, "company_id": session["company_id"]})
+    await publish_attendance_config(session["company_id"])
+    await bump_collection_version(session["company_id"], "outlets")
     return {"message": "Outlet berhasil dihapus"}
 
 # ============ DIVISION MANAGEMENT ============
@@ -3048,8 +4689,11 @@ class DivisionCreate(BaseModel):
     description: Optional[str] = None
 
 @api_router.get("/divisions-session")
-async def get_divisions(request: Request):
+async def get_divisions(request: Request, response: Response):
     session = await require_session_admin(request)
+    cached = await not_modified(request, response, session["company_id"], "divisions")
+    if cached:
+        return cached
     divisions = await db.divisions.find({"company_id": session["company_id"]}, {"_id": 0}).sort("name", 1).to_list(100)
     return divisions
 
@@ -3064,6 +4708,7 @@ async def create_division(data: DivisionCreate, request: Request):
         "created_at": now, "updated_at": now
     }
     await db.divisions.insert_one(doc)
+    await bump_collection_version(session["company_id"], "divisions")
     return {"message": "Divisi berhasil ditambahkan", "id": doc["id"]}
 
 @api_router.put("/divisions-session/{div_id}")
@@ -3072,12 +4717,14 @@ async def update_division(div_id: str, data: DivisionCreate, request: Request):
     await db.divisions.update_one({"id": div_id, "company_id": session["company_id"]}, {"$set": {
         "name": data.name, "description": data.description, "updated_at": datetime.now(timezone.utc).isoformat()
     }})
+    await bump_collection_version(session["company_id"], "divisions")
     return {"message": "Divisi berhasil diupdate"}
 
 @api_router.delete("/divisions-session/{div_id}")
 async def delete_division(div_id: str, request: Request):
     session = await require_session_admin(request)
     await db.divisions.delete_one({"id": div_id, "company_id": session["company_id"]})
+    await bump_collection_version(session["company_id"], "divisions")
     return {"message": "Divisi berhasil dihapus"}
 
 
@@ -3113,6 +4760,7 @@ class EmployeeCreateSession(BaseModel):
     salary: Optional[int] = None
     employment_type: Optional[str] = None  # tetap, kontrak, magang
     outlet_id: Optional[str] = None
+    outlet_ids: Optional[List[str]] = None  # Extra outlets a roaming employee may clock in at
     division_id: Optional[str] = None
     allow_outside_network: Optional[bool] = None
 
@@ -3145,19 +4793,35 @@ class EmployeeUpdateSession(BaseModel):
     salary: Optional[int] = None
     employment_type: Optional[str] = None
     outlet_id: Optional[str] = None
+    outlet_ids: Optional[List[str]] = None  # Extra outlets a roaming employee may clock in at
     division_id: Optional[str] = None
     allow_outside_network: Optional[bool] = None
 
 @api_router.get("/employees-session")
-async def get_employees_session(request: Request):
+@db_budget(8)
+async def get_employees_session(request: Request, response: Response):
     """Get all employees for current company"""
     session = await require_session_admin(request)
+    cached = await not_modified(request, response, session["company_id"], "employees")
+    if cached:
+        return cached
     employees = await db.employees.find(
         {"companies": session["company_id"], "$or": [{"trashed": {"$ne": True}}, {"trashed": {"$exists": False}}]},
         {"_id": 0, "password": 0}
     ).sort("name", 1).to_list(1000)
     return employees
 
+@api_router.get("/employees-session/changes")
+async def get_employees_changes(request: Request, since: str = "0"):
+    """Delta sync: employees written after `since`; trashed/removed ones as tombstones"""
+    session = await require_session_admin(request)
+    return await fetch_changes(
+        db.employees, session["company_id"], "employees",
+        {"companies": session["company_id"]}, since,
+        is_tombstone=lambda emp: bool(emp.get("trashed")),
+        projection={"password": 0}
+    )
+
 @api_router.post("/employees-session")
 async def create_employee_session(data: EmployeeCreateSession, request: Request):
     """Create new employee for current company"""
@@ -3190,9 +4854,11 @@ async def create_employee_session(data: EmployeeCreateSession, request: Request)
         await db.employees.update_one(
             {"email": data.email},
             {"$addToSet": {"companies": session["company_id"]},
-             "$set": {"updated_at": now}}
+             "$set": {"updated_at": now, "rev": await next_rev()}}
         )
         emp_id = existing_emp["id"]
+        await sync_attendance_employee_flags(emp_id)
+        await employee_written(emp_id)
     else:
         pwd = data.password or generate_secure_password()
         emp_doc = {
@@ -3213,12 +4879,15 @@ async def create_employee_session(data: EmployeeCreateSession, request: Request)
             "bank_holder": data.bank_holder,
             "emergency_contact": data.emergency_contact, "emergency_phone": data.emergency_phone,
             "salary": data.salary, "employment_type": data.employment_type,
+            "outlet_id": data.outlet_id, "outlet_ids": data.outlet_ids or [],
+            "division_id": data.division_id,
             "companies": [session["company_id"]],
             "is_active": True, "auth_provider": "email",
-            "created_at": now, "updated_at": now
+            "created_at": now, "updated_at": now, "rev": await next_rev()
         }
         await db.employees.insert_one(emp_doc)
         emp_id = emp_doc["id"]
+        await employee_written(emp_id)
         
         # Send password email
         company = await db.companies.find_one({"id": session["company_id"]}, {"_id": 0})
@@ -3254,7 +4923,9 @@ async def update_employee_session(employee_id: str, data: EmployeeUpdateSession,
             raise HTTPException(status_code=400, detail="Email sudah digunakan")
     
     update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
+    update_data["rev"] = await next_rev()
     await db.employees.update_one({"id": employee_id}, {"$set": update_data})
+    await employee_written(employee_id)
     
     # If deactivated, kill all sessions
     if update_data.get("is_active") == False:
@@ -3283,31 +4954,19 @@ async def delete_employee_session(employee_id: str, request: Request):
         "trashed_at": datetime.now(timezone.utc).isoformat(),
         "trashed_by": session["user_id"],
         "trashed_company": session["company_id"],
-        "updated_at": datetime.now(timezone.utc).isoformat()
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+        "rev": await next_rev()
     }})
+    await sync_attendance_employee_flags(employee_id)
+    await employee_written(employee_id)
     
     # Kill active sessions
     await db.user_sessions.delete_many({"user_id": employee_id, "company_id": session["company_id"]})
     
     return {"message": "Karyawan dipindahkan ke tempat sampah"}
 
-@api_router.get("/employees-session-trash")
-
-@api_router.get("/employees-session/export/excel")
-async def export_employees_excel(request: Request):
-    """Export all employees to Excel with summary sheet"""
-    session = await require_session_admin(request)
-    
-    employees = await db.employees.find(
-        {"companies": session["company_id"], "$or": [{"trashed": {"$ne": True}}, {"trashed": {"$exists": False}}]},
-        {"_id": 0, "password": 0}
-    ).sort("name", 1).to_list(10000)
-    
-    all_outlets = await db.outlets.find({"company_id": session["company_id"]}, {"_id": 0}).to_list(100)
-    all_divisions = await db.divisions.find({"company_id": session["company_id"]}, {"_id": 0}).to_list(100)
-    outlet_map = {o["id"]: o["name"] for o in all_outlets}
-    division_map = {d["id"]: d["name"] for d in all_divisions}
-    
+def build_employees_workbook(employees: List[dict], outlet_map: dict, division_map: dict, company_name: str) -> bytes:
+    """Employee data sheet plus a summary sheet, as .xlsx bytes"""
     import openpyxl
     from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
     
@@ -3377,9 +5036,6 @@ async def export_employees_excel(request: Request):
     title_font = Font(bold=True, size=14, color="2E4DA7")
     section_font = Font(bold=True, size=11)
     
-    company = await db.companies.find_one({"id": session["company_id"]}, {"_id": 0, "name": 1})
-    company_name = company.get("name", "") if company else ""
-    
     ws2.cell(row=1, column=1, value=f"Laporan Data Karyawan - {company_name}").font = title_font
     ws2.cell(row=2, column=1, value=f"Tanggal: {datetime.now(timezone.utc).strftime('%d/%m/%Y')}")
     
@@ -3418,7 +5074,27 @@ async def export_employees_excel(request: Request):
     
     output = io.BytesIO()
     wb.save(output)
-    output.seek(0)
+    return output.getvalue()
+
+@api_router.get("/employees-session/export/excel")
+async def export_employees_excel(request: Request):
+    """Export all employees to Excel with summary sheet"""
+    session = await require_session_admin(request)
+    
+    employees = await db.employees.find(
+        {"companies": session["company_id"], "$or": [{"trashed": {"$ne": True}}, {"trashed": {"$exists": False}}]},
+        {"_id": 0, "password": 0}
+    ).sort("name", 1).to_list(10000)
+    
+    all_outlets = await db.outlets.find({"company_id": session["company_id"]}, {"_id": 0}).to_list(100)
+    all_divisions = await db.divisions.find({"company_id": session["company_id"]}, {"_id": 0}).to_list(100)
+    outlet_map = {o["id"]: o["name"] for o in all_outlets}
+    division_map = {d["id"]: d["name"] for d in all_divisions}
+    
+    company = await db.companies.find_one({"id": session["company_id"]}, {"_id": 0, "name": 1})
+    company_name = company.get("name", "") if company else ""
+    
+    output = io.BytesIO(await asyncio.to_thread(build_employees_workbook, employees, outlet_map, division_map, company_name))
     
     from fastapi.responses import StreamingResponse
     fname = company_name.replace(" ", "_")
@@ -3556,7 +5232,9 @@ async def restore_employee(employee_id: str, request: Request):
     if not emp:
         raise HTTPException(status_code=404, detail="Karyawan tidak ditemukan di tempat sampah")
     
-    await db.employees.update_one({"id": employee_id}, {"$set": {"trashed": False, "updated_at": datetime.now(timezone.utc).isoformat()}, "$unset": {"trashed_at": "", "trashed_by": "", "trashed_company": ""}})
+    await db.employees.update_one({"id": employee_id}, {"$set": {"trashed": False, "updated_at": datetime.now(timezone.utc).isoformat(), "rev": await next_rev()}, "$unset": {"trashed_at": "", "trashed_by": "", "trashed_company": ""}})
+    await sync_attendance_employee_flags(employee_id)
+    await employee_written(employee_id)
     return {"message": "Karyawan berhasil dipulihkan"}
 
 @api_router.delete("/employees-session/{employee_id}/permanent")
@@ -3568,7 +5246,10 @@ async def permanent_delete_employee(employee_id: str, request: Request):
         raise HTTPException(status_code=404, detail="Karyawan tidak ditemukan")
     
     # Remove company from list
-    await db.employees.update_one({"id": employee_id}, {"$pull": {"companies": session["company_id"]}})
+    await db.employees.update_one({"id": employee_id}, {"$pull": {"companies": session["company_id"]}, "$set": {"rev": await next_rev()}})
+    await add_tombstones(session["company_id"], "employees", [employee_id])
+    await sync_attendance_employee_flags(employee_id)
+    await employee_written(employee_id, session["company_id"])
     await db.user_sessions.delete_many({"user_id": employee_id, "company_id": session["company_id"]})
     return {"message": "Karyawan dihapus permanen"}
 
@@ -3584,8 +5265,10 @@ async def reset_employee_password(employee_id: str, request: Request):
     new_pwd = generate_secure_password()
     await db.employees.update_one({"id": employee_id}, {"$set": {
         "password": hash_password(new_pwd),
-        "updated_at": datetime.now(timezone.utc).isoformat()
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+        "rev": await next_rev()
     }})
+    await employee_written(employee_id)
     
     company = await db.companies.find_one({"id": session["company_id"]}, {"_id": 0, "name": 1})
     company_name = company.get("name", "") if company else ""
@@ -3605,7 +5288,96 @@ async def reset_employee_password(employee_id: str, request: Request):
     
     return {"message": f"Password baru berhasil dikirim ke {emp['email']}", "password": new_pwd}
 
+# Header aliases accepted by the employee import, checked in order (first match wins)
+EMPLOYEE_IMPORT_ALIASES = {
+    'name': ['nama', 'name', 'nama lengkap', 'nama karyawan'],
+    'email': ['email', 'e-mail', 'email address'],
+    'phone': ['telepon', 'phone', 'hp', 'no hp', 'no telepon', 'no. hp', 'no. telepon'],
+    'id_number': ['no ktp/nik', 'nik', 'ktp', 'no ktp', 'no. ktp', 'no nik', 'no. nik'],
+    'gender': ['jenis kelamin', 'gender'],
+    'birth_place': ['tempat lahir', 'birth place'],
+    'birth_date': ['tanggal lahir', 'birth date', 'tgl lahir'],
+    'religion': ['agama', 'religion'],
+    'marital_status': ['status pernikahan', 'marital status', 'status nikah'],
+    'education': ['pendidikan', 'education', 'pendidikan terakhir'],
+    'major': ['jurusan', 'major', 'program studi'],
+    'province': ['provinsi', 'province'],
+    'city': ['kota/kabupaten', 'kota', 'kabupaten', 'city'],
+    'district': ['kecamatan', 'district'],
+    'village': ['kelurahan', 'kelurahan/desa', 'desa', 'village'],
+    'full_address': ['alamat lengkap', 'alamat', 'address', 'full address'],
+    'position': ['posisi', 'position', 'jabatan'],
+    'department': ['departemen', 'department', 'divisi', 'bagian'],
+    'join_date': ['tanggal masuk', 'join date', 'tgl masuk', 'tanggal bergabung'],
+    'employment_type': ['status kerja', 'tipe kerja', 'employment type'],
+    'salary': ['gaji', 'salary'],
+    'bank_name': ['nama bank', 'bank'],
+    'bank_account': ['no rekening', 'nomor rekening', 'bank account'],
+    'bank_holder': ['atas nama rekening', 'atas nama', 'bank holder'],
+    'emergency_contact': ['kontak darurat', 'emergency contact'],
+    'emergency_phone': ['telepon darurat', 'emergency phone'],
+    'outlet_name': ['outlet', 'cabang', 'branch', 'outlet/cabang'],
+    'division_name': ['divisi', 'division'],
+}
 
+def employee_import_columns(headers: List[str]) -> Dict[str, int]:
+    """Column index of each known field, matched by header alias"""
+    col_map = {}
+    for i, h in enumerate(headers):
+        for field, aliases in EMPLOYEE_IMPORT_ALIASES.items():
+            if h in aliases:
+                col_map[field] = i
+                break
+    return col_map
+
+def employee_import_cell(row: tuple, col_map: Dict[str, int], field: str) -> str:
+    idx = col_map.get(field)
+    if idx is not None and idx < len(row) and row[idx] is not None:
+        val = row[idx]
+        if hasattr(val, 'isoformat'):
+            return val.isoformat()[:10]
+        return str(val).strip()
+    return ''
+
+def employee_import_data(row: tuple, col_map: Dict[str, int], outlet_map: dict, division_map: dict, now: str) -> dict:
+    """Employee fields from one import row; empty cells are left out so they don't overwrite data"""
+    salary_str = employee_import_cell(row, col_map, 'salary')
+    salary_val = None
+    if salary_str:
+        try: salary_val = int(float(salary_str))
+        except: pass
+    
+    emp_data = {
+        "name": employee_import_cell(row, col_map, 'name'), "phone": employee_import_cell(row, col_map, 'phone'),
+        "id_number": employee_import_cell(row, col_map, 'id_number'),
+        "gender": employee_import_cell(row, col_map, 'gender'),
+        "birth_place": employee_import_cell(row, col_map, 'birth_place'),
+        "birth_date": employee_import_cell(row, col_map, 'birth_date'),
+        "religion": employee_import_cell(row, col_map, 'religion'),
+        "marital_status": employee_import_cell(row, col_map, 'marital_status'),
+        "education": employee_import_cell(row, col_map, 'education'),
+        "major": employee_import_cell(row, col_map, 'major'),
+        "province": employee_import_cell(row, col_map, 'province'),
+        "city": employee_import_cell(row, col_map, 'city'),
+        "district": employee_import_cell(row, col_map, 'district'),
+        "village": employee_import_cell(row, col_map, 'village'),
+        "full_address": employee_import_cell(row, col_map, 'full_address'),
+        "position": employee_import_cell(row, col_map, 'position'),
+        "department": employee_import_cell(row, col_map, 'department'),
+        "join_date": employee_import_cell(row, col_map, 'join_date'),
+        "employment_type": employee_import_cell(row, col_map, 'employment_type'),
+        "salary": salary_val,
+        "bank_name": employee_import_cell(row, col_map, 'bank_name'),
+        "bank_account": employee_import_cell(row, col_map, 'bank_account'),
+        "bank_holder": employee_import_cell(row, col_map, 'bank_holder'),
+        "emergency_contact": employee_import_cell(row, col_map, 'emergency_contact'),
+        "emergency_phone": employee_import_cell(row, col_map, 'emergency_phone'),
+        "outlet_id": outlet_map.get(employee_import_cell(row, col_map, 'outlet_name').lower(), ""),
+        "division_id": division_map.get(employee_import_cell(row, col_map, 'division_name').lower(), ""),
+        "updated_at": now
+    }
+    # Remove empty values
+    return {k: v for k, v in emp_data.items() if v is not None and v != ""}
 
 @api_router.post("/employees-session/import")
 async def import_employees_excel(request: Request, file: UploadFile = File(...)):
@@ -3636,56 +5408,12 @@ async def import_employees_excel(request: Request, file: UploadFile = File(...))
     
     headers = [cell.value.lower().strip() if cell.value else '' for cell in ws[1]]
     
-    # Map column names
-    col_map = {}
-    field_aliases = {
-        'name': ['nama', 'name', 'nama lengkap', 'nama karyawan'],
-        'email': ['email', 'e-mail', 'email address'],
-        'phone': ['telepon', 'phone', 'hp', 'no hp', 'no telepon', 'no. hp', 'no. telepon'],
-        'id_number': ['no ktp/nik', 'nik', 'ktp', 'no ktp', 'no. ktp', 'no nik', 'no. nik'],
-        'gender': ['jenis kelamin', 'gender'],
-        'birth_place': ['tempat lahir', 'birth place'],
-        'birth_date': ['tanggal lahir', 'birth date', 'tgl lahir'],
-        'religion': ['agama', 'religion'],
-        'marital_status': ['status pernikahan', 'marital status', 'status nikah'],
-        'education': ['pendidikan', 'education', 'pendidikan terakhir'],
-        'major': ['jurusan', 'major', 'program studi'],
-        'province': ['provinsi', 'province'],
-        'city': ['kota/kabupaten', 'kota', 'kabupaten', 'city'],
-        'district': ['kecamatan', 'district'],
-        'village': ['kelurahan', 'kelurahan/desa', 'desa', 'village'],
-        'full_address': ['alamat lengkap', 'alamat', 'address', 'full address'],
-        'position': ['posisi', 'position', 'jabatan'],
-        'department': ['departemen', 'department', 'divisi', 'bagian'],
-        'join_date': ['tanggal masuk', 'join date', 'tgl masuk', 'tanggal bergabung'],
-        'employment_type': ['status kerja', 'tipe kerja', 'employment type'],
-        'salary': ['gaji', 'salary'],
-        'bank_name': ['nama bank', 'bank'],
-        'bank_account': ['no rekening', 'nomor rekening', 'bank account'],
-        'bank_holder': ['atas nama rekening', 'atas nama', 'bank holder'],
-        'emergency_contact': ['kontak darurat', 'emergency contact'],
-        'emergency_phone': ['telepon darurat', 'emergency phone'],
-        'outlet_name': ['outlet', 'cabang', 'branch', 'outlet/cabang'],
-        'division_name': ['divisi', 'division'],
-    }
-    
-    for i, h in enumerate(headers):
-        for field, aliases in field_aliases.items():
-            if h in aliases:
-                col_map[field] = i
-                break
+    col_map = employee_import_columns(headers)
     
     if 'name' not in col_map or 'email' not in col_map:
         raise HTTPException(status_code=400, detail="Excel harus memiliki kolom 'Nama' dan 'Email'")
     
-    def get_cell(row, field):
-        idx = col_map.get(field)
-        if idx is not None and idx < len(row) and row[idx] is not None:
-            val = row[idx]
-            if hasattr(val, 'isoformat'):
-                return val.isoformat()[:10]
-            return str(val).strip()
-        return ''
+    get_cell = lambda row, field: employee_import_cell(row, col_map, field)
     
     now = datetime.now(timezone.utc).isoformat()
     imported = 0
@@ -3717,49 +5445,13 @@ async def import_employees_excel(request: Request, file: UploadFile = File(...))
                 errors.append(f"Baris {row_idx}: NIK '{nik}' harus 16 digit angka")
                 continue
             
-            salary_str = get_cell(row, 'salary')
-            salary_val = None
-            if salary_str:
-                try: salary_val = int(float(salary_str))
-                except: pass
-            
-            # Build update data
-            emp_data = {
-                "name": name, "phone": get_cell(row, 'phone'),
-                "id_number": nik,
-                "gender": get_cell(row, 'gender'),
-                "birth_place": get_cell(row, 'birth_place'),
-                "birth_date": get_cell(row, 'birth_date'),
-                "religion": get_cell(row, 'religion'),
-                "marital_status": get_cell(row, 'marital_status'),
-                "education": get_cell(row, 'education'),
-                "major": get_cell(row, 'major'),
-                "province": get_cell(row, 'province'),
-                "city": get_cell(row, 'city'),
-                "district": get_cell(row, 'district'),
-                "village": get_cell(row, 'village'),
-                "full_address": get_cell(row, 'full_address'),
-                "position": get_cell(row, 'position'),
-                "department": get_cell(row, 'department'),
-                "join_date": get_cell(row, 'join_date'),
-                "employment_type": get_cell(row, 'employment_type'),
-                "salary": salary_val,
-                "bank_name": get_cell(row, 'bank_name'),
-                "bank_account": get_cell(row, 'bank_account'),
-                "bank_holder": get_cell(row, 'bank_holder'),
-                "emergency_contact": get_cell(row, 'emergency_contact'),
-                "emergency_phone": get_cell(row, 'emergency_phone'),
-                "outlet_id": outlet_map.get(get_cell(row, 'outlet_name').lower(), ""),
-                "division_id": division_map.get(get_cell(row, 'division_name').lower(), ""),
-                "updated_at": now
-            }
-            # Remove empty values
-            emp_data = {k: v for k, v in emp_data.items() if v is not None and v != ""}
+            emp_data = employee_import_data(row, col_map, outlet_map, division_map, now)
             
             # Check existing in this company → UPDATE (replace data)
             existing = await db.employees.find_one({"email": email, "companies": session["company_id"]})
             if existing:
-                await db.employees.update_one({"email": email}, {"$set": emp_data})
+                await db.employees.update_one({"email": email}, {"$set": {**emp_data, "rev": await next_rev()}})
+                await employee_written(existing["id"])
                 imported += 1
                 continue
             
@@ -3767,10 +5459,13 @@ async def import_employees_excel(request: Request, file: UploadFile = File(...))
             existing_emp = await db.employees.find_one({"email": email})
             if existing_emp:
                 emp_data["updated_at"] = now
+                emp_data["rev"] = await next_rev()
                 await db.employees.update_one(
                     {"email": email},
                     {"$addToSet": {"companies": session["company_id"]}, "$set": emp_data}
                 )
+                await sync_attendance_employee_flags(existing_emp["id"])
+                await employee_written(existing_emp["id"])
             else:
                 pwd = generate_secure_password()
                 emp_doc = {
@@ -3780,9 +5475,11 @@ async def import_employees_excel(request: Request, file: UploadFile = File(...))
                     "companies": [session["company_id"]],
                     "is_active": True, "auth_provider": "email",
                     "created_at": now,
-                    **emp_data
+                    **emp_data,
+                    "rev": await next_rev()
                 }
                 await db.employees.insert_one(emp_doc)
+                await employee_written(emp_doc["id"])
                 
                 # Send password email (non-blocking)
                 try:
@@ -3938,15 +5635,16 @@ async def get_jobs(current_user: dict = Depends(require_admin_or_super)):
             updated_at=job["updated_at"]
         ))
     
-
-    
-    return result
+    return model_list_response(result)
 
 # Session-based job endpoints (for new auth system)
 @api_router.get("/jobs-session", response_model=List[JobResponse])
-async def get_jobs_session(request: Request):
+async def get_jobs_session(request: Request, response: Response):
     """Get jobs using session auth"""
     session = await require_session_admin(request)
+    cached = await not_modified(request, response, session["company_id"], "jobs")
+    if cached:
+        return cached
     
     query = {"company_id": session["company_id"]}
     jobs = await db.jobs.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
@@ -3973,7 +5671,7 @@ async def get_jobs_session(request: Request):
             updated_at=job["updated_at"]
         ))
 
-    return result
+    return model_list_response(result, response)
 
 
 @api_router.post("/jobs-session", response_model=JobResponse)
@@ -3990,6 +5688,7 @@ async def create_job_session(data: JobCreate, request: Request):
     }
     
     await db.jobs.insert_one(job_doc)
+    await bump_collection_version(job_doc["company_id"], "jobs")
     
     await create_activity_log(
         user_id=session["user_id"], user_name=session["name"], user_email=session["email"],
@@ -4034,6 +5733,7 @@ async def update_job_session(job_id: str, data: JobUpdate, request: Request):
     update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
     
     await db.jobs.update_one({"id": job_id}, {"$set": update_data})
+    await bump_collection_version(job["company_id"], "jobs")
     
     changes = ", ".join(update_data.keys())
     await create_activity_log(
@@ -4080,8 +5780,11 @@ async def delete_job_session(job_id: str, request: Request):
         raise HTTPException(status_code=403, detail="Access denied")
     
     # Delete related applications
+    app_ids = await db.applications.distinct("id", {"job_id": job_id})
     await db.applications.delete_many({"job_id": job_id})
+    await add_tombstones(job["company_id"], "applications", app_ids)
     await db.jobs.delete_one({"id": job_id})
+    await bump_collection_version(job["company_id"], "jobs")
     
     await create_activity_log(
         user_id=session["user_id"], user_name=session["name"], user_email=session["email"],
@@ -4115,6 +5818,7 @@ async def create_job(data: JobCreate, current_user: dict = Depends(require_admin
     }
     
     await db.jobs.insert_one(job_doc)
+    await bump_collection_version(job_doc["company_id"], "jobs")
     
     return JobResponse(
         id=job_doc["id"],
@@ -4148,6 +5852,7 @@ async def update_job(job_id: str, data: JobUpdate, current_user: dict = Depends(
     update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
     
     await db.jobs.update_one({"id": job_id}, {"$set": update_data})
+    await bump_collection_version(job["company_id"], "jobs")
     
     updated = await db.jobs.find_one({"id": job_id}, {"_id": 0})
     app_count = await db.applications.count_documents({"job_id": job_id})
@@ -4180,8 +5885,11 @@ async def delete_job(job_id: str, current_user: dict = Depends(require_admin_or_
     if current_user["role"] == UserRole.ADMIN and job["company_id"] != current_user.get("company_id"):
         raise HTTPException(status_code=403, detail="Access denied")
     
+    app_ids = await db.applications.distinct("id", {"job_id": job_id})
     await db.applications.delete_many({"job_id": job_id})
+    await add_tombstones(job["company_id"], "applications", app_ids)
     await db.jobs.delete_one({"id": job_id})
+    await bump_collection_version(job["company_id"], "jobs")
     
     return {"message": "Job deleted successfully"}
 
@@ -4346,10 +6054,13 @@ async def get_public_job_detail(domain: str, job_id: str):
 # ============ FORM FIELDS ROUTES ============
 
 @api_router.get("/form-fields", response_model=List[FormFieldResponse])
-async def get_form_fields(current_user: dict = Depends(require_admin_or_super)):
+async def get_form_fields(request: Request, response: Response, current_user: dict = Depends(require_admin_or_super)):
     company_id = current_user.get("company_id")
     if current_user["role"] == UserRole.SUPER_ADMIN:
         raise HTTPException(status_code=400, detail="Super Admin must specify company")
+    cached = await not_modified(request, response, company_id, "form_fields")
+    if cached:
+        return cached
     
     fields = await db.form_fields.find({"company_id": company_id}, {"_id": 0}).sort("order", 1).to_list(100)
     
@@ -4368,6 +6079,7 @@ async def create_form_field(data: FormFieldCreate, current_user: dict = Depends(
     }
     
     await db.form_fields.insert_one(field_doc)
+    await bump_collection_version(company_id, "form_fields")
     
     return FormFieldResponse(**field_doc)
 
@@ -4382,6 +6094,7 @@ async def update_form_field(field_id: str, data: FormFieldUpdate, current_user:
     
     update_data = {k: v for k, v in data.model_dump().items() if v is not None}
     await db.form_fields.update_one({"id": field_id}, {"$set": update_data})
+    await bump_collection_version(field["company_id"], "form_fields")
     
     updated = await db.form_fields.find_one({"id": field_id}, {"_id": 0})
     return FormFieldResponse(**updated)
@@ -4396,6 +6109,7 @@ async def delete_form_field(field_id: str, current_user: dict = Depends(require_
         raise HTTPException(status_code=403, detail="Access denied")
     
     await db.form_fields.delete_one({"id": field_id})
+    await bump_collection_version(field["company_id"], "form_fields")
     return {"message": "Field deleted successfully"}
 
 # ============ APPLICATION ROUTES ============
@@ -4498,16 +6212,20 @@ async def submit_application(
         "status": ApplicationStatus.PENDING,
         "notes": None,
         "created_at": datetime.now(timezone.utc).isoformat(),
-        "updated_at": datetime.now(timezone.utc).isoformat()
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+        "rev": await next_rev()
     }
     
     await db.applications.insert_one(application_doc)
+    await bump_collection_version(job["company_id"], "jobs")
+    event_bus.publish(job["company_id"], "application.created", {
+        "id": application_doc["id"], "job_id": job_id, "job_title": job.get("title"),
+        "applicant_name": parsed_data.get("full_name", parsed_data.get("name")),
+        "status": application_doc["status"], "created_at": application_doc["created_at"]
+    })
     
     # Send confirmation email to applicant (async, don't block response)
-    try:
-        await send_application_confirmation_email(application_doc, job, company)
-    except Exception as e:
-        logging.error(f"Failed to send confirmation email: {e}")
+    spawn(send_logged(send_application_confirmation_email(application_doc, job, company), "confirmation email"))
     
     return {"message": "Application submitted successfully", "id": application_doc["id"]}
 
@@ -4526,36 +6244,32 @@ async def get_applications(
         query["status"] = status
     
     applications = await db.applications.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
+    return model_list_response(await build_application_responses(applications))
+
+async def build_application_responses(applications: List[dict]) -> List[ApplicationResponse]:
+    """Attach job title/department (one $in lookup) and applicant fields to raw applications"""
+    job_ids = list({app["job_id"] for app in applications})
+    jobs = await db.jobs.find({"id": {"$in": job_ids}}, {"_id": 0, "id": 1, "title": 1, "department": 1}).to_list(len(job_ids))
+    job_lookup = {job["id"]: job for job in jobs}
     
     result = []
     for app in applications:
-        job = await db.jobs.find_one({"id": app["job_id"]}, {"_id": 0})
-        job_title = job["title"] if job else "Unknown"
-        job_department = job.get("department") if job else None
-        
+        job = job_lookup.get(app["job_id"])
         form_data = app.get("form_data", {})
-        applicant_name = form_data.get("full_name", form_data.get("name", "Unknown"))
-        applicant_email = form_data.get("email", "Unknown")
-        
         result.append(ApplicationResponse(
-            id=app["id"],
-            job_id=app["job_id"],
-            company_id=app["company_id"],
-            job_title=job_title,
-            job_department=job_department,
-            applicant_name=applicant_name,
-            applicant_email=applicant_email,
-            form_data=form_data,
-            resume_url=app.get("resume_url"),
-            status=app["status"],
-            notes=app.get("notes"),
-            created_at=app["created_at"],
-            updated_at=app["updated_at"]
+            id=app["id"], job_id=app["job_id"], company_id=app["company_id"],
+            job_title=job["title"] if job else "Unknown",
+            job_department=job.get("department") if job else None,
+            applicant_name=form_data.get("full_name", form_data.get("name", "Unknown")),
+            applicant_email=form_data.get("email", "Unknown"),
+            form_data=form_data, resume_url=app.get("resume_url"),
+            status=app["status"], notes=app.get("notes"),
+            created_at=app["created_at"], updated_at=app["updated_at"]
         ))
-    
-
+    return result
 
 @api_router.get("/applications-session", response_model=List[ApplicationResponse])
+@db_budget(8)
 async def get_applications_session(
     request: Request,
     job_id: Optional[str] = None,
@@ -4570,35 +6284,20 @@ async def get_applications_session(
     if status:
         query["status"] = status
     
-    applications = await db.applications.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    
-    result = []
-    for app in applications:
-        job = await db.jobs.find_one({"id": app["job_id"]}, {"_id": 0})
-        job_title = job["title"] if job else "Unknown"
-        job_department = job.get("department") if job else None
-        
-        form_data = app.get("form_data", {})
-        applicant_name = form_data.get("full_name", form_data.get("name", "Unknown"))
-        applicant_email = form_data.get("email", "Unknown")
-        
-        result.append(ApplicationResponse(
-            id=app["id"],
-            job_id=app["job_id"],
-            company_id=app["company_id"],
-            job_title=job_title,
-            job_department=job_department,
-            applicant_name=applicant_name,
-            applicant_email=applicant_email,
-            form_data=form_data,
-            resume_url=app.get("resume_url"),
-            status=app["status"],
-            notes=app.get("notes"),
-            created_at=app["created_at"],
-            updated_at=app["updated_at"]
-        ))
-    
-    return result
+    cursor = db.applications.find(query, {"_id": 0}).sort("created_at", -1).limit(1000)
+    return await stream_json_list(cursor, build_application_responses)
+
+@api_router.get("/applications-session/changes")
+async def get_applications_changes(request: Request, since: str = "0"):
+    """Delta sync: applications written after `since`; trashed/deleted ones as tombstones"""
+    session = await require_session_admin(request)
+    changes = await fetch_changes(
+        db.applications, session["company_id"], "applications",
+        {"company_id": session["company_id"]}, since,
+        is_tombstone=lambda app: "deleted_at" in app
+    )
+    changes["upserts"] = [r.model_dump() for r in await build_application_responses(changes["upserts"])]
+    return changes
 
 @api_router.put("/applications-session/{app_id}/status")
 async def update_application_status_session(app_id: str, status: str, notes: Optional[str] = None, request: Request = None):
@@ -4618,9 +6317,11 @@ async def update_application_status_session(app_id: str, status: str, notes: Opt
         {"$set": {
             "status": status,
             "notes": notes,
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+            "rev": await next_rev()
         }}
     )
+    event_bus.publish(session["company_id"], "application.status", {"id": app_id, "status": status, "old_status": old_status})
     
     form_data = application.get("form_data", {})
     applicant_name = form_data.get("full_name", form_data.get("name", "Unknown"))
@@ -4637,7 +6338,8 @@ async def update_application_status_session(app_id: str, status: str, notes: Opt
         job = await db.jobs.find_one({"id": application["job_id"]}, {"_id": 0})
         company = await db.companies.find_one({"id": application["company_id"]}, {"_id": 0})
         if job and company:
-            await send_status_update_email(application, job, company, old_status, status)
+            spawn(send_logged(send_status_update_email(application, job, company, old_status, status),
+                              "status update email"))
     except Exception as e:
         logging.error(f"Failed to send status update email: {e}")
     
@@ -4656,7 +6358,7 @@ async def update_application_status_session(app_id: str, status: str, notes: Opt
                     existing_other = await db.employees.find_one({"email": emp_email})
                     if existing_other:
                         # Add company to existing employee + update data
-                        update_fields = {"updated_at": now_str}
+                        update_fields = {"updated_at": now_str, "rev": await next_rev()}
                         if fd.get("phone"): update_fields["phone"] = fd["phone"]
                         if job: update_fields["position"] = job.get("title", "")
                         if job: update_fields["department"] = job.get("department", "")
@@ -4664,6 +6366,8 @@ async def update_application_status_session(app_id: str, status: str, notes: Opt
                             {"email": emp_email},
                             {"$addToSet": {"companies": session["company_id"]}, "$set": update_fields}
                         )
+                        await sync_attendance_employee_flags(existing_other["id"])
+                        await employee_written(existing_other["id"])
                     else:
                         hire_pwd = generate_secure_password()
                         emp_doc = {
@@ -4693,9 +6397,10 @@ async def update_application_status_session(app_id: str, status: str, notes: Opt
                             "picture": None,
                             "companies": [session["company_id"]],
                             "is_active": True, "auth_provider": "email",
-                            "created_at": now_str, "updated_at": now_str
+                            "created_at": now_str, "updated_at": now_str, "rev": await next_rev()
                         }
                         await db.employees.insert_one(emp_doc)
+                        await employee_written(emp_doc["id"])
                         
                         # Send password email to hired employee
                         try:
@@ -4738,7 +6443,7 @@ async def soft_delete_application(app_id: str, request: Request):
     application = await db.applications.find_one({"id": app_id, "company_id": session["company_id"]}, {"_id": 0})
     if not application:
         raise HTTPException(status_code=404, detail="Application not found")
-    await db.applications.update_one({"id": app_id}, {"$set": {"deleted_at": datetime.now(timezone.utc).isoformat()}})
+    await db.applications.update_one({"id": app_id}, {"$set": {"deleted_at": datetime.now(timezone.utc).isoformat(), "rev": await next_rev()}})
     
     form_data = application.get("form_data", {})
     applicant_name = form_data.get("full_name", form_data.get("name", "Unknown"))
@@ -4756,26 +6461,11 @@ async def soft_delete_application(app_id: str, request: Request):
 async def get_trash_applications(request: Request):
     """Get trashed applications"""
     session = await require_session_admin(request)
-    applications = await db.applications.find(
+    cursor = db.applications.find(
         {"company_id": session["company_id"], "deleted_at": {"$exists": True}},
         {"_id": 0}
-    ).sort("deleted_at", -1).to_list(1000)
-    result = []
-    for app in applications:
-        job = await db.jobs.find_one({"id": app["job_id"]}, {"_id": 0})
-        job_title = job["title"] if job else "Unknown"
-        job_department = job.get("department") if job else None
-        form_data = app.get("form_data", {})
-        result.append(ApplicationResponse(
-            id=app["id"], job_id=app["job_id"], company_id=app["company_id"],
-            job_title=job_title, job_department=job_department,
-            applicant_name=form_data.get("full_name", form_data.get("name", "Unknown")),
-            applicant_email=form_data.get("email", "Unknown"),
-            form_data=form_data, resume_url=app.get("resume_url"),
-            status=app["status"], notes=app.get("notes"),
-            created_at=app["created_at"], updated_at=app["updated_at"]
-        ))
-    return result
+    ).sort("deleted_at", -1).limit(1000)
+    return await stream_json_list(cursor, build_application_responses)
 
 @api_router.post("/applications-session/{app_id}/restore")
 async def restore_application(app_id: str, request: Request):
@@ -4784,7 +6474,7 @@ async def restore_application(app_id: str, request: Request):
     application = await db.applications.find_one({"id": app_id, "company_id": session["company_id"], "deleted_at": {"$exists": True}}, {"_id": 0})
     if not application:
         raise HTTPException(status_code=404, detail="Application not found in trash")
-    await db.applications.update_one({"id": app_id}, {"$unset": {"deleted_at": ""}})
+    await db.applications.update_one({"id": app_id}, {"$unset": {"deleted_at": ""}, "$set": {"rev": await next_rev()}})
     
     form_data = application.get("form_data", {})
     applicant_name = form_data.get("full_name", form_data.get("name", "Unknown"))
@@ -4810,6 +6500,8 @@ async def permanent_delete_application(app_id: str, request: Request):
     applicant_name = form_data.get("full_name", form_data.get("name", "Unknown"))
     
     await db.applications.delete_one({"id": app_id})
+    await add_tombstones(session["company_id"], "applications", [app_id])
+    await bump_collection_version(session["company_id"], "jobs")
     
     await create_activity_log(
         user_id=session["user_id"], user_name=session["name"], user_email=session["email"],
@@ -4825,28 +6517,29 @@ async def permanent_delete_application(app_id: str, request: Request):
 class ExportRequest(BaseModel):
     application_ids: List[str]
 
-@api_router.post("/applications-session/export")
-async def export_applications(data: ExportRequest, request: Request):
-    """Export selected applications to Excel + CV files as ZIP"""
+CV_IMAGE_EXTS = {".png", ".jpg", ".jpeg", ".gif", ".webp", ".bmp"}
+CV_THUMB_HEIGHT = 120  # pixels
+
+def application_thumbnail(file_path: Path) -> Path:
+    """JPEG preview of an image CV, CV_THUMB_HEIGHT tall, in a temp file the caller removes"""
+    from PIL import Image as PILImage
+    with PILImage.open(file_path) as img:
+        ratio = CV_THUMB_HEIGHT / img.height
+        thumb_w = int(img.width * ratio)
+        thumb = img.resize((thumb_w, CV_THUMB_HEIGHT), PILImage.LANCZOS)
+        if thumb.mode in ("RGBA", "P"):
+            thumb = thumb.convert("RGB")
+        
+        thumb_path = Path(tempfile.mktemp(suffix=".jpg"))
+        thumb.save(thumb_path, "JPEG", quality=80)
+    return thumb_path
+
+def build_applications_workbook(apps: List[dict], jobs_map: dict) -> tuple:
+    """Applications sheet with CV previews, as (.xlsx bytes, CV files to bundle)"""
     from openpyxl import Workbook
     from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
     from openpyxl.drawing.image import Image as XlImage
     from openpyxl.utils import get_column_letter
-    from PIL import Image as PILImage
-    
-    session = await require_session_admin(request)
-    
-    if not data.application_ids:
-        raise HTTPException(status_code=400, detail="No applications selected")
-    
-    # Fetch applications
-    apps = await db.applications.find(
-        {"id": {"$in": data.application_ids}, "company_id": session["company_id"]},
-        {"_id": 0}
-    ).to_list(len(data.application_ids))
-    
-    if not apps:
-        raise HTTPException(status_code=404, detail="No applications found")
     
     # Collect all unique form_data keys across all applications
     all_keys = []
@@ -4857,17 +6550,6 @@ async def export_applications(data: ExportRequest, request: Request):
                 all_keys.append(key)
                 key_set.add(key)
     
-    # Fetch job titles
-    job_ids = list(set(a["job_id"] for a in apps))
-    jobs_map = {}
-    for jid in job_ids:
-        job = await db.jobs.find_one({"id": jid}, {"_id": 0})
-        if job:
-            jobs_map[jid] = job
-    
-    IMAGE_EXTS = {".png", ".jpg", ".jpeg", ".gif", ".webp", ".bmp"}
-    THUMB_HEIGHT = 120  # pixels
-    
     # Create Excel workbook
     wb = Workbook()
     ws = wb.active
@@ -4963,26 +6645,17 @@ async def export_applications(data: ExportRequest, request: Request):
                 cv_files.append({"path": file_path, "name": f"CV/{safe_name}"})
                 
                 # Preview column: embed image or show link
-                if ext in IMAGE_EXTS:
+                if ext in CV_IMAGE_EXTS:
                     try:
-                        # Create thumbnail
-                        with PILImage.open(file_path) as img:
-                            ratio = THUMB_HEIGHT / img.height
-                            thumb_w = int(img.width * ratio)
-                            thumb = img.resize((thumb_w, THUMB_HEIGHT), PILImage.LANCZOS)
-                            if thumb.mode in ("RGBA", "P"):
-                                thumb = thumb.convert("RGB")
-                            
-                            thumb_path = Path(tempfile.mktemp(suffix=".jpg"))
-                            thumb.save(thumb_path, "JPEG", quality=80)
-                            temp_thumbs.append(thumb_path)
+                        thumb_path = application_thumbnail(file_path)
+                        temp_thumbs.append(thumb_path)
                         
                         xl_img = XlImage(str(thumb_path))
                         cell_ref = f"{get_column_letter(cv_preview_col)}{row_idx}"
                         ws.add_image(xl_img, cell_ref)
                         
                         # Set row height to fit image
-                        ws.row_dimensions[row_idx].height = THUMB_HEIGHT * 0.75 + 10
+                        ws.row_dimensions[row_idx].height = CV_THUMB_HEIGHT * 0.75 + 10
                     except Exception as e:
                         ws.cell(row=row_idx, column=cv_preview_col, value=f"(gagal preview: {ext})").border = thin_border
                 else:
@@ -5014,14 +6687,48 @@ async def export_applications(data: ExportRequest, request: Request):
                     max_len = max(max_len, len(str(cell.value)))
         ws.column_dimensions[get_column_letter(col_idx)].width = min(max_len + 4, 50)
     
+    excel_buffer = io.BytesIO()
+    try:
+        wb.save(excel_buffer)  # Embedded thumbnails are read from their temp files here
+    finally:
+        for tp in temp_thumbs:
+            try:
+                tp.unlink()
+            except:
+                pass
+    return excel_buffer.getvalue(), cv_files
+
+
+@api_router.post("/applications-session/export")
+@db_budget(10)
+async def export_applications(data: ExportRequest, request: Request):
+    """Export selected applications to Excel + CV files as ZIP"""
+    session = await require_session_admin(request)
+    
+    if not data.application_ids:
+        raise HTTPException(status_code=400, detail="No applications selected")
+    
+    # Fetch applications
+    apps = await db.applications.find(
+        {"id": {"$in": data.application_ids}, "company_id": session["company_id"]},
+        {"_id": 0}
+    ).to_list(len(data.application_ids))
+    
+    if not apps:
+        raise HTTPException(status_code=404, detail="No applications found")
+    
+    # Fetch job titles
+    job_ids = list(set(a["job_id"] for a in apps))
+    jobs = await db.jobs.find({"id": {"$in": job_ids}}, {"_id": 0}).to_list(len(job_ids))
+    jobs_map = {job["id"]: job for job in jobs}
+    
+    workbook, cv_files = await asyncio.to_thread(build_applications_workbook, apps, jobs_map)
+    
     # Create ZIP in memory
     zip_buffer = io.BytesIO()
     with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zf:
         # Add Excel file
-        excel_buffer = io.BytesIO()
-        wb.save(excel_buffer)
-        excel_buffer.seek(0)
-        zf.writestr("Data_Lamaran.xlsx", excel_buffer.read())
+        zf.writestr("Data_Lamaran.xlsx", workbook)
         
         # Add CV files
         for cv in cv_files:
@@ -5029,13 +6736,6 @@ async def export_applications(data: ExportRequest, request: Request):
     
     zip_buffer.seek(0)
     
-    # Cleanup temp thumbnails
-    for tp in temp_thumbs:
-        try:
-            tp.unlink()
-        except:
-            pass
-    
     # Log activity
     await create_activity_log(
         user_id=session["user_id"], user_name=session["name"], user_email=session["email"],
@@ -5067,8 +6767,10 @@ async def update_application_status(app_id: str, data: ApplicationUpdateStatus,
     }
     if data.notes is not None:
         update_data["notes"] = data.notes
+    update_data["rev"] = await next_rev()
     
     await db.applications.update_one({"id": app_id}, {"$set": update_data})
+    event_bus.publish(application["company_id"], "application.status", {"id": app_id, "status": data.status, "old_status": application.get("status")})
     
     return {"message": "Application status updated"}
 
@@ -5082,6 +6784,8 @@ async def delete_application(app_id: str, current_user: dict = Depends(require_a
         raise HTTPException(status_code=403, detail="Access denied")
     
     await db.applications.delete_one({"id": app_id})
+    await add_tombstones(application["company_id"], "applications", [app_id])
+    await bump_collection_version(application["company_id"], "jobs")
     return {"message": "Application deleted"}
 
 # ============ FILE UPLOAD ROUTES ============
@@ -5168,19 +6872,17 @@ class AllUsersResponse(BaseModel):
     updated_at: str
 
 @api_router.get("/users")
+@db_budget(8)
 async def get_users(current_user: dict = Depends(require_super_admin)):
     """Get all company admins and employees"""
     result = []
+    companies = await db.companies.find({}, {"_id": 0, "id": 1, "name": 1}).to_list(None)
+    company_name_map = {c["id"]: c["name"] for c in companies}
     
     # Get all company admins
     admins = await db.company_admins.find({}, {"_id": 0, "password": 0}).to_list(1000)
     for admin in admins:
-        # Get company names
-        company_names = []
-        for comp_id in admin.get("companies", []):
-            comp = await db.companies.find_one({"id": comp_id}, {"_id": 0, "name": 1})
-            if comp:
-                company_names.append(comp["name"])
+        company_names = [company_name_map[c] for c in admin.get("companies", []) if c in company_name_map]
         
         result.append({
             "id": admin["id"],
@@ -5202,12 +6904,7 @@ async def get_users(current_user: dict = Depends(require_super_admin)):
     # Get all employees
     employees = await db.employees.find({}, {"_id": 0, "password": 0}).to_list(1000)
     for emp in employees:
-        # Get company names
-        company_names = []
-        for comp_id in emp.get("companies", []):
-            comp = await db.companies.find_one({"id": comp_id}, {"_id": 0, "name": 1})
-            if comp:
-                company_names.append(comp["name"])
+        company_names = [company_name_map[c] for c in emp.get("companies", []) if c in company_name_map]
         
         result.append({
             "id": emp["id"],
@@ -5222,7 +6919,7 @@ async def get_users(current_user: dict = Depends(require_super_admin)):
             "updated_at": emp["updated_at"] if isinstance(emp["updated_at"], str) else emp["updated_at"].isoformat()
         })
     
-    return result
+    return ORJSONResponse(result)  # Plain JSON values; skips jsonable_encoder
 
 @api_router.post("/users", response_model=UserResponse)
 async def create_user(data: UserCreate, current_user: dict = Depends(require_super_admin)):
@@ -5261,9 +6958,11 @@ async def create_user(data: UserCreate, current_user: dict = Depends(require_sup
             "is_active": True,
             "auth_provider": "email",
             "created_at": now,
-            "updated_at": now
+            "updated_at": now,
+            "rev": await next_rev()
         }
         await db.employees.insert_one(user_doc)
+        await employee_written(user_id)
     
     return UserResponse(
         id=user_id,
@@ -5293,8 +6992,12 @@ async def update_user(user_id: str, data: UserUpdate, current_user: dict = Depen
     if "password" in update_data:
         update_data["password"] = hash_password(update_data["password"])
     update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
+    if role == "employee":
+        update_data["rev"] = await next_rev()
     
     await table.update_one({"id": user_id}, {"$set": update_data})
+    if role == "employee":
+        await employee_written(user_id)
     updated = await table.find_one({"id": user_id}, {"_id": 0})
     
     company_id = updated.get("companies", [None])[0] if updated.get("companies") else updated.get("company_id", "")
@@ -5321,11 +7024,466 @@ async def delete_user(user_id: str, current_user: dict = Depends(require_super_a
     user = await db.employees.find_one({"id": user_id})
     if user:
         await db.employees.delete_one({"id": user_id})
+        await sync_attendance_employee_flags(user_id)
+        for company_id in user.get("companies") or []:
+            await add_tombstones(company_id, "employees", [user_id])
+        await bump_collection_version(user.get("companies") or [], "employees")
         return {"message": "User deleted successfully"}
     
     raise HTTPException(status_code=404, detail="User not found")
 
 
+# ============ OFFICE NETWORK ALLOWLIST ============
+
+def parse_office_ip(entry: str):
+    """
+    Parse one office_ips entry into an ip_network.
+    Accepts CIDR ("10.0.1.0/24", "2001:db8::/32"), single addresses and the
+    legacy dotted prefixes ("10.0.1" / "10.0.1.") which are widened to the
+    octet boundary, so "10.0.1" no longer matches 10.0.10.x.
+    """
+    entry = (entry or "").strip()
+    if not entry:
+        return None
+    try:
+        return ipaddress.ip_network(entry, strict=False)
+    except ValueError:
+        pass
+    octets = entry.rstrip(".").split(".")
+    if 1 <= len(octets) < 4 and all(o.isdigit() and int(o) <= 255 for o in octets):
+        padded = octets + ["0"] * (4 - len(octets))
+        return ipaddress.ip_network(f"{'.'.join(padded)}/{8 * len(octets)}")
+    return None
+
+def validate_office_ips(entries: Optional[List[str]]):
+    """Raise 400 if any office_ips entry cannot be parsed"""
+    invalid = [e for e in (entries or []) if parse_office_ip(e) is None]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"IP kantor tidak valid: {', '.join(invalid)}")
+
+class IPAllowlist:
+    """
+    Compiled office network allowlist.
+    Networks are bucketed by prefix length into sets of masked integers, so a
+    lookup costs one set probe per distinct prefix length no matter how many
+    entries the list has.
+    """
+    __slots__ = ("size", "_v4", "_v6")
+
+    def __init__(self, entries):
+        v4, v6 = {}, {}
+        self.size = 0
+        for entry in entries or []:
+            net = parse_office_ip(entry)
+            if net is None:
+                logging.warning(f"Ignoring invalid office IP entry: {entry!r}")
+                continue
+            buckets = v4 if net.version == 4 else v6
+            buckets.setdefault(net.prefixlen, set()).add(int(net.network_address))
+            self.size += 1
+        self._v4 = self._compile(v4, 32)
+        self._v6 = self._compile(v6, 128)
+
+    @staticmethod
+    def _compile(buckets: dict, bits: int):
+        full = (1 << bits) - 1
+        # Longest prefix first: the most specific networks are checked first
+        return [(full ^ ((1 << (bits - plen)) - 1), frozenset(nets)) for plen, nets in sorted(buckets.items(), reverse=True)]
+
+    def __bool__(self):
+        return self.size > 0
+
+    def contains(self, ip: str) -> bool:
+        try:
+            addr = ipaddress.ip_address((ip or "").strip())
+        except ValueError:
+            return False
+        if addr.version == 6 and addr.ipv4_mapped:
+            addr = addr.ipv4_mapped
+        value = int(addr)
+        for mask, nets in (self._v4 if addr.version == 4 else self._v6):
+            if value & mask in nets:
+                return True
+        return False
+
+# Proxies whose forwarding headers we believe (nginx on loopback / private network)
+TRUSTED_PROXIES = IPAllowlist(os.environ.get(
+    'TRUSTED_PROXIES', '127.0.0.0/8,::1/128,10.0.0.0/8,172.16.0.0/12,192.168.0.0/16,fc00::/7'
+).split(','))
+
+def get_client_ip(request: Request) -> str:
+    """
+    Resolve the real client IP.
+    Forwarding headers are only honoured when the direct peer is a trusted proxy;
+    X-Forwarded-For is walked right to left, skipping trusted hops.
+    CF-Connecting-IP is not read here: only nginx can tell whether its own peer
+    is Cloudflare, so it resolves that header into X-Real-IP (real_ip_header).
+    """
+    peer = request.client.host if request.client else ""
+    if not TRUSTED_PROXIES.contains(peer):
+        return peer
+    
+    value = (request.headers.get("x-real-ip") or "").strip()
+    if value:
+        return value
+    
+    chain = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    for hop in reversed(chain):
+        if not TRUSTED_PROXIES.contains(hop):
+            return hop
+    return chain[0] if chain else peer
+
+
+# ============ OUTLET GEOFENCE ============
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great-circle distance in meters"""
+    R = 6371000
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = math.radians(lat2 - lat1)
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp/2)**2 + math.cos(p1) * math.cos(p2) * math.sin(dl/2)**2
+    return R * 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+
+def employee_outlet_ids(emp: dict) -> List[str]:
+    """Primary outlet first, then any extra outlets a roaming employee may use"""
+    ids = [emp["outlet_id"]] if emp.get("outlet_id") else []
+    for oid in emp.get("outlet_ids") or []:
+        if oid and oid not in ids:
+            ids.append(oid)
+    return ids
+
+# ============ ATTENDANCE CONFIG CACHE ============
+
+# Attendance settings and outlets change a few times a month but are read on
+# every clock. Each worker keeps a per-company snapshot; writes go through
+# publish_attendance_config() which bumps a shared version in config_versions
+# so other workers drop their copy on the next sync tick.
+CONFIG_CACHE_TTL = int(os.environ.get('CONFIG_CACHE_TTL', 300))  # seconds, safety net
+CONFIG_SYNC_INTERVAL = float(os.environ.get('CONFIG_SYNC_INTERVAL', 5))  # seconds
+GEO_GRID_DEG = 0.01  # ~1.1 km grid cells for the in-memory outlet index
+
+def outlet_radius(outlet: dict) -> int:
+    """Geofence radius in meters; missing or null means the 100m default"""
+    return outlet.get("radius_meters") or 100
+
+def reject_outside_network(client_ip: str, outlet_name: Optional[str] = None):
+    """403 for a clock attempt from outside the allowed office network"""
+    msg = "Absen hanya bisa dilakukan dari jaringan kantor"
+    if outlet_name:
+        msg += f" ({outlet_name})"
+    raise HTTPException(status_code=403, detail=f"{msg}. IP Anda: {client_ip}")
+
+class AttendanceConfig:
+    """Immutable snapshot of one company's attendance settings and outlets"""
+    __slots__ = ("company_id", "version", "settings", "outlets", "outlet_allowlists",
+                 "global_allowlist", "geo_grid", "geo_max_radius", "loaded_at")
+
+    def __init__(self, company_id: str, version: int, settings_doc: Optional[dict], outlets: List[dict]):
+        self.company_id = company_id
+        self.version = version
+        values = {k: v for k, v in (settings_doc or {}).items() if v is not None}
+        try:
+            self.settings = AttendanceSettings(**values)
+        except Exception as e:
+            logging.warning(f"Invalid attendance settings for {company_id}, using raw values: {e}")
+            self.settings = AttendanceSettings.model_construct(**{**AttendanceSettings().model_dump(), **values})
+        self.outlets = {o["id"]: o for o in outlets}
+        self.outlet_allowlists = {o["id"]: IPAllowlist(o.get("office_ips")) for o in outlets}
+        self.global_allowlist = IPAllowlist(self.settings.office_ips)
+        self.geo_grid = {}
+        self.geo_max_radius = 0
+        for o in outlets:
+            if o.get("geo_enabled") and o.get("latitude") is not None and o.get("longitude") is not None:
+                self.geo_grid.setdefault(self._cell(o["latitude"], o["longitude"]), []).append(o)
+                self.geo_max_radius = max(self.geo_max_radius, outlet_radius(o))
+        self.loaded_at = time.monotonic()
+
+    @staticmethod
+    def _cell(lat: float, lng: float) -> tuple:
+        return (math.floor(lat / GEO_GRID_DEG), math.floor(lng / GEO_GRID_DEG))
+
+    def is_fresh(self) -> bool:
+        return time.monotonic() - self.loaded_at < CONFIG_CACHE_TTL
+
+    def nearest_outlet(self, outlet_ids: List[str], lat: float, lng: float):
+        """
+        Resolve the outlet a GPS fix belongs to among the permitted outlets.
+        Returns (outlet, distance_m, within_radius): the nearest outlet whose own
+        radius_meters contains the point, else the nearest permitted outlet.
+        """
+        permitted = [self.outlets[i] for i in outlet_ids if i in self.outlets]
+        candidates = [o for o in permitted if o.get("geo_enabled") and o.get("latitude") is not None and o.get("longitude") is not None]
+        if not candidates:
+            return None, None, False
+        
+        # Only grid cells that an outlet radius could reach need to be scanned
+        reach_y = int(self.geo_max_radius / 111000 / GEO_GRID_DEG) + 1
+        reach_x = int(reach_y / max(math.cos(math.radians(lat)), 0.01)) + 1
+        if (2 * reach_y + 1) * (2 * reach_x + 1) < len(candidates):
+            permitted_ids = {o["id"] for o in candidates}
+            cy, cx = self._cell(lat, lng)
+            nearby = [o for dy in range(-reach_y, reach_y + 1) for dx in range(-reach_x, reach_x + 1)
+                      for o in self.geo_grid.get((cy + dy, cx + dx), ()) if o["id"] in permitted_ids]
+        else:
+            nearby = candidates
+        
+        best, best_dist = None, None
+        for o in nearby:
+            dist = haversine(lat, lng, o["latitude"], o["longitude"])
+            if dist <= outlet_radius(o) and (best is None or dist < best_dist):
+                best, best_dist = o, dist
+        if best:
+            return best, best_dist, True
+        
+        nearest = min(candidates, key=lambda o: haversine(lat, lng, o["latitude"], o["longitude"]))
+        return nearest, haversine(lat, lng, nearest["latitude"], nearest["longitude"]), False
+
+_attendance_configs: Dict[str, AttendanceConfig] = {}
+_attendance_config_loads: Dict[str, asyncio.Future] = {}  # In-flight loads only
+
+async def load_attendance_config(company_id: str) -> AttendanceConfig:
+    """Read settings + outlets from Mongo and replace this worker's cached snapshot"""
+    # Version first: a write landing mid-load leaves us older than the shared version
+    version_doc = await db.config_versions.find_one({"company_id": company_id}, {"_id": 0, "attendance": 1})
+    settings_doc = await db.attendance_settings.find_one({"company_id": company_id}, {"_id": 0})
+    outlets = await db.outlets.find({"company_id": company_id}, {"_id": 0}).to_list(None)
+    config = AttendanceConfig(company_id, (version_doc or {}).get("attendance", 0), settings_doc, outlets)
+    _attendance_configs[company_id] = config
+    return config
+
+async def get_attendance_config(company_id: str) -> AttendanceConfig:
+    """Cached attendance config; concurrent misses for one company share a single load"""
+    config = _attendance_configs.get(company_id)
+    if config and config.is_fresh():
+        return config
+    load = _attendance_config_loads.get(company_id)
+    if load is None:
+        load = asyncio.ensure_future(load_attendance_config(company_id))
+        _attendance_config_loads[company_id] = load
+        load.add_done_callback(lambda _: _attendance_config_loads.pop(company_id, None))
+    # Shielded: one cancelled request must not cancel the load the others wait on
+    return await asyncio.shield(load)
+
+async def publish_attendance_config(company_id: str) -> AttendanceConfig:
+    """Write-through after settings/outlet writes: bump the shared version, then reload"""
+    await db.config_versions.find_one_and_update(
+        {"company_id": company_id},
+        {"$inc": {"attendance": 1}, "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}},
+        upsert=True, return_document=ReturnDocument.AFTER
+    )
+    return await load_attendance_config(company_id)
+
+async def sync_config_versions():
+    """Background loop: drop cached configs that another worker has published past"""
+    since = datetime.now(timezone.utc).isoformat()
+    while True:
+        await asyncio.sleep(CONFIG_SYNC_INTERVAL)
+        # Overlap polls by a second so writes racing the previous poll are not missed
+        poll_started = (datetime.now(timezone.utc) - timedelta(seconds=1)).isoformat()
+        try:
+            async for doc in db.config_versions.find({"updated_at": {"$gte": since}}, {"_id": 0}):
+                cached = _attendance_configs.get(doc["company_id"])
+                if cached and cached.version < doc.get("attendance", 0):
+                    _attendance_configs.pop(doc["company_id"], None)
+            since = poll_started
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning(f"Config version sync failed: {e}")
+
+
+# ============ ATTENDANCE STORAGE ============
+
+# Attendance keeps the display strings ("date" = "YYYY-MM-DD", clock times =
+# "HH:MM:SS") plus typed fields derived from them on every write:
+#   day            - BSON date at 00:00 UTC of the local date, for range scans
+#   <event>_min    - epoch minutes of each clock event (Asia/Jakarta wall time)
+#   work_minutes / break_minutes - durations, computed once when a pair completes
+JAKARTA_TZ = ZoneInfo("Asia/Jakarta")
+ATTENDANCE_EVENTS = ("clock_in", "clock_out", "break_start", "break_end")
+
+def attendance_day(date_str: str) -> datetime:
+    """Native date key for a YYYY-MM-DD attendance date"""
+    return datetime.strptime(date_str, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+
+def attendance_minute(date_str: Optional[str], time_str: Optional[str]) -> Optional[int]:
+    """Epoch minute of a local HH:MM[:SS] time on an attendance date"""
+    if not date_str or not time_str:
+        return None
+    try:
+        local = datetime.strptime(f"{date_str} {time_str[:5]}", "%Y-%m-%d %H:%M").replace(tzinfo=JAKARTA_TZ)
+    except ValueError:
+        return None
+    return int(local.timestamp()) // 60
+
+def span_minutes(start: Optional[int], end: Optional[int]) -> Optional[int]:
+    if start is None or end is None:
+        return None
+    mins = end - start
+    if mins < 0:  # Shift ending after midnight on the same record
+        mins += 24 * 60
+    return mins
+
+def attendance_derived_fields(record: dict) -> dict:
+    """Typed fields to $set alongside a record's string date/times"""
+    fields = {"day": attendance_day(record["date"])}
+    for event in ATTENDANCE_EVENTS:
+        fields[f"{event}_min"] = attendance_minute(record["date"], record.get(event))
+    # Events earlier on the clock than clock-in belong to a shift past midnight
+    start = fields["clock_in_min"]
+    for event in ATTENDANCE_EVENTS[1:]:
+        if start is not None and fields[f"{event}_min"] is not None and fields[f"{event}_min"] < start:
+            fields[f"{event}_min"] += 24 * 60
+    fields["work_minutes"] = span_minutes(fields["clock_in_min"], fields["clock_out_min"])
+    fields["break_minutes"] = span_minutes(fields["break_start_min"], fields["break_end_min"])
+    return fields
+
+def format_minutes(mins: Optional[int]) -> str:
+    if mins is None:
+        return ""
+    return f"{mins // 60}j {mins % 60}m"
+
+def attendance_day_filter(date: Optional[str] = None, month: Optional[str] = None) -> Optional[dict]:
+    """Index-friendly filter on `day` for an exact date or a YYYY-MM month"""
+    try:
+        if date:
+            return attendance_day(date)
+        if month:
+            start = datetime.strptime(month, "%Y-%m").replace(tzinfo=timezone.utc)
+            end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+            return {"$gte": start, "$lt": end}
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Format tanggal tidak valid (YYYY-MM-DD / YYYY-MM)")
+    return None
+
+async def sync_attendance_employee_flags(employee_id: str, database=None):
+    """
+    Recompute the denormalized employee flags on an employee's attendance and rollups:
+    employee_active (still in the company and not trashed) and employee_removed
+    (permanently deleted from the company). Call after trash/restore/delete/re-add.
+    """
+    database = database if database is not None else db
+    emp = await database.employees.find_one({"id": employee_id}, {"_id": 0, "companies": 1, "trashed": 1})
+    companies = (emp or {}).get("companies") or []
+    trashed = bool(emp and emp.get("trashed"))
+    rev = await next_rev()
+    for collection in (database.attendance, database.attendance_rollups):
+        await collection.update_many(
+            {"employee_id": employee_id, "company_id": {"$in": companies}},
+            {"$set": {"employee_active": not trashed, "employee_removed": False, "rev": rev}}
+        )
+        await collection.update_many(
+            {"employee_id": employee_id, "company_id": {"$nin": companies}},
+            {"$set": {"employee_active": False, "employee_removed": True, "rev": rev}}
+        )
+
+async def migrate_attendance_employee_flags(database) -> int:
+    """Backfill employee_active/employee_removed on attendance saved before the flags existed"""
+    employee_ids = await database.attendance.distinct("employee_id", {"employee_active": {"$exists": False}})
+    for employee_id in employee_ids:
+        await sync_attendance_employee_flags(employee_id, database)
+    if employee_ids:
+        logging.info(f"Attendance employee flags backfilled for {len(employee_ids)} employee(s)")
+    return len(employee_ids)
+
+async def migrate_attendance(database, batch_size: int = 1000):
+    """All attendance backfills, in order"""
+    await migrate_sync_revs(database, batch_size)
+    await migrate_attendance_dates(database, batch_size)
+    await migrate_attendance_employee_flags(database)
+    if not await database.attendance_rollups.find_one({}, {"_id": 1}):
+        await rebuild_attendance_rollups(database)
+
+async def migrate_attendance_dates(database, batch_size: int = 1000) -> int:
+    """Backfill typed date/time fields on attendance saved before they existed, in batches"""
+    migrated = 0
+    projection = {"_id": 1, "date": 1, **{event: 1 for event in ATTENDANCE_EVENTS}}
+    while True:
+        batch = await database.attendance.find(
+            {"day": {"$exists": False}, "date": {"$type": "string"}}, projection
+        ).limit(batch_size).to_list(batch_size)
+        if not batch:
+            return migrated
+        ops = []
+        for record in batch:
+            try:
+                fields = attendance_derived_fields(record)
+            except ValueError:
+                logging.warning(f"Attendance {record['_id']} has invalid date {record.get('date')!r}, skipped")
+                fields = {"day": None}  # Excluded from future batches; never matches a range
+            ops.append(UpdateOne({"_id": record["_id"]}, {"$set": fields}))
+        await database.attendance.bulk_write(ops, ordered=False)
+        migrated += len(ops)
+        logging.info(f"Attendance date migration: {migrated} record(s) done")
+
+
+# ============ ATTENDANCE ROLLUPS ============
+
+# attendance_rollups holds one summary per (company_id, employee_id, month) so
+# month-end reporting reads O(employees) documents instead of every record.
+# Rollups are recomputed for the touched employee-months after each write;
+# the same pipeline rebuilds them wholesale.
+
+def attendance_rollup_pipeline(match: dict, work_start: str) -> list:
+    not_null = lambda field: {"$ne": [{"$ifNull": [field, None]}, None]}
+    return [
+        {"$match": {**match, "day": {**match.get("day", {}), "$type": "date"}}},
+        {"$sort": {"day": 1}},
+        {"$group": {
+            "_id": {"employee_id": "$employee_id", "month": {"$dateToString": {"format": "%Y-%m", "date": "$day"}}},
+            "company_id": {"$first": "$company_id"},
+            "employee_name": {"$last": "$employee_name"},
+            "employee_email": {"$last": "$employee_email"},
+            "employee_active": {"$last": {"$ifNull": ["$employee_active", True]}},
+            "employee_removed": {"$last": {"$ifNull": ["$employee_removed", False]}},
+            "records": {"$sum": 1},
+            "days_present": {"$sum": {"$cond": [not_null("$clock_in"), 1, 0]}},
+            "late_count": {"$sum": {"$cond": [
+                {"$and": [not_null("$clock_in"), {"$gt": [{"$substrCP": ["$clock_in", 0, 5]}, work_start]}]}, 1, 0
+            ]}},
+            "work_minutes": {"$sum": {"$ifNull": ["$work_minutes", 0]}},
+            "break_minutes": {"$sum": {"$ifNull": ["$break_minutes", 0]}},
+            "pending_count": {"$sum": {"$cond": [
+                {"$or": [{"$eq": ["$status", "pending_approval"]}, not_null("$pending_change")]}, 1, 0
+            ]}},
+        }},
+        {"$project": {
+            "_id": 0, "company_id": 1, "employee_id": "$_id.employee_id", "month": "$_id.month",
+            "employee_name": 1, "employee_email": 1, "employee_active": 1, "employee_removed": 1,
+            "records": 1, "days_present": 1, "late_count": 1, "work_minutes": 1, "break_minutes": 1,
+            "pending_count": 1, "work_start": {"$literal": work_start},
+            "updated_at": {"$literal": datetime.now(timezone.utc).isoformat()},
+        }},
+        {"$merge": {"into": "attendance_rollups", "on": ["company_id", "employee_id", "month"],
+                    "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ]
+
+async def refresh_attendance_rollups(company_id: str, employee_ids: List[str], months: List[str]):
+    """Recompute rollups for the given employees in the given YYYY-MM months"""
+    if not employee_ids or not months:
+        return
+    config = await get_attendance_config(company_id)
+    for month in set(months):
+        match = {"company_id": company_id, "employee_id": {"$in": list(set(employee_ids))}, "day": attendance_day_filter(month=month)}
+        try:
+            await db.attendance.aggregate(attendance_rollup_pipeline(match, config.settings.work_start)).to_list(None)
+        except Exception as e:
+            # Rollups are derived data; a failed refresh is repaired by the next write or a rebuild
+            logging.error(f"Attendance rollup refresh failed for {company_id} {month}: {e}")
+
+async def rebuild_attendance_rollups(database, company_id: Optional[str] = None) -> int:
+    """Backfill job: rebuild every rollup of one company, or of all companies"""
+    company_ids = [company_id] if company_id else await database.attendance.distinct("company_id")
+    for cid in company_ids:
+        settings_doc = await database.attendance_settings.find_one({"company_id": cid}, {"_id": 0, "work_start": 1})
+        work_start = (settings_doc or {}).get("work_start") or "08:00"
+        await database.attendance.aggregate(attendance_rollup_pipeline({"company_id": cid}, work_start)).to_list(None)
+    if company_ids:
+        logging.info(f"Attendance rollups rebuilt for {len(company_ids)} company(ies)")
+    return len(company_ids)
+
+
 # ============ ATTENDANCE MANAGEMENT ============
 
 class AttendanceSettings(BaseModel):
@@ -5337,6 +7495,8 @@ class AttendanceSettings(BaseModel):
     break_start: str = "12:00"
     break_end: str = "13:00"
     allow_backdate: bool = False  # Global setting
+    session_timeout: int = 30  # Minutes of inactivity before employee logout
+    model_config = ConfigDict(extra="allow")
 
 @api_router.get("/attendance/face-status")
 async def get_face_status(request: Request):
@@ -5370,7 +7530,8 @@ async def register_face(request: Request):
     update_data = {
         "face_photo": photo_url,
         "face_registered_at": datetime.now(timezone.utc).isoformat(),
-        "updated_at": datetime.now(timezone.utc).isoformat()
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+        "rev": await next_rev()
     }
     if face_descriptor:
         update_data["face_descriptor"] = face_descriptor
@@ -5381,6 +7542,7 @@ async def register_face(request: Request):
         update_data["face_update_token.used"] = True
     
     await db.employees.update_one({"id": session["user_id"]}, {"$set": update_data})
+    await employee_written(session["user_id"])
     
     return {"message": "Wajah berhasil didaftarkan", "face_photo": photo_url}
 
@@ -5400,41 +7562,35 @@ async def get_face_descriptor(request: Request):
 async def get_attendance_settings(request: Request):
     """Get attendance settings for company"""
     session = await require_session_admin(request)
-    settings = await db.attendance_settings.find_one({"company_id": session["company_id"]}, {"_id": 0})
-    if not settings:
-        settings = {
-            "company_id": session["company_id"],
-            "face_threshold": 70,
-            "office_ips": [],
-            "allow_outside_network": False,
-            "work_start": "08:00",
-            "work_end": "17:00",
-            "break_start": "12:00",
-            "break_end": "13:00",
-            "allow_backdate": False,
-            "session_timeout": 30
-        }
-    return settings
+    config = await get_attendance_config(session["company_id"])
+    return {**config.settings.model_dump(), "company_id": session["company_id"]}
 
 @api_router.get("/attendance/settings-public")
 async def get_attendance_settings_public(request: Request):
     """Get session timeout setting for employees"""
     session = await get_session_user(request)
-    settings = await db.attendance_settings.find_one({"company_id": session["company_id"]}, {"_id": 0})
-    return {"session_timeout": settings.get("session_timeout", 30) if settings else 30}
+    config = await get_attendance_config(session["company_id"])
+    return {"session_timeout": config.settings.session_timeout}
 
 @api_router.put("/attendance/settings")
 async def update_attendance_settings(data: Dict[str, Any], request: Request):
     """Update attendance settings"""
     session = await require_session_admin(request)
+    if "office_ips" in data:
+        validate_office_ips(data["office_ips"])
     data["company_id"] = session["company_id"]
     data["updated_at"] = datetime.now(timezone.utc).isoformat()
     
-    await db.attendance_settings.update_one(
+    # Previous document from the same write; the cached config may already hold the new values
+    previous = await db.attendance_settings.find_one_and_update(
         {"company_id": session["company_id"]},
         {"$set": data},
-        upsert=True
+        upsert=True, projection={"_id": 0, "work_start": 1}, return_document=ReturnDocument.BEFORE
     )
+    previous_start = (previous or {}).get("work_start") or AttendanceSettings().work_start
+    config = await publish_attendance_config(session["company_id"])
+    if config.settings.work_start != previous_start:
+        await rebuild_attendance_rollups(db, session["company_id"])  # Late counts depend on work_start
     return {"message": "Pengaturan absensi berhasil disimpan"}
 
 @api_router.post("/attendance/clock")
@@ -5446,12 +7602,7 @@ async def clock_attendance(request: Request):
     action = body.get("action")  # clock_in, clock_out, break_start, break_end
     photo_url = body.get("photo_url")
     face_score = body.get("face_score", 0)
-    client_ip = (
-        request.headers.get("cf-connecting-ip") or  # Cloudflare real IP
-        request.headers.get("x-real-ip") or
-        request.headers.get("x-forwarded-for", "").split(",")[0].strip() or
-        request.client.host
-    )
+    client_ip = get_client_ip(request)
     geo_location = body.get("geo_location")  # {lat, lng, acc}
     backdate = body.get("date")
     backtime = body.get("time")
@@ -5459,13 +7610,20 @@ async def clock_attendance(request: Request):
     if action not in ("clock_in", "clock_out", "break_start", "break_end"):
         raise HTTPException(status_code=400, detail="Action tidak valid")
     
+    # Validate before a one-time backdate token can be spent
+    if backdate:
+        if not isinstance(backdate, str) or not re.fullmatch(r"\d{4}-\d{2}-\d{2}", backdate):
+            raise HTTPException(status_code=400, detail="Format tanggal tidak valid (YYYY-MM-DD)")
+        attendance_day_filter(backdate)  # 400 on impossible dates such as 2026-02-30
+    if backtime and (not isinstance(backtime, str) or not re.fullmatch(r"([01]\d|2[0-3]):[0-5]\d", backtime)):
+        raise HTTPException(status_code=400, detail="Format jam tidak valid (HH:MM)")
+    
     company_id = session["company_id"]
     employee_id = session["user_id"]
     
-    # Get attendance settings
-    settings = await db.attendance_settings.find_one({"company_id": company_id}, {"_id": 0})
-    if not settings:
-        settings = {"face_threshold": 70, "office_ips": [], "allow_outside_network": False, "allow_backdate": False}
+    # Get attendance settings and outlets from the per-company cache
+    config = await get_attendance_config(company_id)
+    settings = config.settings
     
     # Check employee-specific settings
     emp = await db.employees.find_one({"id": employee_id}, {"_id": 0})
@@ -5479,15 +7637,15 @@ async def clock_attendance(request: Request):
     emp_allow_outside = emp.get("allow_outside_network")  # None = not set (use outlet/global)
     outlet = None
     outlet_name = ""
-    outlet_ips = []
     outlet_allow_outside = False
     
-    if emp.get("outlet_id"):
-        outlet = await db.outlets.find_one({"id": emp["outlet_id"]}, {"_id": 0})
-        if outlet:
-            outlet_ips = outlet.get("office_ips", [])
-            outlet_name = outlet.get("name", "")
-            outlet_allow_outside = outlet.get("allow_outside_network", False)
+    # Permitted outlets: primary outlet_id plus outlet_ids for roaming staff
+    permitted_ids = employee_outlet_ids(emp)
+    permitted = [config.outlets[i] for i in permitted_ids if i in config.outlets]
+    if permitted:
+        outlet = permitted[0]
+        outlet_name = outlet.get("name", "")
+        outlet_allow_outside = outlet.get("allow_outside_network", False)
     
     # Resolve allow_outside: employee > outlet > global
     if emp_allow_outside is not None:
@@ -5495,45 +7653,40 @@ async def clock_attendance(request: Request):
     elif outlet:
         resolved_allow_outside = outlet_allow_outside
     else:
-        resolved_allow_outside = settings.get("allow_outside_network", False)
-    
-    # Fallback to global IPs if outlet has none
-    if not outlet_ips:
-        outlet_ips = settings.get("office_ips", [])
-    
-    # Check IP
-    if outlet_ips and not resolved_allow_outside:
-        ip_valid = any(client_ip.startswith(ip) for ip in outlet_ips)
-        if not ip_valid:
-            msg = f"Absen hanya bisa dilakukan dari jaringan kantor"
-            if outlet_name: msg += f" ({outlet_name})"
-            msg += f". IP Anda: {client_ip}"
-            raise HTTPException(status_code=403, detail=msg)
-    
-    # Check geolocation if outlet has geo_enabled
-    if outlet and outlet.get("geo_enabled") and outlet.get("latitude") and outlet.get("longitude") and not resolved_allow_outside:
-            emp_geo = geo_location
-            if not emp_geo or not emp_geo.get("lat") or not emp_geo.get("lng"):
-                raise HTTPException(status_code=403, detail=f"Lokasi GPS diperlukan untuk absen di {outlet.get('name', 'outlet ini')}. Pastikan GPS aktif.")
-            
-            import math
-            def haversine(lat1, lon1, lat2, lon2):
-                R = 6371000
-                p1, p2 = math.radians(lat1), math.radians(lat2)
-                dp = math.radians(lat2 - lat1)
-                dl = math.radians(lon2 - lon1)
-                a = math.sin(dp/2)**2 + math.cos(p1) * math.cos(p2) * math.sin(dl/2)**2
-                return R * 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-            
-            distance = haversine(emp_geo["lat"], emp_geo["lng"], outlet["latitude"], outlet["longitude"])
-            max_radius = outlet.get("radius_meters", 100)
-            if distance > max_radius:
-                raise HTTPException(status_code=403, detail=f"Anda berada {int(distance)}m dari {outlet.get('name', 'outlet')}. Maksimal {max_radius}m.")
+        resolved_allow_outside = settings.allow_outside_network
+    
+    # Outlet the employee is clocking at (recorded on the attendance record)
+    used_outlet = outlet
+    
+    # Check IP against every permitted outlet; fall back to global IPs if none has any
+    outlet_allowlists = [(o, config.outlet_allowlists[o["id"]]) for o in permitted]
+    outlet_allowlists = [(o, a) for o, a in outlet_allowlists if a]
+    if outlet_allowlists and not resolved_allow_outside:
+        used_outlet = next((o for o, a in outlet_allowlists if a.contains(client_ip)), None)
+        if not used_outlet:
+            reject_outside_network(client_ip, outlet_name)
+    
+    allowlist = None if outlet_allowlists else config.global_allowlist
+    if allowlist and not resolved_allow_outside:
+        if not allowlist.contains(client_ip):
+            reject_outside_network(client_ip, outlet_name)
+    
+    # Check geolocation against the nearest geo-enabled permitted outlet
+    geo_outlets = [o for o in permitted if o.get("geo_enabled") and o.get("latitude") and o.get("longitude")]
+    if geo_outlets and not resolved_allow_outside:
+        emp_geo = geo_location
+        if not emp_geo or not emp_geo.get("lat") or not emp_geo.get("lng"):
+            raise HTTPException(status_code=403, detail=f"Lokasi GPS diperlukan untuk absen di {geo_outlets[0].get('name', 'outlet ini')}. Pastikan GPS aktif.")
+        
+        nearest, distance, within = config.nearest_outlet([o["id"] for o in geo_outlets], emp_geo["lat"], emp_geo["lng"])
+        if not within:
+            raise HTTPException(status_code=403, detail=f"Anda berada {int(distance)}m dari {nearest.get('name', 'outlet')}. Maksimal {outlet_radius(nearest)}m.")
+        used_outlet = nearest
+    used_outlet_id = used_outlet["id"] if used_outlet else None
+    used_outlet_name = used_outlet.get("name", "") if used_outlet else None
     
     # Use Asia/Jakarta timezone for attendance time
-    from zoneinfo import ZoneInfo
-    jakarta_tz = ZoneInfo("Asia/Jakarta")
-    now = datetime.now(jakarta_tz)
+    now = datetime.now(JAKARTA_TZ)
     today = now.strftime("%Y-%m-%d")
     current_time = now.strftime("%H:%M:%S")
     
@@ -5543,12 +7696,13 @@ async def clock_attendance(request: Request):
         backdate_token = emp.get("backdate_token")
         has_valid_token = backdate_token and not backdate_token.get("used")
         
-        if not has_valid_token and not settings.get("allow_backdate"):
+        if not has_valid_token and not settings.allow_backdate:
             raise HTTPException(status_code=403, detail="Absen mundur tanggal tidak diizinkan. Hubungi HRD untuk akses.")
         
         if has_valid_token:
             # Mark token as used
-            await db.employees.update_one({"id": employee_id}, {"$set": {"backdate_token.used": True}})
+            await db.employees.update_one({"id": employee_id}, {"$set": {"backdate_token.used": True, "rev": await next_rev()}})
+            await employee_written(employee_id)
         
         today = backdate
         is_backdate = True  # Always treat as backdate when date is explicitly sent
@@ -5557,7 +7711,7 @@ async def clock_attendance(request: Request):
         current_time = backtime + ":00"
     
     # Check face threshold
-    threshold = settings.get("face_threshold", 70)
+    threshold = settings.face_threshold
     needs_approval = face_score < threshold
     status = "pending_approval" if needs_approval else "approved"
     
@@ -5575,7 +7729,10 @@ async def clock_attendance(request: Request):
             "employee_name": session.get("name", emp.get("name", "")),
             "employee_email": session.get("email", emp.get("email", "")),
             "company_id": company_id,
+            "outlet_id": used_outlet_id,
             "date": today,
+            "day": attendance_day(today),
+            "employee_active": True, "employee_removed": False,
             "clock_in": None, "clock_out": None,
             "break_start": None, "break_end": None,
             "clock_in_photo": None, "clock_out_photo": None,
@@ -5584,7 +7741,8 @@ async def clock_attendance(request: Request):
             "status": status,
             "is_backdate": is_backdate,
             "notes": None,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "rev": await next_rev()
         }
         await db.attendance.insert_one(record)
     
@@ -5596,7 +7754,8 @@ async def clock_attendance(request: Request):
         pending_change = {
             "action": action, "time": current_time, "photo_url": photo_url,
             "face_score": face_score, "ip": client_ip, "date": today,
-            "geo_location": geo_location
+            "geo_location": geo_location,
+            "outlet_id": used_outlet_id, "outlet_name": used_outlet_name
         }
         update_fields = {
             "status": "pending_approval",
@@ -5610,6 +7769,7 @@ async def clock_attendance(request: Request):
                 "clock_in": current_time, "clock_in_photo": photo_url,
                 "clock_in_score": face_score, "clock_in_ip": client_ip,
                 "clock_in_geo": geo_location,
+                "clock_in_outlet_id": used_outlet_id, "clock_in_outlet_name": used_outlet_name,
                 "status": status
             }
         elif action == "clock_out":
@@ -5620,7 +7780,8 @@ async def clock_attendance(request: Request):
             update_fields = {
                 "clock_out": current_time, "clock_out_photo": photo_url,
                 "clock_out_score": face_score, "clock_out_ip": client_ip,
-                "clock_out_geo": geo_location
+                "clock_out_geo": geo_location,
+                "clock_out_outlet_id": used_outlet_id, "clock_out_outlet_name": used_outlet_name
             }
         elif action == "break_start":
             update_fields = {
@@ -5636,11 +7797,20 @@ async def clock_attendance(request: Request):
                 "break_end_score": face_score,
                 "break_end_geo": geo_location
             }
+        update_fields.update(attendance_derived_fields({**record, **update_fields}))
+    update_fields["rev"] = await next_rev()
     
     await db.attendance.update_one(
         {"employee_id": employee_id, "company_id": company_id, "date": today},
         {"$set": update_fields}
     )
+    # Best-effort like every rollup refresh; keep the $merge off the clock-in path
+    spawn(refresh_attendance_rollups(company_id, [employee_id], [today[:7]]))
+    event_bus.publish(company_id, "attendance.clock", {
+        "id": record["id"], "employee_id": employee_id, "employee_name": record.get("employee_name"),
+        "date": today, "action": action, "time": current_time, "status": status,
+        "needs_approval": needs_approval, "outlet_name": used_outlet_name
+    })
     
     return {
         "message": f"{'Absen masuk' if action == 'clock_in' else 'Absen pulang' if action == 'clock_out' else 'Break mulai' if action == 'break_start' else 'Break selesai'} berhasil" + (" (menunggu approval)" if needs_approval else ""),
@@ -5656,9 +7826,9 @@ async def get_my_attendance(request: Request, month: Optional[str] = None):
     
     query = {"employee_id": session["user_id"], "company_id": session["company_id"]}
     if month:  # Format: 2026-03
-        query["date"] = {"$regex": f"^{month}"}
+        query["day"] = attendance_day_filter(month=month)
     
-    records = await db.attendance.find(query, {"_id": 0}).sort("date", -1).to_list(100)
+    records = await db.attendance.find(query, {"_id": 0}).sort("day", -1).to_list(100)
     
     # Check if employee has backdate token
     emp = await db.employees.find_one({"id": session["user_id"]}, {"_id": 0})
@@ -5670,8 +7840,7 @@ async def get_my_attendance(request: Request, month: Optional[str] = None):
 async def get_today_attendance(request: Request):
     """Get employee's today attendance status"""
     session = await get_session_user(request)
-    from zoneinfo import ZoneInfo
-    today = datetime.now(ZoneInfo("Asia/Jakarta")).strftime("%Y-%m-%d")
+    today = datetime.now(JAKARTA_TZ).strftime("%Y-%m-%d")
     
     record = await db.attendance.find_one({
         "employee_id": session["user_id"],
@@ -5682,55 +7851,58 @@ async def get_today_attendance(request: Request):
     return record or {"date": today, "clock_in": None, "clock_out": None, "break_start": None, "break_end": None}
 
 @api_router.get("/attendance/company")
-async def get_company_attendance(request: Request, date: Optional[str] = None, month: Optional[str] = None):
+@db_budget(6)
+async def get_company_attendance(request: Request, date: Optional[str] = None, month: Optional[str] = None, skip: int = 0, limit: int = 1000):
     """Get all attendance records for company (admin)"""
     session = await require_session_admin(request)
     
-    query = {"company_id": session["company_id"]}
-    if date:
-        query["date"] = date
-    elif month:
-        query["date"] = {"$regex": f"^{month}"}
+    # Only employees still in this company (excludes trashed & permanently deleted)
+    query = {"company_id": session["company_id"], "employee_active": True}
+    if date or month:
+        query["day"] = attendance_day_filter(date, month)
     else:
-        from zoneinfo import ZoneInfo
-        query["date"] = datetime.now(ZoneInfo("Asia/Jakarta")).strftime("%Y-%m-%d")
-    
-    records = await db.attendance.find(query, {"_id": 0}).sort("date", -1).to_list(1000)
-    
-    # Filter: only show records for employees still in this company (exclude trashed & permanently deleted)
-    active_emps = await db.employees.find(
-        {"companies": session["company_id"], "$or": [{"trashed": {"$ne": True}}, {"trashed": {"$exists": False}}]},
-        {"_id": 0, "id": 1}
-    ).to_list(10000)
-    active_ids = {e["id"] for e in active_emps}
-    records = [r for r in records if r.get("employee_id") in active_ids]
+        query["day"] = attendance_day(datetime.now(JAKARTA_TZ).strftime("%Y-%m-%d"))
     
+    limit = min(max(limit, 1), 1000)
+    records = await db.attendance.find(query, {"_id": 0}).sort("day", -1).skip(max(skip, 0)).limit(limit).to_list(limit)
     return records
 
-@api_router.get("/attendance/export")
-async def export_attendance_excel(request: Request, month: Optional[str] = None, date: Optional[str] = None):
-    """Export attendance to Excel (.xlsx)"""
+@api_router.get("/attendance/company/changes")
+async def get_company_attendance_changes(request: Request, since: str = "0", date: Optional[str] = None, month: Optional[str] = None):
+    """Delta sync: attendance written after `since`; records of removed employees as tombstones"""
     session = await require_session_admin(request)
-    
     query = {"company_id": session["company_id"]}
-    filename_part = "semua"
-    if date:
-        query["date"] = date
-        filename_part = date
-    elif month:
-        query["date"] = {"$regex": f"^{month}"}
-        filename_part = month
-    
-    records = await db.attendance.find(query, {"_id": 0}).sort("date", 1).to_list(10000)
+    if date or month:
+        query["day"] = attendance_day_filter(date, month)
+    return await fetch_changes(
+        db.attendance, session["company_id"], "attendance", query, since,
+        is_tombstone=lambda record: not record.get("employee_active", True)
+    )
+
+@api_router.get("/attendance/summary")
+async def get_attendance_summary(request: Request, month: Optional[str] = None):
+    """Monthly per-employee attendance summary (admin), read from attendance_rollups"""
+    session = await require_session_admin(request)
+    month = month or datetime.now(JAKARTA_TZ).strftime("%Y-%m")
+    attendance_day_filter(month=month)  # Validates format
     
-    # Filter: only active employees
-    active_emps = await db.employees.find(
-        {"companies": session["company_id"], "$or": [{"trashed": {"$ne": True}}, {"trashed": {"$exists": False}}]},
-        {"_id": 0, "id": 1}
-    ).to_list(10000)
-    active_ids = {e["id"] for e in active_emps}
-    records = [r for r in records if r.get("employee_id") in active_ids]
+    rows = await db.attendance_rollups.find(
+        {"company_id": session["company_id"], "month": month, "employee_active": True},
+        {"_id": 0, "company_id": 0, "employee_active": 0, "employee_removed": 0}
+    ).sort("employee_name", 1).to_list(None)
     
+    totals = {key: sum(r.get(key, 0) for r in rows) for key in ("days_present", "late_count", "work_minutes", "break_minutes", "pending_count")}
+    return {"month": month, "employees": rows, "totals": totals}
+
+@api_router.post("/attendance/summary/rebuild")
+async def rebuild_attendance_summary(request: Request):
+    """Rebuild this company's attendance rollups from the raw records (admin)"""
+    session = await require_session_admin(request)
+    await rebuild_attendance_rollups(db, session["company_id"])
+    return {"message": "Ringkasan absensi berhasil dihitung ulang"}
+
+def build_attendance_workbook(records: List[dict], outlet_lookup: dict, division_lookup: dict, emp_lookup: dict) -> bytes:
+    """Attendance records as one colour-coded sheet, as .xlsx bytes"""
     import openpyxl
     from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
     
@@ -5762,17 +7934,6 @@ async def export_attendance_excel(request: Request, month: Optional[str] = None,
         cell.alignment = header_align
         cell.border = thin_border
     
-    # Helper: calc duration
-    def calc_dur(start, end):
-        if not start or not end: return ""
-        try:
-            sh, sm = int(start[:2]), int(start[3:5])
-            eh, em = int(end[:2]), int(end[3:5])
-            mins = (eh * 60 + em) - (sh * 60 + sm)
-            if mins < 0: mins += 24 * 60
-            return f"{mins // 60}j {mins % 60}m"
-        except: return ""
-    
     # Status label
     status_map = {"approved": "OK", "pending_approval": "Menunggu", "rejected": "Ditolak"}
     
@@ -5781,16 +7942,6 @@ async def export_attendance_excel(request: Request, month: Optional[str] = None,
     red_fill = PatternFill(start_color="FFEBEE", end_color="FFEBEE", fill_type="solid")
     yellow_fill = PatternFill(start_color="FFF8E1", end_color="FFF8E1", fill_type="solid")
     
-    # Build outlet/division lookup
-    all_outlets = await db.outlets.find({"company_id": session["company_id"]}, {"_id": 0}).to_list(100)
-    all_divisions = await db.divisions.find({"company_id": session["company_id"]}, {"_id": 0}).to_list(100)
-    outlet_lookup = {o["id"]: o["name"] for o in all_outlets}
-    division_lookup = {d["id"]: d["name"] for d in all_divisions}
-    emp_lookup = {}
-    all_emps = await db.employees.find({"companies": session["company_id"]}, {"_id": 0, "id": 1, "outlet_id": 1, "division_id": 1}).to_list(10000)
-    for e in all_emps:
-        emp_lookup[e["id"]] = e
-    
     for idx, r in enumerate(records, 1):
         row = idx + 1
         geo_in = r.get("clock_in_geo", {}) or {}
@@ -5802,14 +7953,14 @@ async def export_attendance_excel(request: Request, month: Optional[str] = None,
             r.get("date", ""),
             r.get("employee_name", ""),
             r.get("employee_email", ""),
-            outlet_lookup.get(emp.get("outlet_id"), ""),
+            r.get("clock_in_outlet_name") or outlet_lookup.get(emp.get("outlet_id"), ""),
             division_lookup.get(emp.get("division_id"), ""),
             (r.get("clock_in") or "")[:5],
             (r.get("clock_out") or "")[:5],
-            calc_dur(r.get("clock_in"), r.get("clock_out")),
+            format_minutes(r.get("work_minutes")),
             (r.get("break_start") or "")[:5],
             (r.get("break_end") or "")[:5],
-            calc_dur(r.get("break_start"), r.get("break_end")),
+            format_minutes(r.get("break_minutes")),
             r.get("clock_in_score", ""),
             r.get("clock_out_score", ""),
             r.get("clock_in_ip", ""),
@@ -5847,7 +7998,33 @@ async def export_attendance_excel(request: Request, month: Optional[str] = None,
     # Save to bytes
     output = io.BytesIO()
     wb.save(output)
-    output.seek(0)
+    return output.getvalue()
+
+@api_router.get("/attendance/export")
+async def export_attendance_excel(request: Request, month: Optional[str] = None, date: Optional[str] = None):
+    """Export attendance to Excel (.xlsx)"""
+    session = await require_session_admin(request)
+    
+    # Only active employees
+    query = {"company_id": session["company_id"], "employee_active": True}
+    filename_part = "semua"
+    if date or month:
+        query["day"] = attendance_day_filter(date, month)
+        filename_part = date or month
+    
+    records = await db.attendance.find(query, {"_id": 0}).sort("day", 1).to_list(10000)
+    
+    # Build outlet/division lookup
+    all_outlets = await db.outlets.find({"company_id": session["company_id"]}, {"_id": 0}).to_list(100)
+    all_divisions = await db.divisions.find({"company_id": session["company_id"]}, {"_id": 0}).to_list(100)
+    outlet_lookup = {o["id"]: o["name"] for o in all_outlets}
+    division_lookup = {d["id"]: d["name"] for d in all_divisions}
+    emp_lookup = {}
+    all_emps = await db.employees.find({"companies": session["company_id"]}, {"_id": 0, "id": 1, "outlet_id": 1, "division_id": 1}).to_list(10000)
+    for e in all_emps:
+        emp_lookup[e["id"]] = e
+    
+    output = io.BytesIO(await asyncio.to_thread(build_attendance_workbook, records, outlet_lookup, division_lookup, emp_lookup))
     
     company = await db.companies.find_one({"id": session["company_id"]}, {"_id": 0, "name": 1})
     company_name = (company.get("name", "company") if company else "company").replace(" ", "_")
@@ -5862,134 +8039,138 @@ async def export_attendance_excel(request: Request, month: Optional[str] = None,
 
 
 @api_router.get("/attendance/pending")
-async def get_pending_attendance(request: Request):
+@db_budget(6)
+async def get_pending_attendance(request: Request, skip: int = 0, limit: int = 100):
     """Get attendance records pending approval"""
     session = await require_session_admin(request)
+    limit = min(max(limit, 1), 1000)
+    # Excludes only permanently deleted employees (trashed still show for approval)
     records = await db.attendance.find({
         "company_id": session["company_id"],
+        "employee_removed": False,
         "$or": [
             {"status": "pending_approval"},
             {"pending_change": {"$ne": None, "$exists": True}}
         ]
-    }, {"_id": 0}).sort("date", -1).to_list(100)
-    
-    # Filter: exclude only permanently deleted employees (trashed still show for approval)
-    active_emps = await db.employees.find(
-        {"companies": session["company_id"]},
-        {"_id": 0, "id": 1}
-    ).to_list(10000)
-    active_ids = {e["id"] for e in active_emps}
-    records = [r for r in records if r.get("employee_id") in active_ids]
+    }, {"_id": 0}).sort("day", -1).skip(max(skip, 0)).limit(limit).to_list(limit)
     
     return records
 
+# Fields a pending change copies onto the record, per action
+PENDING_CHANGE_FIELDS = {
+    "clock_in": {"clock_in": "time", "clock_in_photo": "photo_url", "clock_in_score": "face_score", "clock_in_ip": "ip", "clock_in_outlet_id": "outlet_id", "clock_in_outlet_name": "outlet_name"},
+    "clock_out": {"clock_out": "time", "clock_out_photo": "photo_url", "clock_out_score": "face_score", "clock_out_ip": "ip", "clock_out_outlet_id": "outlet_id", "clock_out_outlet_name": "outlet_name"},
+    "break_start": {"break_start": "time", "break_start_photo": "photo_url", "break_start_score": "face_score"},
+    "break_end": {"break_end": "time", "break_end_photo": "photo_url", "break_end_score": "face_score"},
+}
+
+def attendance_approval_op(record: dict, approve: bool, approver_id: str, now_str: str, rev: int) -> UpdateOne:
+    """Build the update that approves or rejects one attendance record"""
+    pending = record.get("pending_change")
+    update_data = {"approved_by": approver_id, "approved_at": now_str, "pending_change": None, "rev": rev}
+    if approve:
+        update_data["status"] = "approved"
+        # Apply pending change if exists (low face score / backdate)
+        if pending:
+            for field, key in PENDING_CHANGE_FIELDS.get(pending.get("action"), {}).items():
+                update_data[field] = pending.get(key)
+            update_data.update(attendance_derived_fields({**record, **update_data}))
+    else:
+        # Rejected — discard pending change, keep original data; a record
+        # with an approved clock-in stays approved
+        update_data["status"] = "approved" if record.get("clock_in") else "rejected"
+        if pending:
+            update_data["last_rejection"] = {
+                "action": pending.get("action", "unknown"),
+                "time": pending.get("time"),
+                "rejected_at": now_str, "rejected_by": approver_id
+            }
+    return UpdateOne({"id": record["id"], "company_id": record["company_id"]}, {"$set": update_data})
+
+async def apply_attendance_approvals(records: List[dict], approve: bool, approver_id: str) -> List[dict]:
+    """Approve/reject records with a single unordered bulk_write; returns per-record results"""
+    if not records:
+        return []
+    now_str = datetime.now(timezone.utc).isoformat()
+    rev = await next_rev()
+    ops = [attendance_approval_op(r, approve, approver_id, now_str, rev) for r in records]
+    failed = {}
+    try:
+        await db.attendance.bulk_write(ops, ordered=False)
+    except BulkWriteError as e:
+        for err in e.details.get("writeErrors", []):
+            failed[err["index"]] = err.get("errmsg", "error")
+    
+    by_company = {}
+    for r in records:
+        employees, months = by_company.setdefault(r["company_id"], (set(), set()))
+        employees.add(r["employee_id"])
+        months.add(r["date"][:7])
+    for company_id, (employees, months) in by_company.items():
+        await refresh_attendance_rollups(company_id, list(employees), list(months))
+        event_bus.publish(company_id, "attendance.approval", {
+            "approve": approve,
+            "ids": [r["id"] for i, r in enumerate(records) if i not in failed and r["company_id"] == company_id]
+        })
+    result = "approved" if approve else "rejected"
+    return [
+        {"id": r["id"], "result": "error", "error": failed[i]} if i in failed else {"id": r["id"], "result": result}
+        for i, r in enumerate(records)
+    ]
+
 @api_router.put("/attendance/{record_id}/approve")
 async def approve_attendance(record_id: str, approve: bool, request: Request):
     """Approve or reject attendance (admin)"""
     session = await require_session_admin(request)
     
-    record = await db.attendance.find_one({"id": record_id, "company_id": session["company_id"]})
+    record = await db.attendance.find_one({"id": record_id, "company_id": session["company_id"]}, {"_id": 0})
     if not record:
         raise HTTPException(status_code=404, detail="Record tidak ditemukan")
     
-    now_str = datetime.now(timezone.utc).isoformat()
-    
-    if approve:
-        update_data = {"status": "approved", "approved_by": session["user_id"], "approved_at": now_str}
-        
-        # Apply pending change if exists (from backdate with low score)
-        pending = record.get("pending_change")
-        if pending:
-            action = pending["action"]
-            if action == "clock_in":
-                update_data.update({"clock_in": pending["time"], "clock_in_photo": pending["photo_url"], "clock_in_score": pending["face_score"], "clock_in_ip": pending["ip"]})
-            elif action == "clock_out":
-                update_data.update({"clock_out": pending["time"], "clock_out_photo": pending["photo_url"], "clock_out_score": pending["face_score"], "clock_out_ip": pending["ip"]})
-            elif action == "break_start":
-                update_data.update({"break_start": pending["time"], "break_start_photo": pending["photo_url"], "break_start_score": pending["face_score"]})
-            elif action == "break_end":
-                update_data.update({"break_end": pending["time"], "break_end_photo": pending["photo_url"], "break_end_score": pending["face_score"]})
-            update_data["pending_change"] = None
-        
-        await db.attendance.update_one({"id": record_id}, {"$set": update_data})
-    else:
-        # Rejected — discard pending change, keep original data
-        # If there was existing approved data, keep it approved
-        # Add rejection note so employee can see it was rejected
-        prev_status = "approved" if record.get("clock_in") and not record.get("pending_change") else "rejected"
-        if record.get("pending_change"):
-            prev_status = "approved" if record.get("clock_in") else "rejected"
-        
-        update_data = {
-            "approved_by": session["user_id"],
-            "approved_at": now_str,
-            "pending_change": None,
-            "last_rejection": {
-                "action": record.get("pending_change", {}).get("action", "unknown"),
-                "time": record.get("pending_change", {}).get("time"),
-                "rejected_at": now_str,
-                "rejected_by": session["user_id"]
-            }
-        }
-        # Restore previous status (keep approved if was already approved before backdate attempt)
-        if record.get("clock_in"):
-            update_data["status"] = "approved"
-        else:
-            update_data["status"] = "rejected"
-        
-        await db.attendance.update_one({"id": record_id}, {"$set": update_data})
-    
+    results = await apply_attendance_approvals([record], approve, session["user_id"])
+    if results[0]["result"] == "error":
+        raise HTTPException(status_code=500, detail="Gagal memproses absen")
     return {"message": f"Absen {'disetujui' if approve else 'ditolak'}"}
 
+BULK_APPROVE_MAX = 5000
+
 @api_router.post("/attendance/bulk-approve")
 async def bulk_approve_attendance(request: Request):
-    """Bulk approve or reject attendance records"""
+    """
+    Bulk approve or reject attendance records.
+    Body: {"record_ids": [...], "approve": true} or, to act on every pending
+    record matching a filter, {"filter": {"date"|"month", "outlet_id", "employee_id"}, "approve": true}
+    """
     session = await require_session_admin(request)
     body = await request.json()
-    record_ids = body.get("record_ids", [])
+    record_ids = body.get("record_ids") or []
+    filters = body.get("filter") or {}
     approve = body.get("approve", True)
     
-    if not record_ids:
+    query = {"company_id": session["company_id"]}
+    if record_ids:
+        query["id"] = {"$in": record_ids}
+    elif filters:
+        query["employee_removed"] = False
+        conditions = [{"$or": [{"status": "pending_approval"}, {"pending_change": {"$ne": None, "$exists": True}}]}]
+        if filters.get("date") or filters.get("month"):
+            query["day"] = attendance_day_filter(filters.get("date"), filters.get("month"))
+        if filters.get("employee_id"):
+            query["employee_id"] = filters["employee_id"]
+        if filters.get("outlet_id"):
+            conditions.append({"$or": [{"outlet_id": filters["outlet_id"]}, {"pending_change.outlet_id": filters["outlet_id"]}]})
+        query["$and"] = conditions
+    else:
         raise HTTPException(status_code=400, detail="Pilih minimal 1 record")
     
-    now_str = datetime.now(timezone.utc).isoformat()
-    count = 0
+    records = await db.attendance.find(query, {"_id": 0}).limit(BULK_APPROVE_MAX).to_list(BULK_APPROVE_MAX)
+    results = await apply_attendance_approvals(records, approve, session["user_id"])
     
-    for rid in record_ids:
-        record = await db.attendance.find_one({"id": rid, "company_id": session["company_id"]})
-        if not record:
-            continue
-        
-        if approve:
-            update_data = {"status": "approved", "approved_by": session["user_id"], "approved_at": now_str}
-            pending = record.get("pending_change")
-            if pending:
-                action = pending["action"]
-                if action == "clock_in":
-                    update_data.update({"clock_in": pending["time"], "clock_in_photo": pending["photo_url"], "clock_in_score": pending["face_score"], "clock_in_ip": pending["ip"]})
-                elif action == "clock_out":
-                    update_data.update({"clock_out": pending["time"], "clock_out_photo": pending["photo_url"], "clock_out_score": pending["face_score"], "clock_out_ip": pending["ip"]})
-                elif action == "break_start":
-                    update_data.update({"break_start": pending["time"], "break_start_photo": pending["photo_url"], "break_start_score": pending["face_score"]})
-                elif action == "break_end":
-                    update_data.update({"break_end": pending["time"], "break_end_photo": pending["photo_url"], "break_end_score": pending["face_score"]})
-                update_data["pending_change"] = None
-            await db.attendance.update_one({"id": rid}, {"$set": update_data})
-        else:
-            update_data = {
-                "approved_by": session["user_id"], "approved_at": now_str, "pending_change": None,
-                "status": "approved" if record.get("clock_in") else "rejected"
-            }
-            if record.get("pending_change"):
-                update_data["last_rejection"] = {
-                    "action": record["pending_change"].get("action", "unknown"),
-                    "time": record["pending_change"].get("time"),
-                    "rejected_at": now_str, "rejected_by": session["user_id"]
-                }
-            await db.attendance.update_one({"id": rid}, {"$set": update_data})
-        count += 1
+    found = {r["id"] for r in records}
+    results += [{"id": rid, "result": "not_found"} for rid in record_ids if rid not in found]
+    count = sum(1 for r in results if r["result"] in ("approved", "rejected"))
     
-    return {"message": f"{count} absen {'disetujui' if approve else 'ditolak'}"}
+    return {"message": f"{count} absen {'disetujui' if approve else 'ditolak'}", "count": count, "results": results}
 
 
 
@@ -6007,8 +8188,10 @@ async def grant_backdate_access(employee_id: str, request: Request):
             "granted_by": session["user_id"],
             "granted_at": datetime.now(timezone.utc).isoformat(),
             "used": False
-        }
+        },
+        "rev": await next_rev()
     }})
+    await employee_written(employee_id)
     
     return {"message": f"Akses absen mundur diberikan ke {emp.get('name')}"}
 
@@ -6026,8 +8209,10 @@ async def grant_face_update_access(employee_id: str, request: Request):
             "granted_by": session["user_id"],
             "granted_at": datetime.now(timezone.utc).isoformat(),
             "used": False
-        }
+        },
+        "rev": await next_rev()
     }})
+    await employee_written(employee_id)
     
     return {"message": f"Akses perbarui wajah diberikan ke {emp.get('name')}"}
 
@@ -6040,10 +8225,81 @@ async def grant_face_update_access(employee_id: str, request: Request):
 async def root():
     return {"message": "Lucky Cell HR System API", "status": "running"}
 
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+@api_router.get("/metrics")
+async def get_metrics(request: Request):
+    """Prometheus metrics of this worker; requires Authorization: Bearer METRICS_TOKEN"""
+    auth = request.headers.get("authorization", "").encode()
+    if not METRICS_TOKEN or not secrets.compare_digest(auth, f"Bearer {METRICS_TOKEN}".encode()):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @api_router.get("/health")
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.now(timezone.utc).isoformat()}
 
+# ============ LIVENESS & READINESS ============
+
+# /health/live only proves the process answers; restart it if that fails.
+# /health/ready checks what this worker depends on and returns 503 when any
+# check is over its threshold, so nginx / the deploy script stop sending it
+# traffic until it recovers. Thresholds are per-worker and env-configurable.
+READY_MONGO_PING_MS = float(os.environ.get('READY_MONGO_PING_MS', '250'))
+READY_POOL_MAX_RATIO = float(os.environ.get('READY_POOL_MAX_RATIO', '0.9'))
+READY_LOOP_LAG_MS = float(os.environ.get('READY_LOOP_LAG_MS', '500'))
+READY_LOG_QUEUE_MAX_RATIO = float(os.environ.get('READY_LOG_QUEUE_MAX_RATIO', '0.8'))
+READY_THREAD_QUEUE_MAX = int(os.environ.get('READY_THREAD_QUEUE_MAX', '50'))
+READY_MIN_FREE_MB = float(os.environ.get('READY_MIN_FREE_MB', '500'))
+
+def readiness_check(value, threshold, ok: bool = None) -> dict:
+    return {"ok": value <= threshold if ok is None else ok, "value": value, "threshold": threshold}
+
+async def mongo_ping_check() -> dict:
+    start = time.perf_counter()
+    try:
+        # Timeout at twice the threshold so a hung primary can't hang the probe
+        await asyncio.wait_for(db.command("ping"), timeout=READY_MONGO_PING_MS * 2 / 1000)
+    except Exception as e:
+        return {**readiness_check(None, READY_MONGO_PING_MS, ok=False), "error": type(e).__name__}
+    return readiness_check(round((time.perf_counter() - start) * 1000, 1), READY_MONGO_PING_MS)
+
+def readiness_checks() -> dict:
+    """Synchronous checks that read in-process state"""
+    # A stall in progress is lag the probe hasn't been able to report yet
+    overdue = max(0.0, time.monotonic() - loop_monitor.beat - loop_monitor.interval)
+    log_queue = activity_log_writer.stats()
+    disk = shutil.disk_usage(UPLOAD_DIR)
+    free_mb = round(disk.free / 1024 / 1024)
+    migration = attendance_migration_state()
+    return {
+        "mongo_pool": readiness_check(round(mongo_pool.checked_out / MONGO_MAX_POOL_SIZE, 3), READY_POOL_MAX_RATIO),
+        "event_loop_lag_ms": readiness_check(round(max(loop_monitor.lag, overdue) * 1000, 1), READY_LOOP_LAG_MS),
+        "activity_log_queue": readiness_check(
+            round(log_queue["queue_depth"] / max(log_queue["queue_capacity"], 1), 3), READY_LOG_QUEUE_MAX_RATIO),
+        "thread_pool_queue": readiness_check(thread_pool._work_queue.qsize(), READY_THREAD_QUEUE_MAX),
+        "upload_disk_free_mb": readiness_check(free_mb, READY_MIN_FREE_MB, ok=free_mb >= READY_MIN_FREE_MB),
+        "attendance_migration": readiness_check(migration, "done", ok=migration == "done"),
+    }
+
+@api_router.get("/health/live")
+async def health_live():
+    """Liveness: the worker process is up and its event loop runs"""
+    return {"status": "alive", "pid": os.getpid(), "timestamp": datetime.now(timezone.utc).isoformat()}
+
+@api_router.get("/health/ready")
+async def health_ready():
+    """Readiness: 200 when every dependency check passes, 503 (with the failing checks) otherwise"""
+    checks = {"mongo_ping_ms": await mongo_ping_check(), **readiness_checks()}
+    ready = all(check["ok"] for check in checks.values())
+    body = {
+        "status": "ready" if ready else "degraded",
+        "pid": os.getpid(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "checks": checks,
+    }
+    return JSONResponse(body, status_code=200 if ready else 503)
+
 # ============ OG META FOR SOCIAL CRAWLERS ============
 
 @api_router.get("/my-ip")
@@ -6054,12 +8310,7 @@ async def get_my_ip(request: Request):
         "x_real_ip": request.headers.get("x-real-ip"),
         "x_forwarded_for": request.headers.get("x-forwarded-for"),
         "client_host": request.client.host,
-        "resolved_ip": (
-            request.headers.get("cf-connecting-ip") or
-            request.headers.get("x-real-ip") or
-            request.headers.get("x-forwarded-for", "").split(",")[0].strip() or
-            request.client.host
-        )
+        "resolved_ip": get_client_ip(request)
     }
 
 
@@ -6225,15 +8476,28 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Request-ID", "X-Profile-ID"],
 )
+app.add_middleware(RequestProfilerMiddleware)
+app.add_middleware(RequestMetricsMiddleware)
 
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    format='%(asctime)s - %(name)s - %(levelname)s [%(request_id)s] - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await loop_monitor.stop()
+    if _spawned_tasks:
+        await asyncio.wait(_spawned_tasks, timeout=SPAWN_DRAIN_SECONDS)
+    await activity_log_writer.stop()
+    # Spawned work still running after the drain (e.g. a long rehydrate) is cancelled too
+    tasks = [*_background_tasks, *_spawned_tasks]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    thread_pool.shutdown(wait=False)
     client.close()
@@ -207,6 +207,43 @@ class TestActivityLogEndpoint:
         
         print(f"✓ Combined filters working: {len(data['logs'])} results")
 
+    def test_09b_cursor_pagination(self):
+        """Test that next_cursor continues after the last row without overlap"""
+        first = self.session.get(f"{BASE_URL}/api/logs/me?limit=2").json()
+        if not first["next_cursor"]:
+            pytest.skip("Not enough logs for a second page")
+
+        second = self.session.get(f"{BASE_URL}/api/logs/me?limit=2&cursor={first['next_cursor']}")
+        assert second.status_code == 200
+
+        first_ids = {log["id"] for log in first["logs"]}
+        for log in second.json()["logs"]:
+            assert log["id"] not in first_ids, "Cursor page repeats a row"
+            assert log["timestamp"] <= first["logs"][-1]["timestamp"]
+
+        print(f"✓ Cursor pagination working: {len(second.json()['logs'])} rows on page 2")
+
+    def test_09c_export_csv_and_ndjson(self):
+        """Test streaming export honours filters in both formats"""
+        response = self.session.get(f"{BASE_URL}/api/logs/me/export?format=csv&action=login")
+        assert response.status_code == 200, f"Failed: {response.text}"
+        assert response.headers["content-type"].startswith("text/csv")
+        lines = response.content.decode("utf-8-sig").splitlines()
+        assert lines[0].startswith("timestamp,user_name,user_email")
+
+        response = self.session.get(f"{BASE_URL}/api/logs/me/export?format=ndjson&action=login")
+        assert response.status_code == 200
+        import json
+        rows = [json.loads(line) for line in response.text.splitlines() if line]
+        for row in rows:
+            assert row["action"] == "login"
+            assert row["company_id"] == self.company_id
+
+        response = self.session.get(f"{BASE_URL}/api/logs/me/export?format=xml")
+        assert response.status_code == 400
+
+        print(f"✓ Export working: {len(lines) - 1} CSV rows, {len(rows)} NDJSON rows")
+
 
 class TestActivityLoggingOnActions:
     """Test that activity logs are created when admin performs actions"""
@@ -0,0 +1,114 @@
+"""
+Test Attendance Listing, Bulk Approval and Monthly Summary
+Tests GET /api/attendance/company pagination, POST /api/attendance/bulk-approve
+per-record results and GET /api/attendance/summary (attendance_rollups).
+
+Test credentials:
+- Company Admin: admin@lucky.com / Admin@2026! (company: PT. LUCKY PERDANA MULTIMEDIA)
+"""
+
+import pytest
+import requests
+import os
+from datetime import datetime
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+COMPANY_ADMIN_EMAIL = "admin@lucky.com"
+COMPANY_ADMIN_PASSWORD = "Admin@2026!"
+COMPANY_NAME = "PT. LUCKY PERDANA MULTIMEDIA"
+
+
+class TestAttendanceSummary:
+    """Attendance endpoints backed by employee flags, bulk_write and rollups"""
+
+    session = requests.Session()
+
+    @classmethod
+    def setup_class(cls):
+        """Login as company admin before running tests"""
+        login_response = cls.session.post(
+            f"{BASE_URL}/api/auth/unified-login",
+            json={"email": COMPANY_ADMIN_EMAIL, "password": COMPANY_ADMIN_PASSWORD}
+        )
+        assert login_response.status_code == 200, f"Login failed: {login_response.text}"
+
+        company_access = next(
+            (a for a in login_response.json()["access_list"] if COMPANY_NAME in a["company_name"]), None
+        )
+        assert company_access is not None, f"Company '{COMPANY_NAME}' not found in access_list"
+
+        select_response = cls.session.post(
+            f"{BASE_URL}/api/auth/select-company",
+            json={
+                "company_id": company_access["company_id"],
+                "role": company_access["role"],
+                "user_table": company_access["user_table"],
+                "user_id": company_access["user_id"]
+            }
+        )
+        assert select_response.status_code == 200, f"Company selection failed: {select_response.text}"
+        cls.month = datetime.now().strftime("%Y-%m")
+        print(f"✓ Logged in to {select_response.json()['company_name']}")
+
+    def test_01_company_attendance_month_with_limit(self):
+        """Month filter returns a list capped by limit"""
+        response = self.session.get(f"{BASE_URL}/api/attendance/company?month={self.month}&limit=5")
+        assert response.status_code == 200, f"Failed: {response.text}"
+        records = response.json()
+        assert isinstance(records, list)
+        assert len(records) <= 5
+        for r in records:
+            assert r["date"].startswith(self.month)
+        print(f"✓ {len(records)} record(s) for {self.month}")
+
+    def test_02_invalid_month_rejected(self):
+        """Malformed month returns 400 instead of an empty regex match"""
+        response = self.session.get(f"{BASE_URL}/api/attendance/company?month=2026-13")
+        assert response.status_code == 400
+        print("✓ Invalid month rejected")
+
+    def test_03_bulk_approve_reports_unknown_ids(self):
+        """Unknown record ids come back as not_found"""
+        response = self.session.post(
+            f"{BASE_URL}/api/attendance/bulk-approve",
+            json={"record_ids": ["does-not-exist"], "approve": True}
+        )
+        assert response.status_code == 200, f"Failed: {response.text}"
+        data = response.json()
+        assert data["count"] == 0
+        assert data["results"] == [{"id": "does-not-exist", "result": "not_found"}]
+        print("✓ Bulk approve per-record results")
+
+    def test_04_bulk_approve_requires_ids_or_filter(self):
+        """Empty body is rejected"""
+        response = self.session.post(f"{BASE_URL}/api/attendance/bulk-approve", json={"approve": True})
+        assert response.status_code == 400
+        print("✓ Bulk approve requires record_ids or filter")
+
+    def test_05_monthly_summary_format(self):
+        """Summary returns one row per employee plus totals"""
+        response = self.session.get(f"{BASE_URL}/api/attendance/summary?month={self.month}")
+        assert response.status_code == 200, f"Failed: {response.text}"
+        data = response.json()
+        assert data["month"] == self.month
+        assert isinstance(data["employees"], list)
+        for key in ("days_present", "late_count", "work_minutes", "break_minutes", "pending_count"):
+            assert key in data["totals"], f"Missing total '{key}'"
+        for row in data["employees"]:
+            assert row["month"] == self.month
+            assert row["days_present"] <= row["records"]
+        print(f"✓ Summary for {len(data['employees'])} employee(s)")
+
+    def test_06_summary_rebuild(self):
+        """Rebuilding rollups keeps the summary consistent"""
+        before = self.session.get(f"{BASE_URL}/api/attendance/summary?month={self.month}").json()
+        response = self.session.post(f"{BASE_URL}/api/attendance/summary/rebuild")
+        assert response.status_code == 200, f"Failed: {response.text}"
+        after = self.session.get(f"{BASE_URL}/api/attendance/summary?month={self.month}").json()
+        assert before["totals"] == after["totals"]
+        print("✓ Rollup rebuild matches incremental totals")
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "--tb=short"])
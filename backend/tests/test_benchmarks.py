@@ -0,0 +1,301 @@
+"""
+Microbenchmarks for CPU-bound helpers in server.py
+Runs the Excel writers, CV thumbnailer, company/license builders, email HTML
+builders, attendance duration math, haversine / nearest outlet, the employee
+import mapper, list response serialization (FastAPI response_model path vs the
+orjson fast path and streaming) and verify_password on synthetic inputs at
+several sizes.
+
+No server or database is needed (server.py is imported, MongoDB is never contacted).
+
+Usage:
+  pytest tests/test_benchmarks.py --benchmark-json=benchmarks.json        # Machine-readable results
+  pytest tests/test_benchmarks.py --benchmark-autosave                    # Save to .benchmarks/
+  pytest tests/test_benchmarks.py --benchmark-compare --benchmark-compare-fail=mean:10%
+"""
+
+import asyncio
+import json
+import os
+import random
+from typing import List
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "makar_benchmarks")
+
+import server  # noqa: E402
+
+NOW = datetime(2026, 7, 1, tzinfo=timezone.utc)
+FIRST_NAMES = ["Budi", "Siti", "Agus", "Dewi", "Andi", "Rina", "Joko", "Sri"]
+LAST_NAMES = ["Santoso", "Wijaya", "Saputra", "Lestari", "Pratama", "Hidayat"]
+
+
+def person(rng, i):
+    name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+    return name, f"{name.lower().replace(' ', '.')}.{i}@example.com"
+
+
+def make_employees(n):
+    rng = random.Random(n)
+    employees = []
+    for i in range(n):
+        name, email = person(rng, i)
+        employees.append({
+            "id": f"emp_{i:012d}", "name": name, "email": email, "phone": f"08{rng.randrange(10**10):010d}",
+            "gender": rng.choice(["Laki-laki", "Perempuan"]), "education": rng.choice(["SMA/SMK", "D3", "S1"]),
+            "outlet_id": f"outlet-{i % 20}", "division_id": f"div-{i % 8}", "position": "Staff",
+            "employment_type": rng.choice(["tetap", "kontrak"]), "join_date": "2024-01-15",
+            "city": "Jakarta Selatan", "full_address": f"Jl. Melati No. {i}, RT 01 / RW 02", "is_active": i % 10 != 0,
+        })
+    return employees
+
+
+def make_attendance(n):
+    rng = random.Random(n)
+    records = []
+    for i in range(n):
+        record = {
+            "id": f"att-{i}", "employee_id": f"emp_{i % 500:012d}", "employee_name": "Budi Santoso",
+            "employee_email": "budi@example.com", "date": (NOW - timedelta(days=i % 365)).strftime("%Y-%m-%d"),
+            "clock_in": f"0{rng.randrange(7, 9)}:{rng.randrange(60):02d}:00", "clock_out": f"17:{rng.randrange(60):02d}:00",
+            "break_start": "12:00:00", "break_end": "13:00:00", "clock_in_score": 0.92, "clock_out_score": 0.88,
+            "status": rng.choice(["approved", "approved", "pending_approval", "rejected"]),
+        }
+        record.update(server.attendance_derived_fields(record))
+        records.append(record)
+    return records
+
+
+def make_applications(n):
+    rng = random.Random(n)
+    apps = []
+    for i in range(n):
+        name, email = person(rng, i)
+        form_data = {"full_name": name, "email": email, "phone": "081234567890", "education": "S1"}
+        if i % 2:
+            form_data.update({"city": "Bandung", "full_address": "Jl. Asia Afrika No. 1", "expected_salary": "5.000.000"})
+        apps.append({
+            "id": f"app-{i}", "job_id": f"job-{i % 5}", "form_data": form_data, "resume_url": None,
+            "status": "pending", "created_at": (NOW - timedelta(hours=i)).isoformat(),
+        })
+    return apps
+
+
+def make_companies(n):
+    return [{
+        "id": f"company-{i}", "name": f"PT Benchmark {i}", "slug": f"bench{i}", "domain": f"bench{i}.makar.id",
+        "is_active": i % 20 != 0, "license_type": "trial",
+        "license_end": (NOW + timedelta(days=i % 400 - 30)).isoformat() if i % 7 else None,
+        "created_at": NOW.isoformat(), "updated_at": NOW.isoformat(),
+    } for i in range(n)]
+
+
+# ============ EXCEL WRITERS ============
+
+@pytest.mark.parametrize("size", [100, 1000, 5000])
+def test_employees_workbook(benchmark, size):
+    employees = make_employees(size)
+    outlets = {f"outlet-{i}": f"Outlet {i}" for i in range(20)}
+    divisions = {f"div-{i}": f"Divisi {i}" for i in range(8)}
+    data = benchmark(server.build_employees_workbook, employees, outlets, divisions, "PT Benchmark")
+    assert data[:2] == b"PK"
+
+
+@pytest.mark.parametrize("size", [100, 1000, 10000])
+def test_attendance_workbook(benchmark, size):
+    records = make_attendance(size)
+    data = benchmark(server.build_attendance_workbook, records, {}, {}, {})
+    assert data[:2] == b"PK"
+
+
+@pytest.mark.parametrize("size", [10, 100, 1000])
+def test_applications_workbook(benchmark, size):
+    apps = make_applications(size)
+    jobs = {f"job-{i}": {"title": f"Sales {i}", "department": "Penjualan"} for i in range(5)}
+    data, cv_files = benchmark(server.build_applications_workbook, apps, jobs)
+    assert data[:2] == b"PK" and cv_files == []
+
+
+@pytest.mark.parametrize("dimensions", [(640, 480), (1920, 1080), (4000, 3000)])
+def test_application_thumbnail(benchmark, tmp_path, dimensions):
+    from PIL import Image
+    source = tmp_path / "cv.jpg"
+    Image.new("RGB", dimensions, (200, 180, 160)).save(source, "JPEG")
+
+    def thumbnail():
+        server.application_thumbnail(source).unlink()
+
+    benchmark(thumbnail)
+
+
+# ============ COMPANIES & LICENSES ============
+
+@pytest.mark.parametrize("size", [10, 100, 1000])
+def test_build_company_responses(benchmark, size):
+    companies = make_companies(size)
+    responses = benchmark(lambda: [server.build_company_response(c, 1, 10) for c in companies])
+    assert len(responses) == size
+
+
+@pytest.mark.parametrize("size", [100, 1000, 10000])
+def test_license_status(benchmark, size):
+    companies = make_companies(size)
+    statuses = benchmark(lambda: [server.get_license_status(c) for c in companies])
+    assert {s for s, _ in statuses} <= {"active", "expired", "suspended"}
+
+
+# ============ EMAIL BUILDERS ============
+
+def test_application_confirmation_email(benchmark):
+    application = make_applications(1)[0]
+    subject, html, text = benchmark(server.build_application_confirmation_email, application,
+                                    {"title": "Sales Promotor"}, {"name": "PT Benchmark"})
+    assert "Sales Promotor" in subject and "<div" in html
+
+
+@pytest.mark.parametrize("new_status", ["reviewing", "hired", "rejected"])
+def test_status_update_email(benchmark, new_status):
+    application = make_applications(1)[0]
+    subject, html, text = benchmark(server.build_status_update_email, application,
+                                    {"title": "Sales Promotor"}, {"name": "PT Benchmark"}, "pending", new_status)
+    assert server.STATUS_LABELS[new_status] in html
+
+
+# ============ ATTENDANCE MATH ============
+
+def test_attendance_durations(benchmark):
+    record = {"date": "2026-07-01", "clock_in": "07:58:12", "clock_out": "17:03:40",
+              "break_start": "12:00:00", "break_end": "12:55:00"}
+
+    def durations():
+        fields = server.attendance_derived_fields(record)
+        return server.format_minutes(fields["work_minutes"]), server.format_minutes(fields["break_minutes"])
+
+    assert benchmark(durations) == ("9j 5m", "0j 55m")
+
+
+def test_haversine(benchmark):
+    distance = benchmark(server.haversine, -6.2615, 106.8106, -6.2250, 106.9004)
+    assert 10000 < distance < 11000
+
+
+@pytest.mark.parametrize("outlets", [10, 100, 1000])
+def test_nearest_outlet(benchmark, outlets):
+    rng = random.Random(outlets)
+    docs = [{"id": f"outlet-{i}", "geo_enabled": True, "radius_meters": 150,
+             "latitude": -6.2 + rng.uniform(-0.3, 0.3), "longitude": 106.8 + rng.uniform(-0.3, 0.3)}
+            for i in range(outlets)]
+    config = server.AttendanceConfig("company-bench", 1, None, docs)
+    ids = [d["id"] for d in docs]
+    outlet, distance, _ = benchmark(config.nearest_outlet, ids, -6.21, 106.81)
+    assert outlet is not None and distance >= 0
+
+
+# ============ EMPLOYEE IMPORT ============
+
+@pytest.mark.parametrize("size", [100, 1000, 5000])
+def test_employee_import_mapper(benchmark, size):
+    headers = ["no", "nama lengkap", "email", "no. hp", "nik", "jenis kelamin", "tgl lahir", "pendidikan",
+               "kota", "alamat", "jabatan", "tanggal masuk", "gaji", "cabang", "division"]
+    rng = random.Random(size)
+    rows = []
+    for i in range(size):
+        name, email = person(rng, i)
+        rows.append((i + 1, name, email, "081234567890", f"{rng.randrange(10**16):016d}", "Perempuan",
+                     datetime(1995, 5, 15), "S1", "Bandung", "Jl. Merdeka No. 1", "Kasir", "2024-01-15",
+                     "4500000", f"Outlet {i % 20}", f"Divisi {i % 8}"))
+    outlets = {f"outlet {i}": f"outlet-{i}" for i in range(20)}
+    divisions = {f"divisi {i}": f"div-{i}" for i in range(8)}
+    now = NOW.isoformat()
+
+    def import_rows():
+        col_map = server.employee_import_columns(headers)
+        return [server.employee_import_data(row, col_map, outlets, divisions, now) for row in rows]
+
+    mapped = benchmark(import_rows)
+    assert mapped[0]["salary"] == 4500000 and mapped[0]["outlet_id"] == "outlet-0"
+
+
+# ============ LIST RESPONSES ============
+
+def application_models(n):
+    return [server.ApplicationResponse(
+        id=a["id"], job_id=a["job_id"], company_id="company-bench", job_title="Sales Promotor",
+        job_department="Penjualan", applicant_name=a["form_data"]["full_name"], applicant_email=a["form_data"]["email"],
+        form_data=a["form_data"], status=a["status"], created_at=a["created_at"], updated_at=a["created_at"],
+    ) for a in make_applications(n)]
+
+
+@pytest.mark.parametrize("size", [100, 1000, 5000])
+def test_list_response_model_path(benchmark, size):
+    """Baseline: FastAPI re-validates the returned models against response_model, then stdlib json"""
+    from fastapi.responses import JSONResponse
+    from fastapi.routing import serialize_response
+    from fastapi.utils import create_response_field
+    field = create_response_field(name="Response", type_=List[server.ApplicationResponse], mode="serialization")
+    rows = application_models(size)
+    loop = asyncio.new_event_loop()
+
+    def render():
+        content = loop.run_until_complete(serialize_response(field=field, response_content=rows, is_coroutine=True))
+        return JSONResponse(content).body
+
+    body = benchmark(render)
+    loop.close()
+    assert len(json.loads(body)) == size
+
+
+@pytest.mark.parametrize("size", [100, 1000, 5000])
+def test_list_response_fast_path(benchmark, size):
+    rows = application_models(size)
+    body = benchmark(lambda: server.model_list_response(rows).body)
+    assert json.loads(body) == [row.model_dump() for row in rows]
+
+
+class ListCursor:
+    """Minimal stand-in for a motor cursor: to_list(n), then async iteration over the rest"""
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+
+    async def to_list(self, length):
+        return [row for _, row in zip(range(length), self.rows)]
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self.rows)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+@pytest.mark.parametrize("size", [100, 1000, 5000])
+def test_list_response_stream(benchmark, size):
+    rows = application_models(size)
+    loop = asyncio.new_event_loop()
+
+    async def build(docs):
+        return docs
+
+    async def collect():
+        response = await server.stream_json_list(ListCursor(rows), build)
+        if not hasattr(response, "body_iterator"):
+            return response.body  # Under one chunk: plain response
+        return b"".join([chunk async for chunk in response.body_iterator])
+
+    body = benchmark(lambda: loop.run_until_complete(collect()))
+    loop.close()
+    assert json.loads(body) == [row.model_dump() for row in rows]
+
+
+# ============ PASSWORDS ============
+
+def test_verify_password(benchmark):
+    hashed = server.hash_password("Benchmark@2026!")
+    assert benchmark(server.verify_password, "Benchmark@2026!", hashed)
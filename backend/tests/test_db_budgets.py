@@ -0,0 +1,203 @@
+"""
+DB Budget / N+1 Detector Tests
+Runs the routes declared with @db_budget in-process (httpx ASGITransport) with
+DB_DEBUG=strict against a small fixture tenant, and checks that each stays
+within its budget (X-DB-Calls) and that the detector flags a repeated query
+shape, an exceeded budget and DB calls made while a streamed body is sent.
+
+Needs a reachable MongoDB (MONGO_URL / DB_NAME; defaults to a local scratch
+database). Fixture documents are removed afterwards.
+"""
+
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "makar_benchmarks")
+
+import httpx  # noqa: E402
+import jwt  # noqa: E402
+from fastapi import Request  # noqa: E402
+from fastapi.responses import StreamingResponse  # noqa: E402
+
+import server  # noqa: E402
+
+ROWS = 20  # Above DB_REPEAT_THRESHOLD, so a per-row query would be flagged
+NOW = datetime.now(timezone.utc)
+TODAY = datetime.now(server.JAKARTA_TZ).strftime("%Y-%m-%d")
+
+
+@pytest.fixture(scope="module")
+def loop():
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(asyncio.wait_for(server.db.command("ping"), 3))
+    except Exception as e:
+        loop.close()
+        pytest.skip(f"MongoDB not reachable: {e!r}")
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(scope="module")
+def tenant(loop):
+    ids = {"company": f"budget-{uuid.uuid4().hex[:8]}", "admin": f"admin_{uuid.uuid4().hex[:12]}",
+           "superadmin": str(uuid.uuid4()), "token": f"budget-test-{uuid.uuid4().hex}"}
+    loop.run_until_complete(create_tenant(ids))
+    yield ids
+    loop.run_until_complete(remove_tenant(ids))
+
+
+async def create_tenant(ids: dict):
+    db, cid, now = server.db, ids["company"], NOW.isoformat()
+    await db.companies.insert_one({"id": cid, "name": "PT Budget Test", "slug": cid, "domain": f"{cid}.makar.id",
+                                   "is_active": True, "created_at": now, "updated_at": now})
+    await db.company_admins.insert_one({"id": ids["admin"], "email": f"{cid}@example.com", "name": "Admin Budget",
+                                        "companies": [cid], "is_active": True, "created_at": now, "updated_at": now})
+    await db.superadmins.insert_one({"id": ids["superadmin"], "email": f"sa-{cid}@example.com", "name": "SA Budget"})
+    await db.user_sessions.insert_one({
+        "session_token": ids["token"], "user_id": ids["admin"], "role": "admin", "company_id": cid,
+        "name": "Admin Budget", "email": f"{cid}@example.com", "company_name": "PT Budget Test",
+        "expires_at": (NOW + timedelta(hours=1)).isoformat(),
+    })
+    jobs = [{"id": f"{cid}-job-{i}", "company_id": cid, "title": f"Job {i}", "job_type": "full_time",
+             "description": "-", "status": "published", "created_at": now, "updated_at": now} for i in range(3)]
+    await db.jobs.insert_many(jobs)
+    await db.applications.insert_many([{
+        "id": f"{cid}-app-{i}", "company_id": cid, "job_id": jobs[i % 3]["id"], "status": "pending",
+        "form_data": {"full_name": f"Pelamar {i}", "email": f"pelamar{i}@example.com"},
+        "created_at": now, "updated_at": now, "rev": 1,
+    } for i in range(ROWS)])
+    await db.employees.insert_many([{
+        "id": f"{cid}-emp-{i}", "email": f"{cid}-emp{i}@example.com", "name": f"Karyawan {i}",
+        "companies": [cid], "is_active": True, "created_at": now, "updated_at": now, "rev": 1,
+    } for i in range(ROWS)])
+    records = []
+    for i in range(ROWS):
+        record = {"id": f"{cid}-att-{i}", "company_id": cid, "employee_id": f"{cid}-emp-{i}",
+                  "employee_name": f"Karyawan {i}", "date": TODAY, "clock_in": "08:10:00",
+                  "status": "pending_approval", "employee_active": True, "employee_removed": False, "rev": 1}
+        record.update(server.attendance_derived_fields(record))
+        records.append(record)
+    await db.attendance.insert_many(records)
+
+
+async def remove_tenant(ids: dict):
+    db, cid = server.db, ids["company"]
+    for collection in ("jobs", "applications", "attendance", "user_sessions", "config_versions"):
+        await db[collection].delete_many({"company_id": cid})
+    await db.employees.delete_many({"companies": cid})
+    await db.company_admins.delete_many({"id": ids["admin"]})
+    await db.superadmins.delete_many({"id": ids["superadmin"]})
+    await db.companies.delete_many({"id": cid})
+
+
+@pytest.fixture
+def strict(monkeypatch):
+    monkeypatch.setattr(server, "DB_DEBUG", "strict")
+
+
+async def call(method: str, path: str, token: str, **kwargs) -> httpx.Response:
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+        return await client.request(method, path, headers={"Authorization": f"Bearer {token}"}, **kwargs)
+
+
+def budget_of(path: str, method: str = "GET") -> int:
+    route = next(r for r in server.app.routes if getattr(r, "path", None) == path and method in r.methods)
+    return route.endpoint.db_budget
+
+
+# ============ BUDGETED ROUTES ============
+
+@pytest.mark.parametrize("path", [
+    "/api/employees-session",
+    "/api/applications-session",
+    "/api/attendance/company",
+    "/api/attendance/pending",
+])
+def test_session_route_within_budget(loop, tenant, strict, path):
+    response = loop.run_until_complete(call("GET", path, tenant["token"]))
+    assert response.status_code == 200, response.text
+    assert len(response.json()) == ROWS
+    assert int(response.headers["x-db-calls"]) <= budget_of(path)
+
+
+def test_export_within_budget(loop, tenant, strict):
+    ids = [f"{tenant['company']}-app-{i}" for i in range(ROWS)]
+    response = loop.run_until_complete(call("POST", "/api/applications-session/export", tenant["token"],
+                                            json={"application_ids": ids}))
+    assert response.status_code == 200, response.text
+    assert int(response.headers["x-db-calls"]) <= budget_of("/api/applications-session/export", "POST")
+
+
+def test_users_within_budget(loop, tenant, strict):
+    token = jwt.encode({"user_id": tenant["superadmin"], "role": "super_admin",
+                        "exp": NOW + timedelta(hours=1)}, server.JWT_SECRET, algorithm=server.JWT_ALGORITHM)
+    response = loop.run_until_complete(call("GET", "/api/users", token))
+    assert response.status_code == 200, response.text
+    assert int(response.headers["x-db-calls"]) <= budget_of("/api/users")
+
+
+# ============ DETECTOR ============
+
+@pytest.fixture(scope="module")
+def probe_routes():
+    """Deliberately bad routes, registered only for this module"""
+    async def n_plus_one(request: Request):
+        session = await server.require_session_admin(request)
+        for i in range(ROWS):
+            await server.db.employees.find_one({"id": f"{session['company_id']}-emp-{i}"}, {"_id": 0, "id": 1})
+        return {"ok": True}
+
+    @server.db_budget(3)
+    async def streamed(request: Request):
+        await server.require_session_admin(request)
+
+        async def body():
+            yield b"["
+            for i in range(4):
+                await server.db.jobs.find_one({"id": f"missing-{i}"})
+                yield b"0," if i < 3 else b"0"
+            yield b"]"
+        return StreamingResponse(body(), media_type="application/json")
+
+    server.app.add_api_route("/test-budget/n-plus-one", n_plus_one)
+    server.app.add_api_route("/test-budget/streamed", streamed)
+    yield
+    server.app.router.routes[:] = [r for r in server.app.router.routes
+                                   if not getattr(r, "path", "").startswith("/test-budget/")]
+
+
+def test_repeated_shape_is_flagged(loop, tenant, strict, probe_routes):
+    response = loop.run_until_complete(call("GET", "/test-budget/n-plus-one", tenant["token"]))
+    assert response.status_code == 500
+    violations = response.json()["violations"]
+    assert any(v.startswith(f"find employees x{ROWS}") for v in violations), violations
+
+
+def error_messages(exc: BaseException) -> list:
+    """Messages of an exception and, for exception groups, everything nested in it"""
+    nested = getattr(exc, "exceptions", None)
+    return [m for e in nested for m in error_messages(e)] if nested else [str(exc)]
+
+
+def test_streamed_body_calls_are_counted(loop, tenant, strict, probe_routes):
+    # The status is already sent, so strict mode aborts the stream instead of returning 500
+    with pytest.raises(Exception) as info:
+        loop.run_until_complete(call("GET", "/test-budget/streamed", tenant["token"]))
+    assert any("while streaming" in m for m in error_messages(info.value)), error_messages(info.value)
+
+
+def test_violations_from_context():
+    route = type("Route", (), {"endpoint": server.db_budget(2)(lambda: None)})()
+    ctx = {"scope": {"route": route}, "shapes": {("find", "jobs", "{}"): 1, ("count", "applications", "{}"): 1}}
+    assert server.db_violations(ctx) == []
+    ctx["shapes"][("count", "applications", "{}")] = server.DB_REPEAT_THRESHOLD + 1
+    violations = server.db_violations(ctx)
+    assert violations[0].startswith(f"count applications x{server.DB_REPEAT_THRESHOLD + 1}")
+    assert violations[-1] == f"{server.DB_REPEAT_THRESHOLD + 2} DB calls, budget 2"
@@ -19,7 +19,7 @@ import {
   TableHeader,
   TableRow,
 } from '../ui/table';
-import { Search, FileText, RefreshCw, ChevronLeft, ChevronRight } from 'lucide-react';
+import { Search, FileText, RefreshCw, ChevronLeft, ChevronRight, Download } from 'lucide-react';
 import { Avatar, AvatarFallback } from '../ui/avatar';
 
 const API = `${process.env.REACT_APP_BACKEND_URL || ''}/api`;
@@ -53,6 +53,7 @@ const ITEMS_PER_PAGE = 50;
 export const ActivityLogTab = ({ language }) => {
   const [logs, setLogs] = useState([]);
   const [total, setTotal] = useState(0);
+  const [totalCapped, setTotalCapped] = useState(false);
   const [loading, setLoading] = useState(true);
   const [refreshing, setRefreshing] = useState(false);
 
@@ -62,6 +63,8 @@ export const ActivityLogTab = ({ language }) => {
   const [startDate, setStartDate] = useState('');
   const [endDate, setEndDate] = useState('');
   const [currentPage, setCurrentPage] = useState(1);
+  // cursors[i] fetches page i + 1; the server pages by (timestamp, id), not skip
+  const [cursors, setCursors] = useState([null]);
 
   const fetchLogs = useCallback(async (page = currentPage) => {
     try {
@@ -71,21 +74,30 @@ export const ActivityLogTab = ({ language }) => {
       if (searchTerm) params.append('search', searchTerm);
       if (startDate) params.append('start_date', startDate);
       if (endDate) params.append('end_date', endDate);
-      params.append('skip', String((page - 1) * ITEMS_PER_PAGE));
+      const cursor = page > 1 ? cursors[page - 1] : null;
+      if (cursor) params.append('cursor', cursor);
       params.append('limit', String(ITEMS_PER_PAGE));
 
       const response = await axios.get(`${API}/logs/me?${params.toString()}`, {
         withCredentials: true,
       });
       setLogs(response.data.logs);
-      setTotal(response.data.total);
+      if (!cursor) {
+        setTotal(response.data.total);
+        setTotalCapped(response.data.total_capped);
+      }
+      setCursors((prev) => {
+        const next = prev.slice(0, page);
+        next[page] = response.data.next_cursor;
+        return next;
+      });
     } catch (error) {
       console.error('Failed to fetch logs:', error);
     } finally {
       setLoading(false);
       setRefreshing(false);
     }
-  }, [filterAction, filterResource, searchTerm, startDate, endDate, currentPage]);
+  }, [filterAction, filterResource, searchTerm, startDate, endDate, currentPage, cursors]);
 
   useEffect(() => {
     fetchLogs(1);
@@ -106,6 +118,17 @@ export const ActivityLogTab = ({ language }) => {
     fetchLogs(currentPage);
   };
 
+  // Plain navigation so the browser streams the file to disk instead of buffering a blob
+  const handleExport = () => {
+    const params = new URLSearchParams({ format: 'csv' });
+    if (filterAction !== 'all') params.append('action', filterAction);
+    if (filterResource !== 'all') params.append('resource_type', filterResource);
+    if (searchTerm) params.append('search', searchTerm);
+    if (startDate) params.append('start_date', startDate);
+    if (endDate) params.append('end_date', endDate);
+    window.location.href = `${API}/logs/me/export?${params.toString()}`;
+  };
+
   const handleResetFilters = () => {
     setSearchTerm('');
     setFilterAction('all');
@@ -116,6 +139,8 @@ export const ActivityLogTab = ({ language }) => {
   };
 
   const totalPages = Math.ceil(total / ITEMS_PER_PAGE);
+  const totalLabel = totalCapped ? `${total}+` : total;
+  const hasNextPage = Boolean(cursors[currentPage]);
 
   const formatTime = (timestamp) => {
     const date = new Date(timestamp);
@@ -131,18 +156,6 @@ export const ActivityLogTab = ({ language }) => {
   const getInitials = (name) =>
     name?.split(' ').map((n) => n[0]).join('').toUpperCase().slice(0, 2) || 'U';
 
-  const getPageNumbers = () => {
-    const pages = [];
-    const maxVisible = 5;
-    let start = Math.max(1, currentPage - Math.floor(maxVisible / 2));
-    let end = Math.min(totalPages, start + maxVisible - 1);
-    if (end - start + 1 < maxVisible) {
-      start = Math.max(1, end - maxVisible + 1);
-    }
-    for (let i = start; i <= end; i++) pages.push(i);
-    return pages;
-  };
-
   return (
     <div className="space-y-4" data-testid="activity-log-tab">
       {/* Filters */}
@@ -168,6 +181,10 @@ export const ActivityLogTab = ({ language }) => {
             <RefreshCw className={`w-4 h-4 mr-2 ${refreshing ? 'animate-spin' : ''}`} />
             Refresh
           </Button>
+          <Button variant="outline" onClick={handleExport} data-testid="log-export-btn">
+            <Download className="w-4 h-4 mr-2" />
+            Export CSV
+          </Button>
         </div>
 
         {/* Filter row */}
@@ -229,7 +246,7 @@ export const ActivityLogTab = ({ language }) => {
           </Button>
 
           <div className="ml-auto text-sm text-gray-500 self-center">
-            {total} log ditemukan
+            {totalLabel} log ditemukan
           </div>
         </div>
       </div>
@@ -298,10 +315,10 @@ export const ActivityLogTab = ({ language }) => {
           )}
 
           {/* Pagination */}
-          {total > ITEMS_PER_PAGE && (
+          {(currentPage > 1 || hasNextPage) && (
             <div className="flex items-center justify-between px-6 py-4 border-t" data-testid="log-pagination">
               <div className="text-sm text-gray-600">
-                Halaman {currentPage} dari {totalPages} ({total} data)
+                Halaman {currentPage} dari {totalCapped ? `${totalPages}+` : totalPages} ({totalLabel} data)
               </div>
               <div className="flex gap-2">
                 <Button
@@ -315,25 +332,11 @@ export const ActivityLogTab = ({ language }) => {
                   Sebelumnya
                 </Button>
 
-                <div className="flex gap-1">
-                  {getPageNumbers().map((num) => (
-                    <Button
-                      key={num}
-                      variant={currentPage === num ? 'default' : 'outline'}
-                      size="sm"
-                      onClick={() => setCurrentPage(num)}
-                      className={currentPage === num ? 'bg-[#2E4DA7] hover:bg-[#2E4DA7]/90' : ''}
-                    >
-                      {num}
-                    </Button>
-                  ))}
-                </div>
-
                 <Button
                   variant="outline"
                   size="sm"
-                  onClick={() => setCurrentPage((p) => Math.min(totalPages, p + 1))}
-                  disabled={currentPage === totalPages}
+                  onClick={() => setCurrentPage((p) => p + 1)}
+                  disabled={!hasNextPage}
                   data-testid="log-next-page"
                 >
                   Selanjutnya
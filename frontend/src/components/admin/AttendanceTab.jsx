@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import axios from 'axios';
 import { Card, CardContent, CardHeader, CardTitle, CardDescription } from '../ui/card';
 import { Button } from '../ui/button';
@@ -14,6 +14,7 @@ import { CalendarClock, Settings, Check, X, Clock, Plus, Trash2, Shield, UserChe
 import { Dialog, DialogContent } from '../ui/dialog';
 import { toast } from 'sonner';
 import { RefreshControl } from '../RefreshControl';
+import { useCompanyEvents } from '../../hooks/use-company-events';
 
 const API = `${process.env.REACT_APP_BACKEND_URL || ''}/api`;
 
@@ -116,6 +117,25 @@ export const AttendanceTab = ({ language }) => {
     finally { setLoading(false); }
   };
 
+  // Live updates: refetch only the attendance lists, batched over a short window
+  const liveTimerRef = useRef(null);
+  const fetchLive = () => {
+    clearTimeout(liveTimerRef.current);
+    liveTimerRef.current = setTimeout(async () => {
+      fetchByDate(filterDate);
+      try {
+        const res = await axios.get(`${API}/attendance/pending`, { withCredentials: true });
+        setPendingRecords(res.data);
+      } catch (e) { console.error(e); }
+    }, 1000);
+  };
+  useEffect(() => () => clearTimeout(liveTimerRef.current), []);
+  useCompanyEvents({
+    'attendance.clock': fetchLive,
+    'attendance.approval': fetchLive,
+    resync: fetchLive,
+  });
+
   // Build lookups
   const empLookup = {};
   employees.forEach(e => { empLookup[e.id] = e; });
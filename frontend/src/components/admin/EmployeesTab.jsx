@@ -80,7 +80,7 @@ export const EmployeesTab = ({ language }) => {
         bank_holder: emp.bank_holder || '',
         emergency_contact: emp.emergency_contact || '', emergency_phone: emp.emergency_phone || '',
         salary: emp.salary || '', employment_type: emp.employment_type || '',
-        outlet_id: emp.outlet_id || '', division_id: emp.division_id || '', allow_outside_network: emp.allow_outside_network ?? null
+        outlet_id: emp.outlet_id || '', outlet_ids: emp.outlet_ids || [], division_id: emp.division_id || '', allow_outside_network: emp.allow_outside_network ?? null
       });
     } else {
       setSelectedEmp(null);
@@ -90,7 +90,7 @@ export const EmployeesTab = ({ language }) => {
         id_number: '', education: '', major: '', province: '', city: '', district: '',
         village: '', full_address: '', bank_name: '', bank_account: '', bank_holder: '',
         emergency_contact: '', emergency_phone: '', salary: '', employment_type: '',
-        outlet_id: '', division_id: '', allow_outside_network: null
+        outlet_id: '', outlet_ids: [], division_id: '', allow_outside_network: null
       });
     }
     setIsFormOpen(true);
@@ -712,6 +712,23 @@ export const EmployeesTab = ({ language }) => {
                     </select>
                   </div>
                 </div>
+                {outlets.filter(o => o.is_active && o.id !== form.outlet_id).length > 0 && (
+                  <div className="grid gap-1.5">
+                    <Label className="text-xs">Outlet Tambahan (boleh absen di sini juga)</Label>
+                    <div className="flex flex-wrap gap-1.5">
+                      {outlets.filter(o => o.is_active && o.id !== form.outlet_id).map(o => {
+                        const selected = (form.outlet_ids || []).includes(o.id);
+                        return (
+                          <button key={o.id} type="button"
+                            onClick={() => setForm({ ...form, outlet_ids: selected ? form.outlet_ids.filter(id => id !== o.id) : [...(form.outlet_ids || []), o.id] })}
+                            className={`text-xs px-2 py-1 rounded border ${selected ? 'bg-blue-50 border-blue-300 text-blue-700' : 'bg-white border-gray-200 text-gray-500'}`}>
+                            {o.name}
+                          </button>
+                        );
+                      })}
+                    </div>
+                  </div>
+                )}
                 <div className="grid sm:grid-cols-2 gap-3">
                   <div className="grid gap-1.5"><Label className="text-xs">Posisi/Jabatan *</Label><Input value={form.position} onChange={(e) => setForm({ ...form, position: e.target.value })} /></div>
                   <div className="grid gap-1.5"><Label className="text-xs">Departemen</Label><Input value={form.department} onChange={(e) => setForm({ ...form, department: e.target.value })} /></div>
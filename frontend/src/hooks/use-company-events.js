@@ -0,0 +1,31 @@
+import { useEffect, useRef } from 'react';
+
+const API = `${process.env.REACT_APP_BACKEND_URL || ''}/api`;
+
+// Subscribe to the company's server-sent event stream (/api/events/stream).
+// `handlers` maps an event type ('attendance.clock', 'application.status', ...)
+// to a callback receiving the parsed payload. `resync` is called after a
+// reconnect and when the server dropped events for a slow connection.
+export function useCompanyEvents(handlers, enabled = true) {
+  const handlersRef = useRef(handlers);
+  handlersRef.current = handlers;
+
+  useEffect(() => {
+    if (!enabled || typeof EventSource === 'undefined') return undefined;
+    const source = new EventSource(`${API}/events/stream`, { withCredentials: true });
+    let connectedBefore = false;
+
+    Object.keys(handlersRef.current).forEach((type) => {
+      source.addEventListener(type, (e) => {
+        const handler = handlersRef.current[type];
+        if (handler) handler(e.data ? JSON.parse(e.data) : {});
+      });
+    });
+    source.onopen = () => {
+      if (connectedBefore) handlersRef.current.resync?.({});
+      connectedBefore = true;
+    };
+
+    return () => source.close();
+  }, [enabled]);
+}
@@ -14,6 +14,7 @@ import {
 import { Avatar, AvatarFallback } from '../components/ui/avatar';
 import { Toaster, toast } from 'sonner';
 import { RefreshControl } from '../components/RefreshControl';
+import { useCompanyEvents } from '../hooks/use-company-events';
 
 import { OverviewTab } from '../components/admin/OverviewTab';
 import { JobsTab } from '../components/admin/JobsTab';
@@ -173,6 +174,13 @@ export const AdminDashboard = () => {
     } finally { setLoading(false); }
   };
 
+  // Live application updates pushed by the server
+  useCompanyEvents({
+    'application.created': () => fetchData(),
+    'application.status': (d) => setApplications(prev => prev.map(a => a.id === d.id ? { ...a, status: d.status } : a)),
+    resync: () => fetchData(),
+  }, !authLoading);
+
   const handleLogout = async () => {
     try { await axios.post(`${API}/auth/logout`, {}, { withCredentials: true }); }
     finally { navigate('/company-login'); }
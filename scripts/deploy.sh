@@ -13,28 +13,32 @@ echo "========================================="
 PROJECT_DIR="$(cd "$(dirname "$0")/.." && pwd)"
 cd "$PROJECT_DIR"
 
-echo "[1/6] Pulling latest code..."
+echo "[1/7] Pulling latest code..."
 git pull
 
-echo "[2/6] Installing backend dependencies..."
+echo "[2/7] Installing backend dependencies..."
 cd "$PROJECT_DIR/backend"
 if [ -d "venv" ]; then
     source venv/bin/activate
 fi
 pip install -r requirements.txt -q 2>/dev/null || pip3 install -r requirements.txt -q
 
-echo "[3/6] Building frontend..."
+echo "[3/7] Migrating attendance data..."
+# Attendance views filter on fields this backfill adds; finish it before the new code serves
+python3 migrate_attendance.py
+
+echo "[4/7] Building frontend..."
 cd "$PROJECT_DIR/frontend"
 yarn install --silent 2>/dev/null
 yarn build
 
-echo "[4/6] Deploying frontend..."
+echo "[5/7] Deploying frontend..."
 if [ -d "/var/www/makar" ]; then
     cp -r build/* /var/www/makar/
     echo "  Copied to /var/www/makar/"
 fi
 
-echo "[5/6] Updating Nginx config..."
+echo "[6/7] Updating Nginx config..."
 NGINX_CONF_SRC="$PROJECT_DIR/nginx/makar.id.conf"
 NGINX_CONF_DST=""
 
@@ -84,10 +88,26 @@ else
     echo "  sudo nginx -t && sudo systemctl reload nginx"
 fi
 
-echo "[6/6] Restarting backend..."
+echo "[7/7] Restarting backend..."
 if systemctl is-active --quiet makar 2>/dev/null; then
     systemctl restart makar
     echo "  Backend restarted"
+
+    # Wait until the worker reports ready (Mongo reachable, loop not stalled, disk free)
+    READY_URL="http://127.0.0.1:8001/api/health/ready"
+    for i in $(seq 1 30); do
+        if curl -fsS -o /dev/null "$READY_URL" 2>/dev/null; then
+            echo "  Backend ready"
+            break
+        fi
+        if [ "$i" -eq 30 ]; then
+            echo "  ERROR: Backend not ready after 60s. Readiness report:"
+            curl -sS "$READY_URL" || true
+            echo ""
+            exit 1
+        fi
+        sleep 2
+    done
 fi
 
 echo ""